@@ -0,0 +1,208 @@
+import datetime
+import hashlib
+import struct
+import tarfile
+import zlib
+from typing import BinaryIO, Callable, Dict, Iterator, List, NamedTuple, Optional
+
+CHUNK_SIZE = 1024 * 1024
+
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP_FLAGS = 0x08 | 0x800  # sizes and CRC-32 in a data descriptor after the content, UTF-8 names
+ZIP_VERSION = 20
+ZIP64_VERSION = 45
+# made on unix, so the external attributes carry the file mode
+ZIP_MADE_BY = 3 << 8
+ZIP_FILE_MODE = 0o100644 << 16
+
+TAR_BLOCK_SIZE = tarfile.BLOCKSIZE
+
+
+class ArchiveEntry(NamedTuple):
+    path: str
+    digest: str
+    size: int
+    modified: datetime.datetime
+
+
+class Segment(NamedTuple):
+    length: int
+    # bytes known up front, or None for file content and for zip records that need the CRC-32 of earlier files
+    data: Optional[bytes]
+    # the entry whose content this segment is, for file content
+    entry: Optional[int] = None
+    # builds the bytes from the CRC-32 of the entries
+    render: Optional[Callable[[Dict[int, int]], bytes]] = None
+
+
+def dos_date_time(value: datetime.datetime):
+    value = max(value, datetime.datetime(1980, 1, 1, tzinfo=value.tzinfo))
+    return ((value.year - 1980) << 9 | value.month << 5 | value.day,
+            value.hour << 11 | value.minute << 5 | value.second // 2)
+
+
+class Archive:
+    """
+    A zip or tar of stored files, laid out from their manifest alone. Every size and offset is known before any
+    content is read, so the archive has a Content-Length and an ETag, and a byte range of it is produced by
+    reading only the files it covers: downloads resume where they stopped.
+
+    Zip entries are STORED, as model weights do not compress, which is also what keeps the layout known in
+    advance; the CRC-32 of every file goes in a data descriptor after it and in the central directory, so
+    resuming a zip past a file reads that file again to compute it. Tar needs no checksum of the content.
+    """
+
+    def __init__(self, root: str, entries: List[ArchiveEntry], archive_format: str,
+                 open_entry: Callable[[ArchiveEntry, int], BinaryIO]):
+        self.root = root
+        self.entries = entries
+        self.format = archive_format
+        self.open_entry = open_entry
+        self.segments = self._zip_segments() if archive_format == "zip" else self._tar_segments()
+        self.size = sum(segment.length for segment in self.segments)
+
+    @property
+    def etag(self) -> str:
+        # the bytes only depend on the manifest, so this is a strong validator
+        hasher = hashlib.sha256(f"{self.format}|{self.root}".encode("utf-8"))
+        for entry in self.entries:
+            hasher.update(f"|{entry.path}|{entry.digest}|{entry.size}|{entry.modified.timestamp()}".encode("utf-8"))
+        return f'"{hasher.hexdigest()}"'
+
+    def name(self, entry: ArchiveEntry) -> str:
+        return f"{self.root}/{entry.path}"
+
+    def _tar_segments(self) -> List[Segment]:
+        segments = []
+        for index, entry in enumerate(self.entries):
+            info = tarfile.TarInfo(self.name(entry))
+            info.size = entry.size
+            info.mtime = int(entry.modified.timestamp())
+            info.mode = 0o644
+            header = info.tobuf(format=tarfile.PAX_FORMAT, encoding="utf-8", errors="surrogateescape")
+            segments.append(Segment(len(header), header))
+            segments.append(Segment(entry.size, None, index))
+            padding = -entry.size % TAR_BLOCK_SIZE
+            if padding:
+                segments.append(Segment(padding, bytes(padding)))
+        segments.append(Segment(2 * TAR_BLOCK_SIZE, bytes(2 * TAR_BLOCK_SIZE)))
+        return segments
+
+    def _zip_segments(self) -> List[Segment]:
+        segments, offsets = [], []
+        offset = 0
+        for index, entry in enumerate(self.entries):
+            offsets.append(offset)
+            header = self._zip_local_header(entry)
+            descriptor_length = 24 if entry.size >= ZIP64_LIMIT else 16
+            segments.append(Segment(len(header), header))
+            segments.append(Segment(entry.size, None, index))
+            segments.append(Segment(descriptor_length, None,
+                                    render=lambda crcs, index=index: self._zip_descriptor(index, crcs[index])))
+            offset += len(header) + entry.size + descriptor_length
+
+        def render_central_directory(crcs: Dict[int, int]) -> bytes:
+            return self._zip_central_directory(offsets, offset, crcs)
+
+        length = len(render_central_directory({index: 0 for index in range(len(self.entries))}))
+        segments.append(Segment(length, None, render=render_central_directory))
+        return segments
+
+    def _zip_local_header(self, entry: ArchiveEntry) -> bytes:
+        name = self.name(entry).encode("utf-8")
+        date, time = dos_date_time(entry.modified)
+        if entry.size >= ZIP64_LIMIT:
+            extra = struct.pack("<HHQQ", 0x0001, 16, entry.size, entry.size)
+            size, version = ZIP64_LIMIT, ZIP64_VERSION
+        else:
+            extra, size, version = b"", entry.size, ZIP_VERSION
+        return struct.pack("<4sHHHHHLLLHH", b"PK\x03\x04", version, ZIP_FLAGS, 0, time, date, 0, size, size,
+                           len(name), len(extra)) + name + extra
+
+    def _zip_descriptor(self, index: int, crc: int) -> bytes:
+        size = self.entries[index].size
+        if size >= ZIP64_LIMIT:
+            return struct.pack("<4sLQQ", b"PK\x07\x08", crc, size, size)
+        return struct.pack("<4sLLL", b"PK\x07\x08", crc, size, size)
+
+    def _zip_central_directory(self, offsets: List[int], start: int, crcs: Dict[int, int]) -> bytes:
+        records = []
+        for index, entry in enumerate(self.entries):
+            name = self.name(entry).encode("utf-8")
+            date, time = dos_date_time(entry.modified)
+            size, offset, fields = entry.size, offsets[index], []
+            if size >= ZIP64_LIMIT:
+                fields += [size, size]
+                size = ZIP64_LIMIT
+            if offset >= ZIP64_LIMIT:
+                fields.append(offset)
+                offset = ZIP64_LIMIT
+            extra = struct.pack(f"<HH{len(fields)}Q", 0x0001, 8 * len(fields), *fields) if fields else b""
+            version = ZIP64_VERSION if fields else ZIP_VERSION
+            records.append(struct.pack("<4sHHHHHHLLLHHHHHLL", b"PK\x01\x02", ZIP_MADE_BY | version, version,
+                                       ZIP_FLAGS, 0, time, date, crcs[index], size, size, len(name), len(extra),
+                                       0, 0, 0, ZIP_FILE_MODE, offset) + name + extra)
+
+        directory = b"".join(records)
+        count, length = len(records), len(directory)
+        end = b""
+        if count >= 0xFFFF or length >= ZIP64_LIMIT or start >= ZIP64_LIMIT:
+            end_64 = start + length
+            end += struct.pack("<4sQHHLLQQQQ", b"PK\x06\x06", 44, ZIP_MADE_BY | ZIP64_VERSION, ZIP64_VERSION, 0, 0,
+                               count, count, length, start)
+            end += struct.pack("<4sLQL", b"PK\x06\x07", 0, end_64, 1)
+            count, length, start = min(count, 0xFFFF), min(length, ZIP64_LIMIT), min(start, ZIP64_LIMIT)
+        end += struct.pack("<4sHHHHLLH", b"PK\x05\x06", 0, 0, count, count, length, start, 0)
+        return directory + end
+
+    def _read(self, entry: ArchiveEntry, start: int, end: int) -> Iterator[bytes]:
+        if end <= start:
+            return
+        source = self.open_entry(entry, start)
+        try:
+            remaining = end - start
+            while remaining > 0:
+                chunk = source.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    raise RuntimeError(f"{entry.path} is shorter than its manifest size")
+                remaining -= len(chunk)
+                yield chunk
+        finally:
+            source.close()
+
+    def iter_bytes(self, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        """
+        The bytes from start to end, inclusive, of the archive. Blocks on the storage: StreamingResponse iterates
+        it in the threadpool, one chunk at a time.
+        """
+        end = self.size - 1 if end is None else end
+        crcs: Dict[int, int] = {}
+        position = 0
+
+        for segment in self.segments:
+            segment_start, position = position, position + segment.length
+            if segment_start > end:
+                return
+            # the part of the segment in the range, relative to the segment
+            first, last = max(start - segment_start, 0), min(end + 1, position) - segment_start
+
+            if segment.entry is not None:
+                entry = self.entries[segment.entry]
+                # the data descriptor after the content is in the range, so the CRC-32 is needed
+                checksum = self.format == "zip" and end >= position
+                if first >= last and not checksum:
+                    continue
+                crc, offset = 0, 0 if checksum else first
+                for chunk in self._read(entry, offset, entry.size if checksum else last):
+                    if checksum:
+                        crc = zlib.crc32(chunk, crc)
+                    chunk_start, offset = offset, offset + len(chunk)
+                    if offset > first and chunk_start < last:
+                        yield chunk[max(first - chunk_start, 0):last - chunk_start]
+                crcs[segment.entry] = crc
+                continue
+
+            if first >= last:
+                continue
+            data = segment.data if segment.data is not None else segment.render(crcs)
+            yield data[first:last]
@@ -0,0 +1,60 @@
+import datetime
+import hashlib
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional
+
+from fastapi import Request, Response, status
+
+
+def make_etag(*parts) -> str:
+    """
+    Build a weak ETag from the values that identify a version of a resource, such as ids and update stamps,
+    so it can be computed without rendering the body.
+    """
+    data = "|".join("" if part is None else part.isoformat() if isinstance(part, datetime.datetime) else str(part)
+                    for part in parts)
+    return f'W/"{hashlib.sha1(data.encode("utf-8")).hexdigest()}"'
+
+
+def format_http_date(value: datetime.datetime) -> str:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return format_datetime(value.astimezone(datetime.timezone.utc), usegmt=True)
+
+
+def _opaque_tag(etag: str) -> str:
+    return etag[2:] if etag.startswith("W/") else etag
+
+
+def is_not_modified(request: Request, etag: str, last_modified: Optional[str] = None) -> bool:
+    """
+    Evaluate If-None-Match (weak comparison) and, only when it is absent, If-Modified-Since.
+    """
+    if_none_match = request.headers.get("if-none-match")
+
+    if if_none_match is not None:
+        if if_none_match.strip() == "*":
+            return True
+        tags = {_opaque_tag(tag.strip()) for tag in if_none_match.split(",")}
+        return _opaque_tag(etag) in tags
+
+    if_modified_since = request.headers.get("if-modified-since")
+
+    if if_modified_since is not None and last_modified is not None:
+        try:
+            return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+
+    return False
+
+
+def validator_headers(etag: str, last_modified: Optional[datetime.datetime] = None) -> dict:
+    headers = {"ETag": etag}
+    if last_modified is not None:
+        headers["Last-Modified"] = format_http_date(last_modified)
+    return headers
+
+
+def not_modified_response(headers: dict) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
@@ -19,8 +19,35 @@ class GlobalConfig(BaseConfig):
     media_path: str = os.environ.get("MEDIA_PATH")
     models_dir: str = os.environ.get('MODELS_DIR')
     models_path: str = os.environ.get("MODELS_PATH")
+    # hash prefix directory levels above every avatar and user model directory; changing it needs a migration
+    storage_fanout_levels: int = int(os.environ.get("STORAGE_FANOUT_LEVELS", 2))
+    # content-addressed blobs behind model files and avatars, relative to the storage root; with the local
+    # backend, the static directories hold hardlinks to them
+    blobs_dir: str = os.environ.get("BLOBS_DIR", "blobs/")
+    blob_gc_grace_seconds: int = int(os.environ.get("BLOB_GC_GRACE_SECONDS", 3600))
+    # "local" keeps the files under static_dir; "s3" keeps them in S3_BUCKET, which needs requirements-s3.txt
+    storage_backend: str = os.environ.get("STORAGE_BACKEND", "local")
+    # download URLs handed out for files the API does not serve itself
+    storage_url_expires: int = int(os.environ.get("STORAGE_URL_EXPIRES", 300))
+    # with the local backend, model files are handed to a front proxy with X-Accel-Redirect: <prefix><key>, e.g.
+    # "/_storage/" with nginx serving `location /_storage/ { internal; alias /home/static/; }`
+    files_accel_redirect_prefix: str = os.environ.get("FILES_ACCEL_REDIRECT_PREFIX")
+    s3_bucket: str = os.environ.get("S3_BUCKET")
+    # unset for AWS; the URL of MinIO or another S3-compatible store otherwise
+    s3_endpoint_url: str = os.environ.get("S3_ENDPOINT_URL")
+    s3_region: str = os.environ.get("S3_REGION")
+    s3_access_key_id: str = os.environ.get("S3_ACCESS_KEY_ID")
+    s3_secret_access_key: str = os.environ.get("S3_SECRET_ACCESS_KEY")
+    # public files such as avatars redirect here, e.g. a CDN in front of the bucket, instead of presigned URLs
+    s3_public_url: str = os.environ.get("S3_PUBLIC_URL")
+    s3_multipart_chunk_size: int = int(os.environ.get("S3_MULTIPART_CHUNK_SIZE", 16 * 1024 * 1024))
+    s3_max_concurrency: int = int(os.environ.get("S3_MAX_CONCURRENCY", 8))
     avatar_sizes: list = [50, 150, 300, 600, 800]
     max_avatar_size: int = 1024 * 1024 * 5
+    accounts_page_size: int = int(os.environ.get("ACCOUNTS_PAGE_SIZE", 50))
+    accounts_max_page_size: int = int(os.environ.get("ACCOUNTS_MAX_PAGE_SIZE", 200))
+    max_batch_size: int = int(os.environ.get("MAX_BATCH_SIZE", 100))
+    accounts_export_batch_size: int = int(os.environ.get("ACCOUNTS_EXPORT_BATCH_SIZE", 1000))
 
     postgres_user: str = os.environ.get("POSTGRES_USER")
     postgres_password: str = os.environ.get("POSTGRES_PASSWORD")
@@ -28,10 +55,72 @@ class GlobalConfig(BaseConfig):
     postgres_port: int = int(os.environ.get("POSTGRES_PORT"))
     postgres_db: str = os.environ.get("POSTGRES_DB")
     postgres_db_tests: str = os.environ.get("POSTGRES_DB_TESTS")
-    db_echo_log: bool = True if os.environ.get("DEBUG") == "True" else False
+    # full SQL echo is opt-in; otherwise only slow and sampled statements are logged
+    db_echo_log: bool = True if os.environ.get("DB_ECHO_LOG") == "True" else False
+    db_slow_query_threshold_ms: int = int(os.environ.get("DB_SLOW_QUERY_THRESHOLD_MS", 200))
+    db_log_sample_rate: float = float(os.environ.get("DB_LOG_SAMPLE_RATE", 0.0))
+    db_pool_size: int = int(os.environ.get("DB_POOL_SIZE", 10))
+    db_max_overflow: int = int(os.environ.get("DB_MAX_OVERFLOW", 20))
+    db_pool_timeout: int = int(os.environ.get("DB_POOL_TIMEOUT", 30))
+    db_pool_recycle: int = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+    db_pool_pre_ping: bool = os.environ.get("DB_POOL_PRE_PING", "True") == "True"
+    db_statement_cache_size: int = int(os.environ.get("DB_STATEMENT_CACHE_SIZE", 500))
+    # per-request query summary header and N+1 warnings; on by default in development
+    query_profiler_debug: bool = os.environ.get("QUERY_PROFILER_DEBUG", os.environ.get("DEBUG")) == "True"
+    query_n_plus_one_threshold: int = int(os.environ.get("QUERY_N_PLUS_ONE_THRESHOLD", 5))
+
+    # requests carrying X-Profile: <PROFILER_TOKEN> are profiled; profiling is off while the token is unset
+    profiler_token: str = os.environ.get("PROFILER_TOKEN")
+    profiler_sample_rate: float = float(os.environ.get("PROFILER_SAMPLE_RATE", 0.0))
+    profiler_interval_ms: int = int(os.environ.get("PROFILER_INTERVAL_MS", 5))
+    profiler_max_active: int = int(os.environ.get("PROFILER_MAX_ACTIVE", 2))
+    profiler_max_duration: int = int(os.environ.get("PROFILER_MAX_DURATION", 30))
+    # OpenTelemetry tracing, needs the packages from requirements-tracing.txt; the exporter is "file" or "otlp"
+    tracing_enabled: bool = os.environ.get("TRACING_ENABLED") == "True"
+    tracing_exporter: str = os.environ.get("TRACING_EXPORTER", "file")
+    tracing_file_path: str = os.environ.get("TRACING_FILE_PATH", "/tmp/traces.jsonl")
+    tracing_otlp_endpoint: str = os.environ.get("TRACING_OTLP_ENDPOINT")
+    tracing_service_name: str = os.environ.get("TRACING_SERVICE_NAME", "api_service")
+    tracing_sample_ratio: float = float(os.environ.get("TRACING_SAMPLE_RATIO", 1.0))
+
+    loop_monitor_enabled: bool = os.environ.get("LOOP_MONITOR_ENABLED", "True") == "True"
+    loop_monitor_interval_ms: int = int(os.environ.get("LOOP_MONITOR_INTERVAL_MS", 50))
+    loop_block_threshold_ms: int = int(os.environ.get("LOOP_BLOCK_THRESHOLD_MS", 100))
+    profiler_output_dir: str = os.environ.get("PROFILER_OUTPUT_DIR", "/tmp/profiles")
+    # profiles kept in PROFILER_OUTPUT_DIR, each a wall and a cpu file; the oldest are deleted past it, 0 keeps all
+    profiler_max_files: int = int(os.environ.get("PROFILER_MAX_FILES", 500))
+    # comma separated postgresql+asyncpg:// URLs of read replicas; reads go to the primary when empty
+    database_replica_urls: list = [url.strip() for url in os.environ.get("DATABASE_REPLICA_URLS", "").split(",")
+                                   if url.strip()]
+    replica_health_check_interval: int = int(os.environ.get("REPLICA_HEALTH_CHECK_INTERVAL", 5))
+    replica_health_check_timeout: int = int(os.environ.get("REPLICA_HEALTH_CHECK_TIMEOUT", 2))
 
     redis_server: str = os.environ.get("REDIS_SERVER")
     redis_port: int = int(os.environ.get("REDIS_PORT"))
+    redis_max_connections: int = int(os.environ.get("REDIS_MAX_CONNECTIONS", 100))
+
+    # threads available to run_in_threadpool and sync dependencies
+    thread_pool_size: int = int(os.environ.get("THREAD_POOL_SIZE", 40))
+
+    response_cache_enabled: bool = os.environ.get("RESPONSE_CACHE_ENABLED", "True") == "True"
+    response_cache_ttl: int = int(os.environ.get("RESPONSE_CACHE_TTL", 60))
+    response_cache_lock_timeout: int = int(os.environ.get("RESPONSE_CACHE_LOCK_TIMEOUT", 5))
+
+    # Redis Streams job queue; a worker consumes the queues in JOB_QUEUE_CONCURRENCY with queue=threads each
+    job_queue_prefix: str = os.environ.get("JOB_QUEUE_PREFIX", "jobs")
+    job_queue_concurrency: str = os.environ.get("JOB_QUEUE_CONCURRENCY", "images=2,default=2")
+    job_visibility_timeout: int = int(os.environ.get("JOB_VISIBILITY_TIMEOUT", 300))
+    job_max_attempts: int = int(os.environ.get("JOB_MAX_ATTEMPTS", 5))
+    job_retry_backoff: float = float(os.environ.get("JOB_RETRY_BACKOFF", 5))
+    job_retry_backoff_max: float = float(os.environ.get("JOB_RETRY_BACKOFF_MAX", 600))
+    job_idempotency_ttl: int = int(os.environ.get("JOB_IDEMPOTENCY_TTL", 86400))
+    job_dead_letter_maxlen: int = int(os.environ.get("JOB_DEAD_LETTER_MAXLEN", 10000))
+    job_worker_metrics_port: int = int(os.environ.get("JOB_WORKER_METRICS_PORT", 0))
+
+    scheduler_lease_seconds: int = int(os.environ.get("SCHEDULER_LEASE_SECONDS", 30))
+
+    health_check_timeout: float = float(os.environ.get("HEALTH_CHECK_TIMEOUT", 1.0))
+    health_check_cache_seconds: float = float(os.environ.get("HEALTH_CHECK_CACHE_SECONDS", 2.0))
 
     access_token_expire_minutes: str = int(os.environ.get("ACCESS_TOKEN_EXPIRE_MINUTES"))
     refresh_token_expire_minutes: str = int(os.environ.get("REFRESH_TOKEN_EXPIRE_MINUTES"))
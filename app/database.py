@@ -1,7 +1,22 @@
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+import asyncio
+import itertools
+import logging
+import time
+from typing import List, Optional
+
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker, AsyncEngine
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
 from app.config import settings
+from app.metrics import DB_POOL_CHECKOUT_WAIT, DB_POOL_CONNECTIONS_IN_USE
+from app.query_stats import install_query_stats
+from app.tracing import install_sql_tracing
+
+logger = logging.getLogger(__name__)
 
 
 Base = declarative_base()
@@ -12,15 +27,183 @@ Base = declarative_base()
 #    echo=settings.db_echo_log,
 # )
 
-async_engine = create_async_engine(
-    settings.async_database_url,
-    echo=settings.db_echo_log,
-    future=True,
-)
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """
+    Connection pool that exports how long checkouts wait and how many connections are in use.
+    """
+    pool_name = "primary"
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        finally:
+            DB_POOL_CHECKOUT_WAIT.labels(self.pool_name).observe(time.perf_counter() - start)
+        DB_POOL_CONNECTIONS_IN_USE.labels(self.pool_name).inc()
+        return connection
+
+    def _do_return_conn(self, record):
+        DB_POOL_CONNECTIONS_IN_USE.labels(self.pool_name).dec()
+        super()._do_return_conn(record)
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.pool_name = self.pool_name
+        return pool
+
+
+def create_engine(url: str, pool_name: str = "primary") -> AsyncEngine:
+    options = {}
+
+    if url.startswith("postgresql+asyncpg"):
+        options.update(
+            poolclass=InstrumentedQueuePool,
+            pool_size=settings.db_pool_size,
+            max_overflow=settings.db_max_overflow,
+            pool_timeout=settings.db_pool_timeout,
+            pool_recycle=settings.db_pool_recycle,
+            pool_pre_ping=settings.db_pool_pre_ping,
+            # prepared statements kept per connection by the asyncpg dialect
+            connect_args={"prepared_statement_cache_size": settings.db_statement_cache_size},
+        )
+
+    engine = create_async_engine(
+        url,
+        echo=settings.db_echo_log,
+        future=True,
+        **options,
+    )
+
+    if isinstance(engine.pool, InstrumentedQueuePool):
+        engine.pool.pool_name = pool_name
+
+    install_query_stats(engine.sync_engine, pool_name)
+    install_sql_tracing(engine.sync_engine)
+    return engine
+
+
+async_engine = create_engine(settings.async_database_url)
+
+
+class ReplicaPool:
+    """
+    Read replicas handed out round-robin. A background task pings every replica and takes the ones that fail out
+    of rotation until they answer again.
+    """
+
+    def __init__(self, urls: List[str]):
+        self.engines = [create_engine(url, pool_name=f"replica{index}") for index, url in enumerate(urls)]
+        self.autocommit_engines = {
+            engine: engine.execution_options(isolation_level="AUTOCOMMIT") for engine in self.engines
+        }
+        self.healthy = list(self.engines)
+        self._counter = itertools.count()
+        self._health_check_task: Optional[asyncio.Task] = None
+
+    def choose(self, autocommit: bool = False) -> Optional[AsyncEngine]:
+        healthy = self.healthy
+        if not healthy:
+            return None
+        engine = healthy[next(self._counter) % len(healthy)]
+        return self.autocommit_engines[engine] if autocommit else engine
+
+    def in_rotation(self, engine: AsyncEngine) -> bool:
+        """
+        Whether engine, as returned by choose, is still healthy.
+        """
+        return any(engine is healthy or engine is self.autocommit_engines[healthy] for healthy in self.healthy)
+
+    async def _is_healthy(self, engine: AsyncEngine) -> bool:
+        try:
+            async with engine.connect() as conn:
+                await asyncio.wait_for(conn.execute(text("SELECT 1")), settings.replica_health_check_timeout)
+            return True
+        except Exception as e:
+            logger.warning("Read replica %s failed its health check: %s", engine.url.render_as_string(), e)
+            return False
+
+    async def check(self) -> None:
+        results = await asyncio.gather(*(self._is_healthy(engine) for engine in self.engines))
+        self.healthy = [engine for engine, healthy in zip(self.engines, results) if healthy]
+
+    async def _run_health_checks(self) -> None:
+        while True:
+            await self.check()
+            await asyncio.sleep(settings.replica_health_check_interval)
+
+    def start_health_checks(self) -> None:
+        if self.engines and self._health_check_task is None:
+            self._health_check_task = asyncio.create_task(self._run_health_checks())
+
+    async def close(self) -> None:
+        if self._health_check_task is not None:
+            self._health_check_task.cancel()
+            await asyncio.gather(self._health_check_task, return_exceptions=True)
+            self._health_check_task = None
+        for engine in self.engines:
+            await engine.dispose()
+
+
+replica_pool = ReplicaPool(settings.database_replica_urls)
+
+
+class AppSession(Session):
+    """
+    Session that remembers whether the current transaction wrote anything, so request-scoped sessions only
+    commit when there is something to commit.
+
+    Sessions opened with info={"read_only": True} send their statements to a healthy read replica, until they
+    write: from then on everything goes to the primary so the request reads its own writes. The replica is chosen
+    once per session, so the reads of a request all see the same replica; when it is taken out of rotation, the
+    rest of the session reads from the primary.
+    """
+
+    @property
+    def has_writes(self) -> bool:
+        return bool(self.new or self.dirty or self.deleted or self.info.get("has_writes"))
+
+    def get_bind(self, mapper=None, clause=None, **kw) -> Engine:
+        if self.info.get("read_only") and not self._flushing and not self.has_writes:
+            if "replica" not in self.info:
+                # follow the transaction mode of the session's own bind, as server-side cursors need a transaction
+                autocommit = self.bind is not None and \
+                    self.bind.get_execution_options().get("isolation_level") == "AUTOCOMMIT"
+                self.info["replica"] = replica_pool.choose(autocommit)
+            replica = self.info["replica"]
+            if replica is not None and replica_pool.in_rotation(replica):
+                return replica.sync_engine
+            self.info["replica"] = None
+        return super().get_bind(mapper, clause=clause, **kw)
+
+
+@event.listens_for(AppSession, "after_flush")
+def _mark_flush_as_write(session, flush_context):
+    session.info["has_writes"] = True
+
+
+@event.listens_for(AppSession, "do_orm_execute")
+def _mark_dml_as_write(orm_execute_state):
+    if not orm_execute_state.is_select:
+        orm_execute_state.session.info["has_writes"] = True
+
+
+@event.listens_for(AppSession, "after_commit")
+@event.listens_for(AppSession, "after_rollback")
+def _reset_writes(session):
+    # a read-only session that wrote keeps reading from the primary for the rest of the request
+    if session.info.pop("has_writes", None) and session.info.get("read_only"):
+        session.info["read_only"] = False
+
 
 # sync_session = sessionmaker(engine, autocommit=False, autoflush=False)
 
-async_session = async_sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False)
+async_session = async_sessionmaker(async_engine, class_=AsyncSession, sync_session_class=AppSession,
+                                   expire_on_commit=False)
+
+# Sessions for safe methods run in autocommit mode, so reads do not pay for BEGIN and COMMIT/ROLLBACK round trips.
+read_only_async_session = async_sessionmaker(async_engine.execution_options(isolation_level="AUTOCOMMIT"),
+                                             class_=AsyncSession, sync_session_class=AppSession,
+                                             expire_on_commit=False, info={"read_only": True})
 
 
 async def create_db_and_tables() -> None:
@@ -1,19 +1,33 @@
-from fastapi import Depends
+import time
+
+from fastapi import Depends, Request
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.config import settings
-from app.database import async_session
-from redis import Redis
+from app.database import async_session, read_only_async_session
+from app.jobs import tasks  # noqa: F401, registers the jobs enqueued by the API
+from app.jobs.queue import JobQueue
+from app.metrics import REDIS_COMMAND_DURATION
+from app.response_cache import ResponseCache
+from app.tracing import span
+from redis import ConnectionPool, Redis
+from redis.client import Pipeline
+
+
+SAFE_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
 
 
 # Define an asynchronous session dependency factory
-async def create_async_database_session() -> AsyncSession:
+async def create_async_database_session(request: Request) -> AsyncSession:
     """
-    Create an asynchronous database session using async_session() and yield it.
-    This allows database transactions to be managed within FastAPI route dependencies.
+    Create an asynchronous database session and yield it.
+    Safe methods get an autocommit session for reads; the session is only committed when it holds changes.
     """
-    async with async_session() as session:
+    session_factory = read_only_async_session if request.method in SAFE_METHODS else async_session
+
+    async with session_factory() as session:
         yield session  # Yield the session to make it available for use within dependencies
-        await session.commit()  # Commit any changes made within the session
+        if session.sync_session.has_writes:
+            await session.commit()  # Commit any changes made within the session
 
 
 # Define a factory function for creating an AuthService dependency
@@ -55,12 +69,94 @@ def get_models_service(models_service_instance):
     return models_service_dependency
 
 
+def get_blobs_service(blobs_service_instance):
+    """
+    Create a BlobsService dependency that receives the asynchronous database session of the request, so blob
+    references are committed together with the rows pointing at them.
+    """
+
+    def blobs_service_dependency(session: AsyncSession = Depends(create_async_database_session)):
+        return blobs_service_instance(session)
+
+    return blobs_service_dependency
+
+
+class InstrumentedPipeline(Pipeline):
+    """
+    Pipeline whose round trip is recorded as a single PIPELINE command.
+    """
+
+    def execute(self, raise_on_error=True):
+        start = time.perf_counter()
+        try:
+            with span("redis PIPELINE", {"db.system": "redis", "db.redis.commands": len(self.command_stack)}):
+                return super().execute(raise_on_error)
+        finally:
+            REDIS_COMMAND_DURATION.labels("PIPELINE").observe(time.perf_counter() - start)
+
+
+class InstrumentedRedis(Redis):
+    """
+    Redis client that records the latency of every command, and a span per command while tracing is on.
+    """
+
+    def execute_command(self, *args, **options):
+        command = str(args[0]).upper()
+        start = time.perf_counter()
+        try:
+            with span(f"redis {command}", {"db.system": "redis"}):
+                return super().execute_command(*args, **options)
+        finally:
+            REDIS_COMMAND_DURATION.labels(command).observe(time.perf_counter() - start)
+
+    def pipeline(self, transaction=True, shard_hint=None) -> InstrumentedPipeline:
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+redis_pool = None
+
+
+def get_redis_pool() -> ConnectionPool:
+    """
+    Connection pool shared by every client returned from cache(), created on first use.
+    """
+    global redis_pool
+
+    if redis_pool is None:
+        redis_pool = ConnectionPool(
+            host=settings.redis_server,
+            port=settings.redis_port,
+            encoding="utf-8",
+            max_connections=settings.redis_max_connections,
+        )
+    return redis_pool
+
+
+def close_redis_pool() -> None:
+    global redis_pool
+
+    if redis_pool is not None:
+        redis_pool.disconnect()
+        redis_pool = None
+
+
 def cache():
     """
-    Create a Redis connection using settings from the application configuration.
+    Create a Redis client using settings from the application configuration. Clients are cheap: they borrow
+    connections from the shared pool instead of opening their own.
+    """
+    return InstrumentedRedis(connection_pool=get_redis_pool())
+
+
+def get_response_cache():
+    """
+    Create a ResponseCache backed by the Redis connection from cache().
+    """
+    return ResponseCache(cache())
+
+
+def get_job_queue():
+    """
+    Create a JobQueue backed by the Redis connection from cache().
     """
-    return Redis(
-        host=settings.redis_server,
-        port=settings.redis_port,
-        charset="utf-8",
-    )
+    return JobQueue(cache())
@@ -0,0 +1,13 @@
+from fastapi import HTTPException
+
+
+class InvalidCursorException(HTTPException):
+    pass
+
+
+class ProfileNotFoundException(HTTPException):
+    pass
+
+
+class RangeNotSatisfiableException(HTTPException):
+    pass
@@ -0,0 +1,123 @@
+import os
+from typing import Mapping, Optional, Tuple
+from urllib.parse import quote
+
+import anyio
+from fastapi import Request, status
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+from app.exceptions import RangeNotSatisfiableException
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def content_disposition(filename: str) -> str:
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+
+def parse_range(value: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    The first and last byte of a Range header asking for a single range, or None for headers to ignore: other
+    units, malformed values, and multiple ranges, which are served in full rather than as multipart/byteranges.
+    Parallel downloads ask for one range per request. Raises RangeNotSatisfiableException for ranges past the end.
+    """
+    unit, _, ranges = value.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        return None
+
+    first, dash, last = ranges.strip().partition("-")
+    if not dash:
+        return None
+    try:
+        if not first:
+            # the last n bytes
+            length = int(last)
+            start, end = (max(size - length, 0) if length > 0 else size), None
+        else:
+            start, end = int(first), int(last) if last else None
+    except ValueError:
+        return None
+
+    if end is not None and end < start:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiableException(status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                                           detail="Range not satisfiable",
+                                           headers={"Content-Range": f"bytes */{size}"})
+    return start, size - 1 if end is None else min(end, size - 1)
+
+
+def requested_range(request: Request, size: int, etag: str,
+                    last_modified: Optional[str] = None) -> Optional[Tuple[int, int]]:
+    """
+    The byte range to serve for the Range header of request, honouring If-Range: a range is only served when the
+    client's copy is the current one, compared strongly by ETag or exactly by date.
+    """
+    value = request.headers.get("range")
+    if value is None or size == 0:
+        return None
+
+    if_range = request.headers.get("if-range")
+    if if_range is not None:
+        if_range = if_range.strip()
+        if if_range.startswith(('"', "W/")):
+            if etag.startswith("W/") or if_range != etag:
+                return None
+        elif if_range != last_modified:
+            return None
+
+    return parse_range(value, size)
+
+
+class RangeFileResponse(Response):
+    """
+    A file on the local filesystem, in full or the byte range start-end of it with 206 Partial Content.
+
+    Servers offering the ASGI zero-copy send extension get the file to sendfile(2) from, so the bytes never go
+    through Python; otherwise the file is read in chunks off the event loop, holding one chunk at a time.
+    """
+
+    def __init__(self, path: str, size: int, byte_range: Optional[Tuple[int, int]] = None,
+                 headers: Optional[Mapping[str, str]] = None, media_type: Optional[str] = None,
+                 send_body: bool = True):
+        self.path = path
+        self.start, self.end = byte_range if byte_range is not None else (0, size - 1)
+        self.send_body = send_body
+        self.status_code = status.HTTP_206_PARTIAL_CONTENT if byte_range is not None else status.HTTP_200_OK
+        self.media_type = media_type
+        self.background = None
+        self.init_headers(headers)
+        self.headers["accept-ranges"] = "bytes"
+        self.headers["content-length"] = str(self.end - self.start + 1)
+        if byte_range is not None:
+            self.headers["content-range"] = f"bytes {self.start}-{self.end}/{size}"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+
+        count = self.end - self.start + 1
+        if not self.send_body or count <= 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        file = await anyio.to_thread.run_sync(open, self.path, "rb")
+        try:
+            if "http.response.zerocopysend" in scope.get("extensions", {}):
+                await send({"type": "http.response.zerocopysend", "file": file, "offset": self.start,
+                            "count": count})
+                return
+
+            offset = self.start
+            while count > 0:
+                chunk = await anyio.to_thread.run_sync(os.pread, file.fileno(), min(CHUNK_SIZE, count), offset)
+                if not chunk:
+                    raise RuntimeError(f"{self.path} is shorter than expected")
+                offset += len(chunk)
+                count -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": count > 0})
+        finally:
+            await anyio.to_thread.run_sync(file.close)
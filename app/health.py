@@ -0,0 +1,97 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+from sqlalchemy import text
+from starlette.concurrency import run_in_threadpool
+
+from app.config import settings
+from app.database import async_engine
+from app.dependencies import cache
+from app.schemas import DependencyHealth, ReadinessCheck
+from app.storage.backends import storage
+from app.v1.accounts import schedulers
+
+STATUS_OK = "OK"
+STATUS_FAILING = "FAILING"
+
+
+async def check_database() -> Optional[str]:
+    # goes through the pool, so a wedged or exhausted pool fails the check
+    async with async_engine.connect() as conn:
+        await conn.execute(text("SELECT 1"))
+    return None
+
+
+async def check_redis() -> Optional[str]:
+    await run_in_threadpool(cache().ping)
+    return None
+
+
+async def check_storage() -> Optional[str]:
+    await run_in_threadpool(storage.check)
+    return None
+
+
+async def check_scheduler() -> Optional[str]:
+    # only the local scheduler fails the check: without a leader the scheduled jobs wait, requests are served
+    # all the same, and failing every worker at once would take the whole fleet out of the load balancer
+    if schedulers.scheduler is None or not schedulers.scheduler.running:
+        raise RuntimeError("scheduler is not running")
+    if schedulers.leadership.is_leader:
+        return "leader"
+    try:
+        leader_present = await run_in_threadpool(schedulers.leadership.leader_present)
+    except Exception as e:
+        return f"leader unknown: {e}"
+    return "follower" if leader_present else "no leader"
+
+
+class ReadinessProbe:
+    """
+    Run the dependency checks concurrently, each within its own timeout, and keep the result for a short while
+    so frequent probes from several load balancers do not add load of their own. Concurrent probes share a
+    single run of the checks.
+    """
+
+    def __init__(self, checks: Dict[str, Callable[[], Awaitable[Optional[str]]]],
+                 timeout: float = settings.health_check_timeout,
+                 cache_seconds: float = settings.health_check_cache_seconds):
+        self.checks = checks
+        self.timeout = timeout
+        self.cache_seconds = cache_seconds
+        self._result: Optional[ReadinessCheck] = None
+        self._checked_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def _run_check(self, check: Callable[[], Awaitable[Optional[str]]]) -> DependencyHealth:
+        start = time.perf_counter()
+        try:
+            detail = await asyncio.wait_for(check(), self.timeout)
+            status = STATUS_OK
+        except asyncio.TimeoutError:
+            detail = f"timed out after {self.timeout:g}s"
+            status = STATUS_FAILING
+        except Exception as e:
+            detail = str(e) or type(e).__name__
+            status = STATUS_FAILING
+        return DependencyHealth(status=status, latency_ms=(time.perf_counter() - start) * 1000, detail=detail)
+
+    async def check(self) -> ReadinessCheck:
+        async with self._lock:
+            if self._result is None or time.monotonic() - self._checked_at >= self.cache_seconds:
+                results = await asyncio.gather(*(self._run_check(check) for check in self.checks.values()))
+                checks = dict(zip(self.checks, results))
+                failing = any(result.status != STATUS_OK for result in checks.values())
+                self._result = ReadinessCheck(status=STATUS_FAILING if failing else STATUS_OK, checks=checks,
+                                              checked_at=time.time())
+                self._checked_at = time.monotonic()
+            return self._result
+
+
+readiness_probe = ReadinessProbe({
+    "database": check_database,
+    "redis": check_redis,
+    "storage": check_storage,
+    "scheduler": check_scheduler,
+})
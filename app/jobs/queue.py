@@ -0,0 +1,278 @@
+import json
+import logging
+import random
+import time
+import uuid
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from redis import Redis
+from redis.exceptions import ResponseError
+
+from app.config import settings
+from app.tracing import inject_trace_headers
+
+logger = logging.getLogger("app.jobs")
+
+GROUP = "workers"
+
+# moves the delayed jobs that are due back onto the stream, atomically so a job is never lost or duplicated
+PROMOTE_DUE_SCRIPT = """
+local due = redis.call("ZRANGEBYSCORE", KEYS[1], "-inf", ARGV[1], "LIMIT", 0, ARGV[2])
+for _, member in ipairs(due) do
+    redis.call("ZREM", KEYS[1], member)
+    local fields = {}
+    for name, value in pairs(cjson.decode(member)) do
+        table.insert(fields, name)
+        table.insert(fields, value)
+    end
+    redis.call("XADD", KEYS[2], "*", unpack(fields))
+end
+return #due
+"""
+
+# adds a job unless its idempotency key is taken, returning the id of the job that holds the key. The key is only
+# set once the job is added, so a failed add leaves nothing behind to deduplicate retries against
+ENQUEUE_IDEMPOTENT_SCRIPT = """
+local existing = redis.call("GET", KEYS[1])
+if existing then
+    return existing
+end
+if ARGV[3] == "" then
+    local fields = {}
+    for name, value in pairs(cjson.decode(ARGV[4])) do
+        table.insert(fields, name)
+        table.insert(fields, value)
+    end
+    redis.call("XADD", KEYS[2], "*", unpack(fields))
+else
+    redis.call("ZADD", KEYS[2], ARGV[3], ARGV[4])
+end
+redis.call("SET", KEYS[1], ARGV[1], "EX", ARGV[2])
+return ARGV[1]
+"""
+
+
+class JobDefinition(NamedTuple):
+    name: str
+    function: Callable
+    queue: str
+    max_attempts: int
+
+
+JOBS: Dict[str, JobDefinition] = {}
+
+
+def job(name: Optional[str] = None, queue: str = "default", max_attempts: int = settings.job_max_attempts):
+    """
+    Register a function as a job that can be enqueued by name. Jobs are delivered at least once, so they must be
+    safe to run again for the same arguments.
+    """
+
+    def register(function: Callable) -> Callable:
+        job_name = name or function.__name__
+        JOBS[job_name] = JobDefinition(job_name, function, queue, max_attempts)
+        return function
+
+    return register
+
+
+class Job(NamedTuple):
+    message_id: str
+    fields: Dict[str, str]
+
+    @property
+    def id(self) -> str:
+        return self.fields["id"]
+
+    @property
+    def name(self) -> str:
+        return self.fields["name"]
+
+    @property
+    def kwargs(self) -> dict:
+        return json.loads(self.fields["kwargs"])
+
+    @property
+    def attempts(self) -> int:
+        return int(self.fields["attempts"])
+
+    @property
+    def max_attempts(self) -> int:
+        return int(self.fields["max_attempts"])
+
+    @property
+    def enqueued_at(self) -> float:
+        return float(self.fields["enqueued_at"])
+
+    @property
+    def trace_headers(self) -> dict:
+        return json.loads(self.fields.get("trace") or "{}")
+
+    @classmethod
+    def from_message(cls, message_id, fields: dict) -> "Job":
+        return cls(_decode(message_id), {_decode(name): _decode(value) for name, value in fields.items()})
+
+
+def _decode(value) -> str:
+    return value.decode("utf-8") if isinstance(value, bytes) else str(value)
+
+
+class JobQueue:
+    """
+    Job queue on Redis Streams. Every queue is a stream read by the consumer group of the workers:
+
+    - a job read by a worker stays pending until the worker acknowledges it; pending jobs idle for longer than
+      the visibility timeout (the worker died, or lost Redis) are claimed again by another worker with XAUTOCLAIM,
+      and workers keep claiming the jobs they are running to show they are still at it
+    - a failed job is acknowledged and re-added to a sorted set of delayed jobs, due after an exponential backoff;
+      after max_attempts it goes to the dead letter stream of its queue instead
+    - an idempotency key makes enqueueing the same work twice within job_idempotency_ttl return the first job
+    """
+
+    def __init__(self, redis_client: Redis, prefix: str = settings.job_queue_prefix,
+                 visibility_timeout: int = settings.job_visibility_timeout):
+        self.redis_client = redis_client
+        self.prefix = prefix
+        self.visibility_timeout = visibility_timeout
+
+    def stream_key(self, queue: str) -> str:
+        return f"{self.prefix}:{queue}"
+
+    def delayed_key(self, queue: str) -> str:
+        return f"{self.prefix}:{queue}:delayed"
+
+    def dead_key(self, queue: str) -> str:
+        return f"{self.prefix}:{queue}:dead"
+
+    def idempotency_key(self, key: str) -> str:
+        return f"{self.prefix}:idempotency:{key}"
+
+    def ensure_group(self, queue: str) -> None:
+        try:
+            self.redis_client.xgroup_create(self.stream_key(queue), GROUP, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    def enqueue(self, name: str, kwargs: Optional[dict] = None, idempotency_key: Optional[str] = None,
+                delay: float = 0) -> str:
+        """
+        Add a job and return its id, or the id of the job already enqueued with the same idempotency key.
+        """
+        definition = JOBS[name]
+        job_id = uuid.uuid4().hex
+
+        fields = {
+            "id": job_id,
+            "name": name,
+            "kwargs": json.dumps(kwargs or {}),
+            "attempts": "0",
+            "max_attempts": str(definition.max_attempts),
+            "enqueued_at": repr(time.time()),
+            "idempotency_key": idempotency_key or "",
+            "trace": json.dumps(inject_trace_headers({})),
+        }
+
+        if idempotency_key:
+            target = self.delayed_key(definition.queue) if delay > 0 else self.stream_key(definition.queue)
+            score = repr(time.time() + delay) if delay > 0 else ""
+            return _decode(self.redis_client.eval(ENQUEUE_IDEMPOTENT_SCRIPT, 2, self.idempotency_key(idempotency_key),
+                                                  target, job_id, settings.job_idempotency_ttl, score,
+                                                  json.dumps(fields)))
+
+        if delay > 0:
+            self.redis_client.zadd(self.delayed_key(definition.queue), {json.dumps(fields): time.time() + delay})
+        else:
+            self.redis_client.xadd(self.stream_key(definition.queue), fields)
+        return job_id
+
+    def read(self, queue: str, consumer: str, block: float = 1.0) -> Optional[Job]:
+        response = self.redis_client.xreadgroup(GROUP, consumer, {self.stream_key(queue): ">"}, count=1,
+                                                block=int(block * 1000))
+        if not response:
+            return None
+        _, messages = response[0]
+        return Job.from_message(*messages[0]) if messages else None
+
+    def claim_stale(self, queue: str, consumer: str) -> Optional[Job]:
+        """
+        Take over one job that has been pending for longer than the visibility timeout. A job that was claimed
+        this way more than max_attempts times keeps killing its workers, and is dead-lettered instead.
+        """
+        stream = self.stream_key(queue)
+        while True:
+            response = self.redis_client.xautoclaim(stream, GROUP, consumer, self.visibility_timeout * 1000,
+                                                    start_id="0-0", count=1)
+            messages = [message for message in response[1] if message[1]]
+            if not messages:
+                return None
+
+            stale = Job.from_message(*messages[0])
+            pending = self.redis_client.xpending_range(stream, GROUP, min=stale.message_id, max=stale.message_id,
+                                                       count=1)
+            deliveries = pending[0]["times_delivered"] if pending else 1
+            if deliveries <= stale.max_attempts:
+                logger.warning("Job %s (%s) timed out, running it again", stale.id, stale.name)
+                return stale
+            self.dead_letter(queue, stale, f"abandoned by {deliveries} workers")
+
+    def extend(self, queue: str, consumer: str, message_ids: List[str]) -> None:
+        """
+        Reset the idle time of jobs that are still running, so they are not claimed by another worker.
+        """
+        if message_ids:
+            self.redis_client.xclaim(self.stream_key(queue), GROUP, consumer, 0, message_ids, justid=True)
+
+    def ack(self, queue: str, job: Job) -> None:
+        pipeline = self.redis_client.pipeline(transaction=True)
+        pipeline.xack(self.stream_key(queue), GROUP, job.message_id)
+        pipeline.xdel(self.stream_key(queue), job.message_id)
+        pipeline.execute()
+
+    def backoff(self, attempts: int) -> float:
+        delay = min(settings.job_retry_backoff * 2 ** (attempts - 1), settings.job_retry_backoff_max)
+        # jitter spreads out the retries of jobs that failed together, e.g. while a dependency was down
+        return delay * random.uniform(0.5, 1.0)
+
+    def retry(self, queue: str, job: Job, error: str) -> Optional[float]:
+        """
+        Schedule the next attempt of a failed job and return its delay, or dead-letter the job when it is out
+        of attempts and return None.
+        """
+        attempts = job.attempts + 1
+        if attempts >= job.max_attempts:
+            self.dead_letter(queue, job, error)
+            return None
+
+        delay = self.backoff(attempts)
+        fields = {**job.fields, "attempts": str(attempts), "last_error": error}
+
+        pipeline = self.redis_client.pipeline(transaction=True)
+        pipeline.zadd(self.delayed_key(queue), {json.dumps(fields): time.time() + delay})
+        pipeline.xack(self.stream_key(queue), GROUP, job.message_id)
+        pipeline.xdel(self.stream_key(queue), job.message_id)
+        pipeline.execute()
+        return delay
+
+    def dead_letter(self, queue: str, job: Job, error: str) -> None:
+        fields = {**job.fields, "last_error": error, "failed_at": repr(time.time())}
+
+        pipeline = self.redis_client.pipeline(transaction=True)
+        pipeline.xadd(self.dead_key(queue), fields, maxlen=settings.job_dead_letter_maxlen, approximate=True)
+        pipeline.xack(self.stream_key(queue), GROUP, job.message_id)
+        pipeline.xdel(self.stream_key(queue), job.message_id)
+        # the same work may be enqueued again, e.g. once the cause is fixed
+        if job.fields.get("idempotency_key"):
+            pipeline.delete(self.idempotency_key(job.fields["idempotency_key"]))
+        pipeline.execute()
+        logger.error("Job %s (%s) failed for good: %s", job.id, job.name, error)
+
+    def promote_due(self, queue: str, limit: int = 100) -> int:
+        return self.redis_client.eval(PROMOTE_DUE_SCRIPT, 2, self.delayed_key(queue), self.stream_key(queue),
+                                      time.time(), limit)
+
+    def remove_consumer(self, queue: str, consumer: str) -> None:
+        # deleting a consumer drops its pending jobs, so one that still has some is left for XAUTOCLAIM
+        stream = self.stream_key(queue)
+        if not self.redis_client.xpending_range(stream, GROUP, min="-", max="+", count=1, consumername=consumer):
+            self.redis_client.xgroup_delconsumer(stream, GROUP, consumer)
@@ -0,0 +1,40 @@
+import datetime
+import os
+
+from app.config import settings
+from app.database import async_session
+from app.jobs.queue import job
+from app.storage.backends import storage
+from app.storage.blobs import blob_store
+from app.storage.service import BlobsService
+from app.v1.accounts.utils import generate_image_resolutions
+
+# The jobs enqueued by name. The API and the worker both import this module, so both register a job with the
+# same queue and number of attempts.
+
+@job(queue="images")
+def resize_avatar(key: str, sizes: list) -> None:
+    stem = os.path.splitext(key)[0]
+    with storage.local_path(key) as path:
+        path_stem = os.path.splitext(path)[0]
+        for rendition in generate_image_resolutions(path, sizes):
+            # renditions keep the name of the avatar: <name>-<width>x<height><ext>
+            storage.put_file(stem + rendition[len(path_stem):], rendition)
+
+
+@job(queue="default")
+async def collect_blobs() -> None:
+    unreferenced_since = (datetime.datetime.now(datetime.timezone.utc)
+                          - datetime.timedelta(seconds=settings.blob_gc_grace_seconds))
+
+    async with async_session() as session:
+        digests = await BlobsService(session).get_unreferenced(unreferenced_since)
+
+    # one transaction per blob, holding its lock from deleting the row to deleting the content: a reference
+    # taken meanwhile waits, then finds the content gone and stores it again. When the content cannot be
+    # deleted, the row is rolled back and collected on the next run.
+    for digest in digests:
+        async with async_session() as session:
+            if await BlobsService(session).collect(digest, unreferenced_since):
+                blob_store.delete(digest)
+                await session.commit()
@@ -0,0 +1,184 @@
+"""
+Run the jobs enqueued by the API.
+
+    python -m app.jobs.worker --queues images=4,default=2
+
+Every queue gets its own threads, so a backlog on one queue does not hold up the others, and several worker
+processes can run side by side to scale out. SIGTERM or SIGINT stop the worker once the running jobs finish.
+"""
+import argparse
+import asyncio
+import inspect
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+from typing import Dict, Tuple
+
+from prometheus_client import start_http_server
+
+from app.config import settings
+from app.database import async_engine
+from app.dependencies import cache, close_redis_pool
+from app.jobs import tasks  # noqa: F401, registers the jobs
+from app.jobs.queue import JOBS, Job, JobQueue
+from app.metrics import JOB_DURATION, JOB_QUEUE_LATENCY, JOBS_PROCESSED
+from app.tracing import configure_tracing, server_span, shutdown_tracing
+
+logger = logging.getLogger("app.jobs")
+
+
+class Worker:
+    def __init__(self, job_queue: JobQueue, concurrency: Dict[str, int]):
+        self.job_queue = job_queue
+        self.concurrency = concurrency
+        self.name = f"{socket.gethostname()}-{os.getpid()}"
+        self.stopped = threading.Event()
+        # the job each consumer is running, for the heartbeat
+        self.running: Dict[str, Tuple[str, str]] = {}
+        self.running_lock = threading.Lock()
+        # coroutine jobs all run on one event loop, which owns the database connections of the worker
+        self.loop = asyncio.new_event_loop()
+
+    def consumers(self):
+        for queue, threads in self.concurrency.items():
+            for index in range(threads):
+                yield queue, f"{self.name}-{queue}-{index}"
+
+    def run(self) -> None:
+        for queue in self.concurrency:
+            self.job_queue.ensure_group(queue)
+
+        threads = [threading.Thread(target=self.consume, args=(queue, consumer), name=consumer)
+                   for queue, consumer in self.consumers()]
+        threads.append(threading.Thread(target=self.maintain, name=f"{self.name}-maintenance"))
+        loop_thread = threading.Thread(target=self.loop.run_forever, name=f"{self.name}-loop")
+        loop_thread.start()
+        for thread in threads:
+            thread.start()
+
+        logger.info("Worker %s consuming %s", self.name,
+                    ", ".join(f"{queue} ({threads} threads)" for queue, threads in self.concurrency.items()))
+
+        for thread in threads:
+            thread.join()
+
+        asyncio.run_coroutine_threadsafe(async_engine.dispose(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        loop_thread.join()
+        self.loop.close()
+
+        for queue, consumer in self.consumers():
+            self.job_queue.remove_consumer(queue, consumer)
+
+    def stop(self, *args) -> None:
+        logger.info("Worker %s stopping after the running jobs", self.name)
+        self.stopped.set()
+
+    def consume(self, queue: str, consumer: str) -> None:
+        next_claim = 0.0
+        while not self.stopped.is_set():
+            try:
+                job = None
+                if time.monotonic() >= next_claim:
+                    job = self.job_queue.claim_stale(queue, consumer)
+                    next_claim = time.monotonic() + max(self.job_queue.visibility_timeout / 10, 1)
+                if job is None:
+                    job = self.job_queue.read(queue, consumer)
+                if job is not None:
+                    self.execute(queue, consumer, job)
+            except Exception:
+                logger.exception("Consumer %s failed, retrying", consumer)
+                self.stopped.wait(1)
+
+    def execute(self, queue: str, consumer: str, job: Job) -> None:
+        definition = JOBS.get(job.name)
+        if definition is None:
+            self.job_queue.dead_letter(queue, job, "unknown job")
+            JOBS_PROCESSED.labels(queue, job.name, "dead").inc()
+            return
+
+        JOB_QUEUE_LATENCY.labels(queue).observe(max(time.time() - job.enqueued_at, 0.0))
+
+        with self.running_lock:
+            self.running[consumer] = (queue, job.message_id)
+        start = time.perf_counter()
+        try:
+            with server_span(f"job {job.name}", job.trace_headers, {"job.id": job.id, "job.queue": queue,
+                                                                    "job.attempt": job.attempts + 1}):
+                result = definition.function(**job.kwargs)
+                if inspect.isawaitable(result):
+                    asyncio.run_coroutine_threadsafe(result, self.loop).result()
+        except Exception as e:
+            delay = self.job_queue.retry(queue, job, f"{type(e).__name__}: {e}")
+            if delay is None:
+                JOBS_PROCESSED.labels(queue, job.name, "dead").inc()
+            else:
+                JOBS_PROCESSED.labels(queue, job.name, "retried").inc()
+                logger.warning("Job %s (%s) failed on attempt %d, retrying in %.0f s", job.id, job.name,
+                               job.attempts + 1, delay, exc_info=True)
+        else:
+            self.job_queue.ack(queue, job)
+            JOBS_PROCESSED.labels(queue, job.name, "succeeded").inc()
+        finally:
+            JOB_DURATION.labels(queue, job.name).observe(time.perf_counter() - start)
+            with self.running_lock:
+                self.running.pop(consumer, None)
+
+    def maintain(self) -> None:
+        """
+        Move retries that are due back onto their queues, and extend the visibility of the running jobs.
+        """
+        heartbeat = max(self.job_queue.visibility_timeout / 3, 1)
+        next_heartbeat = time.monotonic() + heartbeat
+        while not self.stopped.wait(1):
+            try:
+                for queue in self.concurrency:
+                    self.job_queue.promote_due(queue)
+
+                if time.monotonic() >= next_heartbeat:
+                    with self.running_lock:
+                        running = dict(self.running)
+                    for consumer, (queue, message_id) in running.items():
+                        self.job_queue.extend(queue, consumer, [message_id])
+                    next_heartbeat = time.monotonic() + heartbeat
+            except Exception:
+                logger.exception("Job queue maintenance failed")
+
+
+def parse_concurrency(value: str) -> Dict[str, int]:
+    concurrency = {}
+    for item in value.split(","):
+        queue, _, threads = item.partition("=")
+        if queue.strip():
+            concurrency[queue.strip()] = int(threads or 1)
+    return concurrency
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queues", type=parse_concurrency, default=parse_concurrency(settings.job_queue_concurrency),
+                        help="queues to consume and the threads for each, queue=threads,...")
+    parser.add_argument("--metrics-port", type=int, default=settings.job_worker_metrics_port,
+                        help="serve Prometheus metrics on this port (0: off)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+    configure_tracing()
+    if args.metrics_port:
+        start_http_server(args.metrics_port)
+
+    worker = Worker(JobQueue(cache()), args.queues)
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    try:
+        worker.run()
+    finally:
+        close_redis_pool()
+        shutdown_tracing()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+import weakref
+from typing import Optional
+
+from app.config import settings
+from app.metrics import EVENT_LOOP_BLOCKS, EVENT_LOOP_LAG
+from app.utils import route_label
+
+logger = logging.getLogger("app.loop")
+
+
+class LoopMonitor:
+    """
+    Measure how late the event loop runs its callbacks and catch the code that blocks it.
+
+    A heartbeat task on the loop wakes up every interval and records how late it woke up. A watchdog thread
+    checks the heartbeat: once it is more than threshold late, the loop is stuck in a callback, so the watchdog
+    takes the stack of the loop thread right then and logs it together with the route of the request whose task
+    is running. Synchronous Redis calls, bcrypt, Fernet, jwt.decode or filesystem calls made from async code all
+    show up this way.
+    """
+
+    def __init__(self, interval: float = settings.loop_monitor_interval_ms / 1000,
+                 threshold: float = settings.loop_block_threshold_ms / 1000):
+        self.interval = interval
+        self.threshold = threshold
+        self.last_beat = time.monotonic()
+        # request scopes by the task handling them; the router fills in the matched route as the request goes
+        self.requests = weakref.WeakKeyDictionary()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._reported_beat = None
+
+    def track(self, scope: dict) -> None:
+        task = asyncio.current_task()
+        if task is not None:
+            self.requests[task] = scope
+
+    def start(self) -> None:
+        if self._heartbeat_task is not None:
+            return
+
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self.last_beat = time.monotonic()
+        self._stopped.clear()
+
+        self._heartbeat_task = asyncio.create_task(self._heartbeat())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self) -> None:
+        self._stopped.set()
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            await asyncio.gather(self._heartbeat_task, return_exceptions=True)
+            self._heartbeat_task = None
+        if self._watchdog is not None:
+            await asyncio.to_thread(self._watchdog.join)
+            self._watchdog = None
+
+    async def _heartbeat(self) -> None:
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+
+            lag = max(now - start - self.interval, 0.0)
+            EVENT_LOOP_LAG.observe(lag)
+            if lag >= self.threshold:
+                logger.warning("Event loop was blocked for %.1f ms", lag * 1000)
+
+            self.last_beat = now
+
+    def _watch(self) -> None:
+        while not self._stopped.wait(self.interval / 2):
+            beat = self.last_beat
+            if time.monotonic() - beat >= self.threshold and beat != self._reported_beat:
+                self._reported_beat = beat
+                self._report()
+
+    def _current_route(self) -> str:
+        # current_task takes the loop of another thread, here the one the watchdog found blocked
+        try:
+            task = asyncio.current_task(self._loop)
+        except RuntimeError:
+            task = None
+        scope = self.requests.get(task) if task is not None else None
+        if scope is None:
+            return "background"
+        return f'{scope["method"]} {route_label(scope)}'
+
+    def _report(self) -> None:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        route = self._current_route()
+
+        EVENT_LOOP_BLOCKS.labels(route).inc()
+
+        stack = "".join(traceback.format_stack(frame)) if frame is not None else "  (no stack)\n"
+        logger.warning("Event loop blocked for more than %.0f ms in %s, at:\n%s",
+                       self.threshold * 1000, route, stack)
+
+
+loop_monitor = LoopMonitor()
@@ -1,17 +1,80 @@
-from fastapi import FastAPI, status
+import time
+
+IMPORT_STARTED = time.perf_counter()
+
+import hmac
+import logging
+from contextlib import asynccontextmanager
+
+from anyio import to_thread
+from fastapi import FastAPI, Header, Query, Response, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import RedirectResponse
 from fastapi.staticfiles import StaticFiles
+from starlette.concurrency import run_in_threadpool
 
 from app.config import settings
 from app.v1.api import router as v1_router
-from app.database import create_db_and_tables
-from app.schemas import HealthCheck
+from app.v1.models.controller import files_router as model_files_router
+from app.database import async_engine, create_db_and_tables, replica_pool
+from app.dependencies import close_redis_pool
+from app.exceptions import ProfileNotFoundException
+from app.health import readiness_probe, STATUS_OK
+from app.loop_monitor import loop_monitor
+from app.metrics import APP_STARTUP_DURATION, render_metrics
+from app.middleware import LoopMonitorMiddleware, MetricsMiddleware, ProfilerMiddleware, QueryStatsMiddleware, \
+    TracingMiddleware
+from app.profiler import load_profile
+from app.storage.backends import storage
+from app.tracing import configure_tracing, shutdown_tracing
+from app.schemas import HealthCheck, ReadinessCheck
+from app.v1.accounts.schedulers import start_scheduler, shutdown_scheduler
+
+logger = logging.getLogger(__name__)
+
+IMPORT_DURATION = time.perf_counter() - IMPORT_STARTED
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Start the resources shared by all requests of this worker and release them on shutdown.
+
+    Uvicorn only runs the shutdown half once in-flight requests have finished (bounded by
+    --timeout-graceful-shutdown), so what is left to drain here are scheduled jobs and background tasks.
+    """
+    started = time.perf_counter()
+
+    configure_tracing()
+    to_thread.current_default_thread_limiter().total_tokens = settings.thread_pool_size
+    await create_db_and_tables()
+    replica_pool.start_health_checks()
+    # creating the job store connects to the database synchronously
+    await run_in_threadpool(start_scheduler)
+    if settings.loop_monitor_enabled:
+        loop_monitor.start()
+
+    startup_duration = time.perf_counter() - started
+    APP_STARTUP_DURATION.labels("imports").set(IMPORT_DURATION)
+    APP_STARTUP_DURATION.labels("lifespan").set(startup_duration)
+    logger.info("Worker ready in %.0f ms (imports %.0f ms, startup %.0f ms)",
+                (IMPORT_DURATION + startup_duration) * 1000, IMPORT_DURATION * 1000, startup_duration * 1000)
+
+    yield
+
+    await loop_monitor.stop()
+    await run_in_threadpool(shutdown_scheduler)
+    await replica_pool.close()
+    await async_engine.dispose()
+    close_redis_pool()
+    shutdown_tracing()
+
 
 app = FastAPI(
     title=settings.title,
     version=settings.version,
     description=settings.description,
+    lifespan=lifespan,
 )
 
 origins = [
@@ -26,20 +89,25 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-app.mount(settings.media_path, StaticFiles(directory=settings.static_dir + settings.media_dir), name="media")
-app.mount(settings.models_path, StaticFiles(directory=settings.static_dir + settings.models_dir), name="models")
+app.add_middleware(QueryStatsMiddleware)
+app.add_middleware(MetricsMiddleware)
+if settings.loop_monitor_enabled:
+    app.add_middleware(LoopMonitorMiddleware)
+app.add_middleware(ProfilerMiddleware)
+if settings.tracing_enabled:
+    app.add_middleware(TracingMiddleware)
 
 app.include_router(v1_router, prefix="/v1", include_in_schema=True)
+app.include_router(model_files_router, prefix=settings.models_path)
 
-
-@app.on_event("startup")
-async def startup():
-    await create_db_and_tables()
-
-
-@app.on_event("shutdown")
-async def shutdown():
-    pass
+if storage.local:
+    app.mount(settings.media_path, StaticFiles(directory=settings.static_dir + settings.media_dir), name="media")
+else:
+    # media URLs stored before keep working, downloaded from the storage
+    @app.get(settings.media_path + "/{path:path}", response_class=RedirectResponse, include_in_schema=False)
+    async def media(path: str):
+        url = await run_in_threadpool(storage.url, settings.media_dir + path, None, True)
+        return RedirectResponse(url)
 
 
 @app.get('/', response_class=RedirectResponse, include_in_schema=False)
@@ -57,3 +125,56 @@ async def docs():
 )
 async def get_health():
     return HealthCheck(status="OK")
+
+
+@app.get(
+    "/health/live",
+    tags=["healthcheck"],
+    summary="Liveness probe",
+    response_description="Return HTTP Status Code 200 (OK) while the worker's event loop is responsive",
+    status_code=status.HTTP_200_OK,
+    response_model=HealthCheck,
+)
+async def get_liveness():
+    return HealthCheck(status="OK")
+
+
+@app.get(
+    "/health/ready",
+    tags=["healthcheck"],
+    summary="Readiness probe",
+    response_description="Return HTTP Status Code 200 (OK) when every dependency answers in time, 503 otherwise",
+    status_code=status.HTTP_200_OK,
+    response_model=ReadinessCheck,
+)
+async def get_readiness(response: Response):
+    readiness = await readiness_probe.check()
+
+    if readiness.status != STATUS_OK:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+
+    return readiness
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+
+@app.get("/debug/profiles/{profile_id}", include_in_schema=False)
+async def read_profile(profile_id: str, mode: str = Query("wall", pattern="^(wall|cpu)$"),
+                       x_profile: str = Header(None)):
+    """
+    Return a stored profile as collapsed stacks, ready for flamegraph.pl or speedscope.
+    """
+    if not settings.profiler_token or x_profile is None or \
+            not hmac.compare_digest(x_profile, settings.profiler_token):
+        raise ProfileNotFoundException(status_code=status.HTTP_404_NOT_FOUND, detail="Profile not found")
+
+    profile = await run_in_threadpool(load_profile, profile_id, mode)
+
+    if profile is None:
+        raise ProfileNotFoundException(status_code=status.HTTP_404_NOT_FOUND, detail="Profile not found")
+
+    return Response(content=profile, media_type="text/plain")
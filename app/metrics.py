@@ -0,0 +1,178 @@
+import os
+import time
+from typing import Tuple
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, \
+    generate_latest, multiprocess
+
+# With several uvicorn/gunicorn workers, PROMETHEUS_MULTIPROC_DIR must point to a directory shared by all of them
+# (and emptied before the server starts); every worker then writes its samples there and any worker can serve
+# the aggregated numbers. Gauges declare how the values of the workers are combined.
+MULTIPROCESS = "PROMETHEUS_MULTIPROC_DIR" in os.environ
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+APP_STARTUP_DURATION = Gauge(
+    "app_startup_duration_seconds",
+    "Time a worker spent importing the application and running its lifespan startup",
+    ["phase"],
+    multiprocess_mode="max",
+)
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Time spent handling HTTP requests",
+    ["method", "route"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1, 2.5, 5, 10, 30),
+)
+
+HTTP_REQUESTS_IN_FLIGHT = Gauge(
+    "http_requests_in_flight",
+    "HTTP requests currently being handled",
+    multiprocess_mode="livesum",
+)
+
+HTTP_RESPONSES = Counter(
+    "http_responses",
+    "HTTP responses sent, by status code",
+    ["method", "route", "status"],
+)
+
+REDIS_COMMAND_DURATION = Histogram(
+    "redis_command_duration_seconds",
+    "Round trip time of Redis commands and pipelines",
+    ["command"],
+    buckets=LATENCY_BUCKETS,
+)
+
+EVENT_LOOP_LAG = Histogram(
+    "event_loop_lag_seconds",
+    "How late the event loop ran a callback scheduled at a known time",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+
+EVENT_LOOP_BLOCKS = Counter(
+    "event_loop_blocks",
+    "Times a single callback kept the event loop busy beyond the blocking threshold, by the route running it",
+    ["route"],
+)
+
+DB_POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time spent waiting for a connection from the database pool",
+    ["pool"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+
+DB_POOL_CONNECTIONS_IN_USE = Gauge(
+    "db_pool_connections_in_use",
+    "Database connections currently checked out of the pool",
+    ["pool"],
+    multiprocess_mode="livesum",
+)
+
+DB_STATEMENT_DURATION = Histogram(
+    "db_statement_duration_seconds",
+    "Execution time of SQL statements",
+    ["pool", "operation"],
+    buckets=LATENCY_BUCKETS,
+)
+
+BCRYPT_QUEUE_DEPTH = Gauge(
+    "bcrypt_queue_depth",
+    "bcrypt hash and verify calls waiting or running",
+    multiprocess_mode="livesum",
+)
+
+BCRYPT_DURATION = Histogram(
+    "bcrypt_duration_seconds",
+    "Time spent in bcrypt hash and verify calls",
+    ["operation"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+
+IMAGE_RESIZE_DURATION = Histogram(
+    "image_resize_duration_seconds",
+    "Time spent producing one resized image",
+    ["size"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+
+BLOB_WRITES = Counter(
+    "blob_writes",
+    "Uploaded files by whether their content was new or already stored",
+    ["kind", "outcome"],
+)
+
+BLOB_DEDUPLICATED_BYTES = Counter(
+    "blob_deduplicated_bytes",
+    "Bytes of uploaded files that were already stored and not written again",
+    ["kind"],
+)
+
+JOBS_PROCESSED = Counter(
+    "jobs_processed",
+    "Background jobs run by the workers, by outcome: succeeded, retried or dead",
+    ["queue", "job", "outcome"],
+)
+
+JOB_DURATION = Histogram(
+    "job_duration_seconds",
+    "Time spent running background jobs",
+    ["queue", "job"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900),
+)
+
+JOB_QUEUE_LATENCY = Histogram(
+    "job_queue_latency_seconds",
+    "Time from enqueueing a job to a worker starting it",
+    ["queue"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900),
+)
+
+UPLOAD_BYTES = Counter(
+    "upload_bytes",
+    "Bytes received in file uploads",
+    ["kind"],
+)
+
+UPLOAD_THROUGHPUT = Histogram(
+    "upload_throughput_bytes_per_second",
+    "Rate at which a single uploaded file was received and written",
+    ["kind"],
+    buckets=(64e3, 256e3, 1e6, 4e6, 16e6, 64e6, 256e6, 1e9),
+)
+
+
+def observe_upload(kind: str, size: int, started: float) -> None:
+    """
+    Record an uploaded file of size bytes whose transfer began at time.perf_counter() value started.
+    """
+    size = size or 0
+    UPLOAD_BYTES.labels(kind).inc(size)
+    elapsed = time.perf_counter() - started
+    if size and elapsed > 0:
+        UPLOAD_THROUGHPUT.labels(kind).observe(size / elapsed)
+
+
+def observe_blob_write(kind: str, size: int, created: bool) -> None:
+    BLOB_WRITES.labels(kind, "new" if created else "duplicate").inc()
+    if not created:
+        BLOB_DEDUPLICATED_BYTES.labels(kind).inc(size)
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid: int) -> None:
+    """
+    Drop the live gauges of a worker that exited; call it from the process manager (gunicorn's child_exit hook).
+    """
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(pid)
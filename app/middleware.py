@@ -0,0 +1,183 @@
+import hmac
+import logging
+import random
+import time
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.config import settings
+from app.loop_monitor import LoopMonitor, loop_monitor
+from app.metrics import HTTP_REQUEST_DURATION, HTTP_REQUESTS_IN_FLIGHT, HTTP_RESPONSES
+from app.profiler import SamplingProfiler, profiler
+from app.query_stats import QueryStats, request_query_stats
+from app.tracing import server_span, set_span_status
+from app.utils import route_label
+
+logger = logging.getLogger("app.sql")
+
+QUERY_SUMMARY_HEADER = "X-DB-Queries"
+
+
+class QueryStatsMiddleware:
+    """
+    Collect the database work of every request and report it in a Server-Timing header.
+
+    With QUERY_PROFILER_DEBUG on, the response also gets a query summary header and statements repeated at
+    least QUERY_N_PLUS_ONE_THRESHOLD times are logged as possible N+1 queries.
+
+    Written as a plain ASGI middleware so the response is not buffered or moved to another task.
+    """
+
+    def __init__(self, app: ASGIApp, debug: bool = settings.query_profiler_debug):
+        self.app = app
+        self.debug = debug
+
+    def report(self, scope: Scope, stats: QueryStats, headers: MutableHeaders) -> None:
+        repeated = stats.repeated()
+        headers[QUERY_SUMMARY_HEADER] = f"count={stats.count}; time={stats.duration_ms:.2f}ms; " \
+                                        f"repeated={len(repeated)}"
+
+        for shape, count in repeated:
+            logger.warning("Possible N+1 in %s %s: statement run %d times: %s",
+                           scope["method"], scope["path"], count, shape)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats()
+        token = request_query_stats.set(stats)
+
+        async def send_with_timing(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", f'db;dur={stats.duration_ms:.2f};desc="{stats.count} queries"')
+                if self.debug:
+                    self.report(scope, stats, headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            request_query_stats.reset(token)
+
+
+class MetricsMiddleware:
+    """
+    Export per-route latency, status counts and the number of requests in flight.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        start = time.perf_counter()
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        HTTP_REQUESTS_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            HTTP_REQUESTS_IN_FLIGHT.dec()
+            method, route = scope["method"], route_label(scope)
+            HTTP_REQUEST_DURATION.labels(method, route).observe(time.perf_counter() - start)
+            HTTP_RESPONSES.labels(method, route, str(status_code)).inc()
+
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_ID_HEADER = "X-Profile-Id"
+
+
+def profiling_requested(scope: Scope) -> bool:
+    token = Headers(scope=scope).get(PROFILE_HEADER)
+    if token is not None and settings.profiler_token:
+        return hmac.compare_digest(token, settings.profiler_token)
+    return settings.profiler_sample_rate > 0 and random.random() < settings.profiler_sample_rate
+
+
+class ProfilerMiddleware:
+    """
+    Profile requests that ask for it with the X-Profile header, or a PROFILER_SAMPLE_RATE share of all requests.
+
+    The profile is stored as collapsed stacks under PROFILER_OUTPUT_DIR and its id is returned in X-Profile-Id.
+    Only the newest PROFILER_MAX_FILES profiles are kept.
+    """
+
+    def __init__(self, app: ASGIApp, sampling_profiler: SamplingProfiler = profiler):
+        self.app = app
+        self.profiler = sampling_profiler
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not profiling_requested(scope):
+            await self.app(scope, receive, send)
+            return
+
+        profile = self.profiler.start(f'{scope["method"]} {scope["path"]}')
+        if profile is None:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_profile_id(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message)[PROFILE_ID_HEADER] = profile.id
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            self.profiler.stop(profile)
+            await run_in_threadpool(profile.save)
+
+
+class LoopMonitorMiddleware:
+    """
+    Tell the loop monitor which request each task is handling, so blocking code can be attributed to a route.
+    """
+
+    def __init__(self, app: ASGIApp, monitor: LoopMonitor = loop_monitor):
+        self.app = app
+        self.monitor = monitor
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http":
+            self.monitor.track(scope)
+        await self.app(scope, receive, send)
+
+
+class TracingMiddleware:
+    """
+    Open a server span for every request, continuing the caller's trace when it sent a traceparent header.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_status(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                set_span_status(message["status"])
+            await send(message)
+
+        attributes = {"http.method": scope["method"], "http.target": scope["path"]}
+        with server_span(f'{scope["method"]} {scope["path"]}', Headers(scope=scope), attributes) as request_span:
+            await self.app(scope, receive, send_with_status)
+            if request_span is not None:
+                # named after the route template once the router has matched it, as paths are unbounded
+                request_span.update_name(f'{scope["method"]} {route_label(scope)}')
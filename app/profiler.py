@@ -0,0 +1,212 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Dict, Optional
+
+from app.config import settings
+
+# Frames a thread sits in while it has nothing to do; stacks ending in one of them are not samples of work.
+# ThreadPoolExecutor workers block inside the C SimpleQueue.get, so their topmost Python frame is _worker itself.
+IDLE_FRAMES = frozenset({
+    ("threading.py", "wait"),
+    ("queue.py", "get"),
+    ("selectors.py", "select"),
+    ("_base.py", "wait"),
+    ("thread.py", "_worker"),
+})
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _collapse(frame) -> str:
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+def _is_idle(frame) -> bool:
+    return (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name) in IDLE_FRAMES
+
+
+def _current_task(loop: asyncio.AbstractEventLoop) -> Optional[asyncio.Task]:
+    # the task running on the loop of another thread, None when it cannot be told
+    try:
+        return asyncio.current_task(loop)
+    except RuntimeError:
+        return None
+
+
+def _thread_cpu_time(thread_id: int) -> Optional[float]:
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(thread_id))
+    except (AttributeError, OSError):
+        return None
+
+
+class Profile:
+    """
+    Stack samples collected for one request, in collapsed ("folded") format: one line per distinct stack with
+    the frames separated by semicolons, followed by the number of samples, as read by flamegraph.pl, speedscope
+    and most other flamegraph tools.
+
+    Wall samples are taken at every tick; CPU samples only for threads that used CPU time since the previous
+    tick. On the event loop thread only the ticks where the request's own task is running are kept; busy thread
+    pool workers are sampled whoever they work for.
+    """
+
+    def __init__(self, name: str, task: Optional[asyncio.Task], loop_thread_id: int):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.task = task
+        self.loop_thread_id = loop_thread_id
+        self.loop = task.get_loop() if task is not None else None
+        self.started = time.monotonic()
+        self.wall = Counter()
+        self.cpu = Counter()
+
+    def folded(self, mode: str = "wall") -> str:
+        samples = self.cpu if mode == "cpu" else self.wall
+        return "".join(f"{stack} {count}\n" for stack, count in samples.most_common())
+
+    def save(self, directory: str = settings.profiler_output_dir,
+             max_profiles: int = settings.profiler_max_files) -> None:
+        os.makedirs(directory, exist_ok=True)
+        for mode in ("wall", "cpu"):
+            with open(os.path.join(directory, f"{self.id}.{mode}.folded"), "w") as output:
+                output.write(self.folded(mode))
+        prune_profiles(directory, max_profiles)
+
+
+def prune_profiles(directory: str, max_profiles: int) -> None:
+    """
+    Delete the oldest profiles in directory beyond the newest max_profiles, so sampled profiling cannot fill the
+    disk. 0 keeps every profile.
+    """
+    if max_profiles <= 0:
+        return
+    modified = {}
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if not entry.name.endswith(".folded"):
+                continue
+            try:
+                mtime = entry.stat().st_mtime
+            except FileNotFoundError:
+                continue
+            profile_id = entry.name.split(".", 1)[0]
+            modified[profile_id] = max(modified.get(profile_id, 0), mtime)
+
+    for profile_id in sorted(modified, key=modified.get)[:-max_profiles]:
+        for mode in ("wall", "cpu"):
+            try:
+                os.unlink(os.path.join(directory, f"{profile_id}.{mode}.folded"))
+            except FileNotFoundError:
+                pass
+
+
+class SamplingProfiler:
+    """
+    A single background thread that samples the stacks of every thread while at least one profile is active.
+
+    Overhead is bounded by the sampling interval, the number of profiles that may run at the same time and the
+    maximum duration of a profile; nothing is sampled while no profile is active.
+    """
+
+    def __init__(self, interval: float = settings.profiler_interval_ms / 1000,
+                 max_active: int = settings.profiler_max_active,
+                 max_duration: float = settings.profiler_max_duration):
+        self.interval = interval
+        self.max_active = max_active
+        self.max_duration = max_duration
+        self.active: Dict[str, Profile] = {}
+        # held while sampling too, so a profile is no longer written to once stop() returns
+        self._lock = threading.RLock()
+        self._cpu_times: Dict[int, float] = {}
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, name: str) -> Optional[Profile]:
+        """
+        Start profiling the calling task, or return None when max_active profiles are already running.
+        """
+        profile = Profile(name, asyncio.current_task(), threading.get_ident())
+        with self._lock:
+            if len(self.active) >= self.max_active:
+                return None
+            self.active[profile.id] = profile
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+                self._thread.start()
+        return profile
+
+    def stop(self, profile: Profile) -> Profile:
+        with self._lock:
+            self.active.pop(profile.id, None)
+        return profile
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        while True:
+            with self._lock:
+                profiles = list(self.active.values())
+                if not profiles:
+                    self._thread = None
+                    self._cpu_times.clear()
+                    return
+
+                self._sample(own_id, profiles)
+
+            time.sleep(self.interval)
+
+    def _sample(self, own_id: int, profiles) -> None:
+        now = time.monotonic()
+        frames = sys._current_frames()
+
+        for thread_id, frame in frames.items():
+            if thread_id == own_id:
+                continue
+
+            cpu_time = _thread_cpu_time(thread_id)
+            previous = self._cpu_times.get(thread_id)
+            if cpu_time is not None:
+                self._cpu_times[thread_id] = cpu_time
+            on_cpu = cpu_time is not None and previous is not None and cpu_time > previous
+
+            if _is_idle(frame):
+                continue
+            stack = None
+
+            for profile in profiles:
+                if thread_id == profile.loop_thread_id and profile.loop is not None \
+                        and _current_task(profile.loop) is not profile.task:
+                    continue
+                if stack is None:
+                    stack = _collapse(frame)
+                profile.wall[stack] += 1
+                if on_cpu:
+                    profile.cpu[stack] += 1
+
+        for profile in profiles:
+            if now - profile.started > self.max_duration:
+                self.stop(profile)
+
+
+profiler = SamplingProfiler()
+
+
+def load_profile(profile_id: str, mode: str = "wall", directory: str = settings.profiler_output_dir) -> Optional[str]:
+    if mode not in ("wall", "cpu") or not profile_id.isalnum():
+        return None
+    try:
+        with open(os.path.join(directory, f"{profile_id}.{mode}.folded")) as profile_file:
+            return profile_file.read()
+    except FileNotFoundError:
+        return None
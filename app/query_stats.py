@@ -0,0 +1,116 @@
+import logging
+import random
+import re
+import time
+from collections import Counter
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.config import settings
+from app.metrics import DB_STATEMENT_DURATION
+
+logger = logging.getLogger("app.sql")
+
+
+_WHITESPACE = re.compile(r"\s+")
+_PLACEHOLDER_LIST = re.compile(r"\(\s*(?:\$\d+|\?|%\(\w+\)s)(?:\s*,\s*(?:\$\d+|\?|%\(\w+\)s))*\s*\)")
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\$\d+|\b\d+\b")
+
+
+@lru_cache(maxsize=1024)
+def statement_shape(statement: str) -> str:
+    """
+    Reduce a statement to its shape: literals and parameter lists are collapsed, so the same query run with
+    different values, or with IN lists of different lengths, has the same shape.
+    """
+    shape = _WHITESPACE.sub(" ", statement).strip()
+    shape = _PLACEHOLDER_LIST.sub("(?)", shape)
+    return _LITERAL.sub("?", shape)
+
+
+class QueryStats:
+    """
+    Database work done on behalf of one request.
+    """
+    __slots__ = ("count", "duration", "shapes")
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = Counter()
+
+    @property
+    def duration_ms(self) -> float:
+        return self.duration * 1000
+
+    def record(self, statement: str, elapsed: float) -> None:
+        self.count += 1
+        self.duration += elapsed
+        self.shapes[statement_shape(statement)] += 1
+
+    def repeated(self, threshold: int = settings.query_n_plus_one_threshold) -> List[Tuple[str, int]]:
+        """
+        Statement shapes run at least threshold times, most frequent first. A SELECT showing up here usually
+        means rows are being loaded one by one in a loop (an N+1 pattern) instead of in a single query.
+        """
+        return [(shape, count) for shape, count in self.shapes.most_common() if count >= threshold]
+
+
+# The middleware stores a fresh QueryStats here for every request. The object is mutated rather than replaced,
+# so updates made by tasks spawned from the request are visible to it.
+request_query_stats: ContextVar[Optional[QueryStats]] = ContextVar("request_query_stats", default=None)
+
+
+def _statement_operation(statement: str) -> str:
+    words = statement.lstrip().split(None, 1)
+    return words[0].upper() if words else "UNKNOWN"
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+
+def _record_statement(pool_name: str, statement: str, elapsed: float) -> None:
+    DB_STATEMENT_DURATION.labels(pool_name, _statement_operation(statement)).observe(elapsed)
+
+    elapsed_ms = elapsed * 1000
+
+    if elapsed_ms >= settings.db_slow_query_threshold_ms:
+        logger.warning("Slow query on %s (%.1f ms): %s", pool_name, elapsed_ms, statement)
+    elif settings.db_log_sample_rate and random.random() < settings.db_log_sample_rate:
+        logger.info("Sampled query on %s (%.1f ms): %s", pool_name, elapsed_ms, statement)
+
+
+def _handle_error(exception_context):
+    start_times = exception_context.connection.info.get("query_start_time") \
+        if exception_context.connection is not None else None
+    if start_times:
+        start_times.pop()
+
+
+def install_query_stats(engine: Engine, pool_name: str = "primary") -> None:
+    """
+    Time every statement run by engine: the duration is added to the current request's QueryStats, exported as
+    a metric, and logged when the statement is slow or picked by DB_LOG_SAMPLE_RATE.
+    """
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        start_times = conn.info.get("query_start_time")
+        if not start_times:
+            return
+
+        elapsed = time.perf_counter() - start_times.pop()
+
+        stats = request_query_stats.get()
+        if stats is not None:
+            stats.record(statement, elapsed)
+
+        _record_statement(pool_name, statement, elapsed)
+
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
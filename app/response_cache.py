@@ -0,0 +1,169 @@
+import asyncio
+import hashlib
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, Iterable, NamedTuple, Optional, Tuple
+
+from redis import Redis
+from starlette.concurrency import run_in_threadpool
+
+from app.config import settings
+
+CACHE_HIT = "HIT"
+CACHE_MISS = "MISS"
+CACHE_BYPASS = "BYPASS"
+
+CACHE_STATUS_HEADER = "X-Cache"
+
+
+class CachedResponse(NamedTuple):
+    body: bytes
+    headers: dict = {}
+
+
+class ResponseCache:
+    """
+    Cache of serialized response bodies, together with their validator headers, stored in Redis.
+
+    Every entry is tagged. Instead of tracking the keys that belong to a tag, each tag has a version counter that
+    is part of the entry key, so invalidating a tag is a single INCR and entries written by a request that raced
+    with the invalidation are simply never read again (they expire through their TTL).
+
+    The Redis client is synchronous: get_or_set makes its round trips in the threadpool, so the event loop never
+    waits on Redis.
+    """
+
+    def __init__(self, redis_client: Redis, namespace: str = "response_cache",
+                 ttl: int = settings.response_cache_ttl,
+                 lock_timeout: int = settings.response_cache_lock_timeout):
+        self.redis_client = redis_client
+        self.namespace = namespace
+        self.ttl = ttl
+        self.lock_timeout = lock_timeout
+
+    @staticmethod
+    def normalize_params(params: dict) -> str:
+        items = []
+        for name, value in sorted(params.items()):
+            if value is None:
+                continue
+            if isinstance(value, bool):
+                value = "1" if value else "0"
+            items.append(f"{name}={value}")
+        return "&".join(items)
+
+    def _tag_key(self, tag: str) -> str:
+        return f"{self.namespace}:tag:{tag}"
+
+    def build_key(self, name: str, params: dict, tags: Iterable[str]) -> str:
+        tags = sorted(tags)
+        versions = self.redis_client.mget([self._tag_key(tag) for tag in tags]) if tags else []
+        versions = ",".join((version or b"0").decode("utf-8") for version in versions)
+        digest = hashlib.sha1(f"{self.normalize_params(params)}|{versions}".encode("utf-8")).hexdigest()
+        return f"{self.namespace}:{name}:{digest}"
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        entry = self.redis_client.hgetall(key)
+        if not entry or b"body" not in entry:
+            return None
+        headers = {
+            field[7:].decode("utf-8"): value.decode("utf-8")
+            for field, value in entry.items() if field.startswith(b"header:")
+        }
+        return CachedResponse(entry[b"body"], headers)
+
+    def set(self, key: str, response: CachedResponse) -> None:
+        mapping = {"body": response.body}
+        mapping.update({f"header:{name}": value for name, value in response.headers.items()})
+
+        pipeline = self.redis_client.pipeline(transaction=True)
+        pipeline.hset(key, mapping=mapping)
+        pipeline.expire(key, self.ttl)
+        pipeline.execute()
+
+    def invalidate(self, *tags: str) -> None:
+        pipeline = self.redis_client.pipeline(transaction=False)
+        for tag in tags:
+            pipeline.incr(self._tag_key(tag))
+            pipeline.expire(self._tag_key(tag), max(self.ttl * 10, 3600))
+        pipeline.execute()
+
+    def lookup(self, name: str, params: dict, tags: Iterable[str]) -> Tuple[str, Optional[CachedResponse]]:
+        key = self.build_key(name, params, tags)
+        return key, self.get(key)
+
+    def _filled_channel(self, key: str) -> str:
+        return f"{key}:filled"
+
+    def fill(self, key: str, lock_key: str, lock_token: str, response: Optional[CachedResponse]) -> None:
+        """
+        Store the response built under the lock, release the lock and wake the requests waiting for it.
+        """
+        if response is not None:
+            self.set(key, response)
+        if self.redis_client.get(lock_key) == lock_token.encode("utf-8"):
+            self.redis_client.delete(lock_key)
+        self.redis_client.publish(self._filled_channel(key), "1")
+
+    def wait_for_fill(self, key: str, lock_key: str, timeout: float) -> Optional[CachedResponse]:
+        """
+        Block until the request holding lock_key has filled key or given up, for at most timeout seconds. The
+        channel is subscribed to before checking again, so a fill in between is not missed.
+        """
+        deadline = time.monotonic() + timeout
+        pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+        try:
+            pubsub.subscribe(self._filled_channel(key))
+            while True:
+                cached = self.get(key)
+                if cached is not None or not self.redis_client.exists(lock_key):
+                    return cached
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                pubsub.get_message(timeout=remaining)
+        finally:
+            pubsub.close()
+
+    async def _wait_for_fill(self, key: str, lock_key: str) -> Optional[CachedResponse]:
+        # the requests of this worker waiting for the same key share one wait, and so one thread
+        wait = _fill_waits.get(key)
+        if wait is None:
+            wait = asyncio.ensure_future(run_in_threadpool(self.wait_for_fill, key, lock_key, self.lock_timeout))
+            _fill_waits[key] = wait
+            wait.add_done_callback(lambda _: _fill_waits.pop(key, None))
+        return await asyncio.shield(wait)
+
+    async def get_or_set(self, name: str, params: dict, tags: Iterable[str],
+                         producer: Callable[[], Awaitable[Optional[CachedResponse]]]
+                         ) -> Tuple[Optional[CachedResponse], str]:
+        """
+        Return the cached response for the given parameters, or build it with producer and store it.
+
+        Only one request rebuilds a missing entry at a time; concurrent requests for the same key wait for it
+        instead of all hitting the database. A producer returning None means the response must not be cached.
+        """
+        key, cached = await run_in_threadpool(self.lookup, name, params, tags)
+        if cached is not None:
+            return cached, CACHE_HIT
+
+        lock_key = f"{key}:lock"
+        lock_token = uuid.uuid4().hex
+
+        if not await run_in_threadpool(self.redis_client.set, lock_key, lock_token, nx=True,
+                                       px=self.lock_timeout * 1000):
+            cached = await self._wait_for_fill(key, lock_key)
+            if cached is not None:
+                return cached, CACHE_HIT
+            return await producer(), CACHE_MISS
+
+        cached = None
+        try:
+            cached = await producer()
+            return cached, CACHE_MISS
+        finally:
+            await run_in_threadpool(self.fill, key, lock_key, lock_token, cached)
+
+
+# fills waited for by the requests of this worker, by key
+_fill_waits: Dict[str, asyncio.Future] = {}
@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import Dict, Optional
 
 from pydantic import BaseModel
 
@@ -7,8 +7,25 @@ class HealthCheck(BaseModel):
     status: str = "OK"
 
 
+class DependencyHealth(BaseModel):
+    status: str
+    latency_ms: float
+    detail: Optional[str] = None
+
+
+class ReadinessCheck(BaseModel):
+    status: str
+    checks: Dict[str, DependencyHealth]
+    checked_at: float
+
+
 class PaginationMetadata(BaseModel):
     total: int
     total_pages: Optional[int] = None
     page: Optional[int] = None
     per_page: Optional[int] = None
+
+
+class CursorPaginationMetadata(BaseModel):
+    limit: int
+    next_cursor: Optional[str] = None
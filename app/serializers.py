@@ -0,0 +1,39 @@
+from functools import lru_cache
+from typing import Any, Type
+
+import pydantic_core
+from fastapi import Response
+from pydantic import BaseModel
+
+
+class JSONBytesResponse(Response):
+    """
+    Response for bodies that are already serialized to JSON bytes.
+
+    Returning a Response from a route makes FastAPI skip response_model validation and serialization, so the
+    route keeps its response_model for the OpenAPI schema without paying for it at runtime.
+    """
+    media_type = "application/json"
+
+
+@lru_cache(maxsize=None)
+def schema_fields(schema: Type[BaseModel]) -> tuple:
+    return tuple(schema.model_fields)
+
+
+def project(schema: Type[BaseModel], obj: Any, prefix: str = "", **values) -> dict:
+    """
+    Pick the fields of schema from the attributes of obj, in schema order and without validating them.
+
+    Only meant for data whose types are already guaranteed, such as columns loaded from the database. Attributes
+    are looked up as prefix + field name, and keyword arguments take precedence over the attributes of obj.
+    """
+    return {name: values[name] if name in values else getattr(obj, prefix + name) for name in schema_fields(schema)}
+
+
+def dump_json(value: Any) -> bytes:
+    """
+    Serialize dicts, lists and schema instances to JSON bytes with pydantic-core, producing the same output as
+    the response_model serialization for the same data.
+    """
+    return pydantic_core.to_json(value)
@@ -0,0 +1,289 @@
+import abc
+import contextlib
+import errno
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+from typing import BinaryIO, Iterator, Optional
+from urllib.parse import quote
+
+from app.config import settings
+
+# boto3 is optional: install requirements-s3.txt and set STORAGE_BACKEND=s3 to keep the files in a bucket.
+
+
+class StorageBackend(abc.ABC):
+    """
+    Files stored under keys, paths relative to the storage root such as media/accounts/avatars/ab/cd/<name>.
+    Stored files are never modified in place: writing a key replaces its file as a whole.
+
+    The methods block on the filesystem or the network and are meant for run_in_threadpool.
+    """
+
+    # whether the files are on the local filesystem, under path(key)
+    local = False
+
+    @abc.abstractmethod
+    def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def open(self, key: str, offset: int = 0) -> BinaryIO:
+        """
+        The file for reading from offset on.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def put(self, key: str, source: BinaryIO) -> None:
+        """
+        Store the content of source, a seekable file, from its current position.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def put_file(self, key: str, path: str) -> None:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def link(self, source: str, target: str) -> bool:
+        """
+        Make target show the file at source without storing it again. Returns False when the backend cannot,
+        and the caller falls back to copy or to reading source directly.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def copy(self, source: str, target: str) -> None:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def url(self, key: str, filename: Optional[str] = None, public: bool = False) -> Optional[str]:
+        """
+        URL clients download the file from without going through the API, or None when the API serves it.
+        filename sets the name the file is saved under; public files may get a URL that does not expire.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def local_path(self, key: str) -> contextlib.AbstractContextManager:
+        """
+        Context manager giving a path on the local filesystem with the content of the file, for tools that only
+        read from paths. Files written next to it are discarded afterwards unless the backend is local.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def check(self) -> None:
+        """
+        Raise when the storage cannot be written to.
+        """
+        raise NotImplementedError
+
+
+class LocalStorage(StorageBackend):
+    """
+    Files under a directory of the local filesystem, served by the API. Links are hardlinks, so files are stored
+    read-only: writing through one link would change the content seen through the others.
+    """
+
+    local = True
+
+    def __init__(self, root: str):
+        self.root = root
+        self.temp_dir = os.path.join(root, ".tmp")
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self.path(key))
+
+    def open(self, key: str, offset: int = 0) -> BinaryIO:
+        file = open(self.path(key), "rb")
+        file.seek(offset)
+        return file
+
+    def _replace(self, key: str, write) -> None:
+        os.makedirs(self.temp_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.temp_dir)
+        try:
+            with os.fdopen(fd, "wb") as temp_file:
+                write(temp_file)
+            os.chmod(temp_path, 0o444)
+
+            path = self.path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+
+    def put(self, key: str, source: BinaryIO) -> None:
+        self._replace(key, lambda temp_file: shutil.copyfileobj(source, temp_file, 1024 * 1024))
+
+    def put_file(self, key: str, path: str) -> None:
+        if os.path.abspath(path) == os.path.abspath(self.path(key)):
+            return
+        with open(path, "rb") as source:
+            self.put(key, source)
+
+    def link(self, source: str, target: str) -> bool:
+        """
+        Raises FileNotFoundError when there is no file at source.
+        """
+        target_path = self.path(target)
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        temp_path = f"{target_path}.{uuid.uuid4().hex}.tmp"
+        try:
+            os.link(self.path(source), temp_path)
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                raise
+            # no hardlinks across filesystems, or on this one
+            shutil.copyfile(self.path(source), temp_path)
+        os.replace(temp_path, target_path)
+        return True
+
+    def copy(self, source: str, target: str) -> None:
+        self.put_file(target, self.path(source))
+
+    def delete(self, key: str) -> None:
+        try:
+            os.unlink(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def url(self, key: str, filename: Optional[str] = None, public: bool = False) -> Optional[str]:
+        return None
+
+    @contextlib.contextmanager
+    def local_path(self, key: str) -> Iterator[str]:
+        yield self.path(key)
+
+    def check(self) -> None:
+        with tempfile.NamedTemporaryFile(dir=self.root, prefix=".health-"):
+            pass
+
+
+class S3Storage(StorageBackend):
+    """
+    Files in a bucket of S3 or of a compatible store such as MinIO. Uploads and copies of large files go in
+    multipart parts sent in parallel, and clients download straight from the bucket through presigned URLs.
+    Buckets have no links, so link always returns False.
+    """
+
+    def __init__(self, bucket: str, endpoint_url: Optional[str] = None, region: Optional[str] = None,
+                 access_key_id: Optional[str] = None, secret_access_key: Optional[str] = None,
+                 public_url: Optional[str] = None, chunk_size: int = settings.s3_multipart_chunk_size,
+                 max_concurrency: int = settings.s3_max_concurrency, url_expires: int = settings.storage_url_expires):
+        self.bucket = bucket
+        self.endpoint_url = endpoint_url
+        self.region = region
+        self.access_key_id = access_key_id
+        self.secret_access_key = secret_access_key
+        self.public_url = public_url.rstrip("/") if public_url else None
+        self.chunk_size = chunk_size
+        self.max_concurrency = max_concurrency
+        self.url_expires = url_expires
+        self._client = None
+        self._transfer_config = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        # boto3 sessions are not thread-safe, so the client, which is, is created once and shared
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    import boto3
+                    from botocore.config import Config
+
+                    self._client = boto3.session.Session().client(
+                        "s3", endpoint_url=self.endpoint_url, region_name=self.region,
+                        aws_access_key_id=self.access_key_id, aws_secret_access_key=self.secret_access_key,
+                        config=Config(signature_version="s3v4", max_pool_connections=self.max_concurrency * 4))
+        return self._client
+
+    @property
+    def transfer_config(self):
+        if self._transfer_config is None:
+            from boto3.s3.transfer import TransferConfig
+
+            # files above chunk_size go in parts of chunk_size, max_concurrency of them at a time
+            self._transfer_config = TransferConfig(multipart_threshold=self.chunk_size,
+                                                   multipart_chunksize=self.chunk_size,
+                                                   max_concurrency=self.max_concurrency)
+        return self._transfer_config
+
+    def exists(self, key: str) -> bool:
+        from botocore.exceptions import ClientError
+
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+        return True
+
+    def open(self, key: str, offset: int = 0) -> BinaryIO:
+        return self.client.get_object(Bucket=self.bucket, Key=key, Range=f"bytes={offset}-")["Body"]
+
+    def put(self, key: str, source: BinaryIO) -> None:
+        self.client.upload_fileobj(source, self.bucket, key, Config=self.transfer_config)
+
+    def put_file(self, key: str, path: str) -> None:
+        self.client.upload_file(path, self.bucket, key, Config=self.transfer_config)
+
+    def link(self, source: str, target: str) -> bool:
+        return False
+
+    def copy(self, source: str, target: str) -> None:
+        # copied within the bucket, in parallel parts for large files
+        self.client.copy({"Bucket": self.bucket, "Key": source}, self.bucket, target, Config=self.transfer_config)
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    def url(self, key: str, filename: Optional[str] = None, public: bool = False) -> Optional[str]:
+        if public and self.public_url:
+            return f"{self.public_url}/{quote(key)}"
+
+        params = {"Bucket": self.bucket, "Key": key}
+        if filename:
+            params["ResponseContentDisposition"] = f"attachment; filename*=UTF-8''{quote(filename)}"
+        return self.client.generate_presigned_url("get_object", Params=params, ExpiresIn=self.url_expires)
+
+    @contextlib.contextmanager
+    def local_path(self, key: str) -> Iterator[str]:
+        temp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(temp_dir, os.path.basename(key))
+            self.client.download_file(self.bucket, key, path, Config=self.transfer_config)
+            yield path
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    def check(self) -> None:
+        self.client.head_bucket(Bucket=self.bucket)
+
+
+def create_storage() -> StorageBackend:
+    if settings.storage_backend == "s3":
+        return S3Storage(settings.s3_bucket, endpoint_url=settings.s3_endpoint_url, region=settings.s3_region,
+                         access_key_id=settings.s3_access_key_id, secret_access_key=settings.s3_secret_access_key,
+                         public_url=settings.s3_public_url)
+    if settings.storage_backend != "local":
+        raise ValueError(f"Unknown STORAGE_BACKEND {settings.storage_backend!r}, expected local or s3")
+    return LocalStorage(settings.static_dir)
+
+
+storage = create_storage()
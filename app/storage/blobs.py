@@ -0,0 +1,101 @@
+import hashlib
+import os
+from typing import BinaryIO, NamedTuple, Optional
+
+from app.config import settings
+from app.storage.backends import StorageBackend, storage
+from app.storage.layout import fanout
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class StoredBlob(NamedTuple):
+    digest: str
+    size: int
+    # False when the content was already stored and nothing was written
+    created: bool
+
+
+def hash_file(source: BinaryIO) -> StoredBlob:
+    hasher = hashlib.sha256()
+    size = 0
+    while chunk := source.read(CHUNK_SIZE):
+        hasher.update(chunk)
+        size += len(chunk)
+    return StoredBlob(hasher.hexdigest(), size, False)
+
+
+class BlobStore:
+    """
+    Files stored once under the SHA-256 of their content, at <blobs_dir>/sha256/<ab>/<cd>/<digest> in the
+    storage backend. Model directories and avatars link to them where the backend has links, so a file uploaded
+    to many models takes its space once, and replacing a model file never changes the content seen through
+    other links.
+
+    The methods block on the backend and are meant for run_in_threadpool.
+    """
+
+    def __init__(self, backend: StorageBackend = storage, prefix: str = settings.blobs_dir):
+        self.backend = backend
+        self.prefix = prefix
+
+    def key(self, digest: str) -> str:
+        return os.path.join(self.prefix, "sha256", *fanout(digest, 2), digest)
+
+    def path(self, digest: str) -> str:
+        """
+        Path of the blob on the local filesystem, for local backends only.
+        """
+        return self.backend.path(self.key(digest))
+
+    def exists(self, digest: str) -> bool:
+        return self.backend.exists(self.key(digest))
+
+    def open(self, digest: str, offset: int = 0) -> BinaryIO:
+        return self.backend.open(self.key(digest), offset)
+
+    def hash(self, source: BinaryIO) -> StoredBlob:
+        source.seek(0)
+        return hash_file(source)
+
+    def put(self, source: BinaryIO, blob: StoredBlob) -> StoredBlob:
+        """
+        Store the content of source, a seekable file hashed as blob, unless it is already stored.
+        """
+        if self.exists(blob.digest):
+            return blob
+
+        source.seek(0)
+        # a concurrent upload of the same content replaces the blob with identical bytes
+        self.backend.put(self.key(blob.digest), source)
+        return blob._replace(created=True)
+
+    def write(self, source: BinaryIO) -> StoredBlob:
+        """
+        Store the content of source, a seekable file. The content is hashed first, so content that is already
+        stored is never written again.
+        """
+        return self.put(source, self.hash(source))
+
+    def link(self, digest: str, target: str) -> bool:
+        """
+        Make the storage key target a link to the blob, replacing what target was. Returns False when the backend
+        has no links. Raises FileNotFoundError for unknown blobs.
+        """
+        return self.backend.link(self.key(digest), target)
+
+    def place(self, digest: str, target: str) -> None:
+        """
+        Put the content of the blob at the storage key target, linked where the backend can, copied otherwise.
+        """
+        if not self.link(digest, target):
+            self.backend.copy(self.key(digest), target)
+
+    def url(self, digest: str, filename: Optional[str] = None, public: bool = False) -> Optional[str]:
+        return self.backend.url(self.key(digest), filename, public)
+
+    def delete(self, digest: str) -> None:
+        self.backend.delete(self.key(digest))
+
+
+blob_store = BlobStore()
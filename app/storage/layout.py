@@ -0,0 +1,37 @@
+import hashlib
+import os
+from typing import List
+
+from app.config import settings
+
+AVATARS_DIR = "accounts/avatars"
+
+
+def fanout(digest: str, levels: int = settings.storage_fanout_levels) -> List[str]:
+    """
+    Directory levels for a hex digest, two characters each: 256 entries per level at most.
+    """
+    return [digest[2 * level:2 * level + 2] for level in range(levels)]
+
+
+def shard_path(root: str, key: str, *parts: str) -> str:
+    """
+    Path of key under root, fanned out by the hash of key so no directory grows past a few thousand entries.
+    The hash is of the key itself, so the path can be computed again from the key alone.
+    """
+    return os.path.join(root, *fanout(hashlib.sha256(key.encode("utf-8")).hexdigest()), key, *parts)
+
+
+def avatar_path(file_name: str) -> str:
+    """
+    Path of an avatar relative to the static directory; its renditions sit next to it.
+    """
+    return shard_path(os.path.join(settings.media_dir, AVATARS_DIR), file_name)
+
+
+def model_dir(username: str, name: str) -> str:
+    """
+    Directory of a model or repository relative to the static directory, grouped by owner.
+    """
+    return shard_path(settings.models_dir, username, name)
+
@@ -0,0 +1,251 @@
+"""
+Move avatars and model and repository directories to the hash-sharded layout of app.storage.layout, without
+downtime.
+
+    python -m app.storage.migrate_layout migrate --journal moves.jsonl
+    python -m app.storage.migrate_layout cleanup --journal moves.jsonl
+
+migrate walks users, models and repositories in batches of --batch-size rows. For every row whose path is not
+where the layout puts it, the files are hardlinked into the new location first and the row is updated after,
+so both paths serve the same files while the migration runs; a row changed meanwhile is left alone. Files
+uploaded to the old location between linking and the update are linked again right after it. Every move is
+appended to the journal. Running migrate again only picks up rows it has not moved yet.
+
+cleanup deletes the old locations listed in the journal, once nothing points at them: run it after the API
+servers run the new layout and response caches have expired (RESPONSE_CACHE_TTL). Files still missing from
+the new location are linked before the old ones are deleted.
+
+Only the local storage backend has directories to move; with STORAGE_BACKEND=s3, model files are read through
+their manifests and avatars were stored under the new layout from the start.
+"""
+import argparse
+import asyncio
+import errno
+import glob
+import json
+import os
+import shutil
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select, update
+
+from app.config import settings
+from app.database import async_session, async_engine
+from app.dependencies import get_response_cache
+from app.storage.layout import AVATARS_DIR, avatar_path, model_dir
+from app.v1.accounts.models import User
+from app.v1.accounts.utils import invalidate_user_cache
+from app.v1.models.models import Model
+from app.v1.models.utils import invalidate_model_cache
+from app.v1.repositories.models import Repository
+
+TABLES = {
+    "users": (User, User.avatar),
+    "models": (Model, Model.path),
+    "repositories": (Repository, Repository.path),
+}
+
+
+def static_path(path: str) -> str:
+    return os.path.join(settings.static_dir, path)
+
+
+def link_file(source: str, target: str) -> bool:
+    if os.path.exists(target):
+        return False
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    try:
+        os.link(source, target)
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+            raise
+        shutil.copy2(source, target)
+    return True
+
+
+def avatar_files(path: str) -> List[str]:
+    """
+    The avatar at path and its renditions, <name>-<width>x<height><ext>.
+    """
+    stem, ext = os.path.splitext(path)
+    return [path] + glob.glob(f"{glob.escape(stem)}-*x*{glob.escape(ext)}")
+
+
+def link_avatar(old: str, new: str) -> int:
+    target_dir = os.path.dirname(static_path(new))
+    old_stem, new_stem = os.path.splitext(os.path.basename(old))[0], os.path.splitext(os.path.basename(new))[0]
+
+    linked = 0
+    for source in avatar_files(static_path(old)):
+        if os.path.exists(source):
+            name = new_stem + os.path.basename(source)[len(old_stem):]
+            linked += link_file(source, os.path.join(target_dir, name))
+    return linked
+
+
+def link_tree(old: str, new: str) -> int:
+    linked = 0
+    for directory, _, files in os.walk(static_path(old)):
+        target_dir = os.path.join(static_path(new), os.path.relpath(directory, static_path(old)))
+        for name in files:
+            linked += link_file(os.path.join(directory, name), os.path.join(target_dir, name))
+    return linked
+
+
+def remove_empty_parents(path: str, root: str) -> None:
+    directory = os.path.dirname(path)
+    while os.path.abspath(directory).startswith(os.path.abspath(root) + os.sep):
+        try:
+            os.rmdir(directory)
+        except OSError:
+            return
+        directory = os.path.dirname(directory)
+
+
+def target_path(table: str, row) -> Optional[str]:
+    if table == "users":
+        return avatar_path(os.path.basename(row.path)) if row.path else None
+    return model_dir(row.username, row.name)
+
+
+def link(table: str, old: str, new: str) -> int:
+    return link_avatar(old, new) if table == "users" else link_tree(old, new)
+
+
+def remove(table: str, old: str, new: str) -> None:
+    if table == "users":
+        for path in avatar_files(static_path(old)):
+            os.unlink(path)
+        remove_empty_parents(static_path(old), static_path(os.path.join(settings.media_dir, AVATARS_DIR)))
+    elif not os.path.abspath(static_path(new)).startswith(os.path.abspath(static_path(old)) + os.sep):
+        shutil.rmtree(static_path(old), ignore_errors=True)
+        remove_empty_parents(static_path(old), static_path(settings.models_dir))
+
+
+def select_batch(table: str, after, batch_size: int):
+    entity, column = TABLES[table]
+    if table == "users":
+        query = select(User.id, User.username, User.avatar.label("path"))
+    else:
+        query = (select(entity.id, entity.name, column.label("path"), User.username)
+                 .join(User, entity.owner_id == User.id))
+    if after is not None:
+        query = query.filter(entity.id > after)
+    return query.order_by(entity.id).limit(batch_size)
+
+
+async def migrate_table(table: str, batch_size: int, journal, dry_run: bool) -> Tuple[int, int]:
+    entity, column = TABLES[table]
+    response_cache = get_response_cache()
+    after, moved, files = None, 0, 0
+
+    while True:
+        async with async_session() as session:
+            rows = (await session.execute(select_batch(table, after, batch_size))).all()
+        if not rows:
+            return moved, files
+        after = rows[-1].id
+
+        moves = [(row, row.path, target_path(table, row)) for row in rows]
+        moves = [(row, old, new) for row, old, new in moves if new is not None and old != new]
+        if dry_run:
+            moved += len(moves)
+            continue
+
+        for row, old, new in moves:
+            files += await asyncio.to_thread(link, table, old, new)
+
+        applied = []
+        async with async_session() as session:
+            for row, old, new in moves:
+                result = await session.execute(update(entity).where(entity.id == row.id, column == old)
+                                               .values({column: new}))
+                if result.rowcount == 1:
+                    applied.append((row, old, new))
+            await session.commit()
+
+        for row, old, new in applied:
+            # uploads that reached the old location while the row still pointed there
+            files += await asyncio.to_thread(link, table, old, new)
+            journal.write(json.dumps({"table": table, "id": str(row.id), "old": old, "new": new}) + "\n")
+            if table == "users":
+                invalidate_user_cache(response_cache, row.username)
+            else:
+                invalidate_model_cache(response_cache, row.username, row.name)
+        journal.flush()
+
+        moved += len(applied)
+        print(f"{table}: {moved} rows moved, {files} files linked")
+
+
+async def cleanup(journal_path: str, batch_size: int, dry_run: bool) -> Dict[str, int]:
+    with open(journal_path) as journal:
+        entries = [json.loads(line) for line in journal if line.strip()]
+
+    removed = {table: 0 for table in TABLES}
+    for start in range(0, len(entries), batch_size):
+        batch = entries[start:start + batch_size]
+
+        current, referenced = {}, set()
+        async with async_session() as session:
+            for table, (entity, column) in TABLES.items():
+                table_entries = [entry for entry in batch if entry["table"] == table]
+                if not table_entries:
+                    continue
+                ids = [uuid.UUID(entry["id"]) for entry in table_entries]
+                result = await session.execute(select(entity.id, column).filter(entity.id.in_(ids)))
+                current.update({(table, str(row_id)): path for row_id, path in result.all()})
+                # users with the same avatar share its file
+                olds = [entry["old"] for entry in table_entries]
+                result = await session.execute(select(column).filter(column.in_(olds)))
+                referenced.update((table, path) for path in result.scalars())
+
+        for entry in batch:
+            table, old, new = entry["table"], entry["old"], entry["new"]
+            path = current.get((table, entry["id"]))
+            # the row was moved again since, or some row still points at the old location
+            if (path is not None and path != new) or (table, old) in referenced:
+                continue
+            if not os.path.exists(static_path(old)):
+                continue
+            if dry_run:
+                removed[table] += 1
+                continue
+            if path == new:
+                await asyncio.to_thread(link, table, old, new)
+            await asyncio.to_thread(remove, table, old, new)
+            removed[table] += 1
+
+    return removed
+
+
+async def run(args: argparse.Namespace) -> None:
+    try:
+        if args.command == "migrate":
+            with open(args.journal, "a") as journal:
+                for table in args.tables:
+                    moved, files = await migrate_table(table, args.batch_size, journal, args.dry_run)
+                    print(f"{table}: {moved} rows {'to move' if args.dry_run else 'moved'}, {files} files linked")
+        else:
+            removed = await cleanup(args.journal, args.batch_size, args.dry_run)
+            for table, count in removed.items():
+                print(f"{table}: {count} old locations {'to remove' if args.dry_run else 'removed'}")
+    finally:
+        await async_engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["migrate", "cleanup"])
+    parser.add_argument("--journal", required=True, help="file the moves are appended to, and read back by cleanup")
+    parser.add_argument("--batch-size", type=int, default=500, help="rows per batch")
+    parser.add_argument("--tables", nargs="+", choices=list(TABLES), default=list(TABLES), help="tables to migrate")
+    parser.add_argument("--dry-run", action="store_true", help="count the rows without changing anything")
+    args = parser.parse_args()
+
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
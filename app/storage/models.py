@@ -0,0 +1,15 @@
+from sqlalchemy import Column, String, DateTime, func, BigInteger, Integer, Index
+from app.database import Base
+
+
+class Blob(Base):
+    __tablename__ = "blobs"
+
+    digest = Column(String(64), primary_key=True)
+    size = Column(BigInteger, nullable=False)
+    # model files and avatars pointing at the blob; unreferenced blobs are collected after a grace period
+    refcount = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (Index("ix_blobs_unreferenced", "updated_at", postgresql_where=refcount <= 0),)
@@ -0,0 +1,102 @@
+import datetime
+from collections import Counter
+from typing import Dict, List
+
+from sqlalchemy import func, update, delete, select, bindparam
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.storage.models import Blob
+
+
+class BlobsService:
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def get_blobs(self, digests: List[str]) -> Dict[str, Blob]:
+        if not digests:
+            return {}
+        query = select(Blob).filter(Blob.digest.in_(digests))
+        result = await self.session.execute(query)
+        return {blob.digest: blob for blob in result.scalars()}
+
+    async def lock(self, *digests: str) -> None:
+        """
+        Lock the blobs until the transaction ends. References are added and blobs collected under these locks, so
+        a blob is never collected between finding its content stored and referencing it.
+
+        The locks are taken in digest order: a transaction changing several blobs locks all of them first, in one
+        call, so two transactions sharing blobs never wait on each other.
+        """
+        for digest in sorted(set(digests)):
+            await self.session.execute(select(func.pg_advisory_xact_lock(func.hashtext(digest))))
+
+    async def register(self, digest: str, size: int) -> None:
+        """
+        Record the blob before its content is written, unreferenced unless it already is, for a transaction of
+        its own to commit. Content whose request fails before referencing it is then collected like any other
+        unreferenced blob, after the grace period that also covers the upload.
+        """
+        await self.lock(digest)
+        query = (insert(Blob)
+                 .values(digest=digest, size=size, refcount=0)
+                 .on_conflict_do_update(index_elements=[Blob.digest], set_={"updated_at": func.now()},
+                                        where=Blob.refcount <= 0))
+        await self.session.execute(query)
+
+    async def add_reference(self, digest: str, size: int) -> int:
+        """
+        Reference the blob under its lock and return its reference count. At 1, the blob was unreferenced and
+        its content may have been collected before the lock was taken.
+        """
+        await self.lock(digest)
+        query = (insert(Blob)
+                 .values(digest=digest, size=size, refcount=1)
+                 .on_conflict_do_update(index_elements=[Blob.digest],
+                                        set_={"refcount": Blob.refcount + 1, "updated_at": func.now()})
+                 .returning(Blob.refcount))
+        result = await self.session.execute(query)
+        return result.scalar_one()
+
+    async def release(self, digest: str) -> None:
+        query = (update(Blob)
+                 .where(Blob.digest == digest)
+                 .values(refcount=Blob.refcount - 1, updated_at=func.now()))
+        await self.session.execute(query)
+
+    async def add_references(self, digests: List[str]) -> None:
+        """
+        Reference each of digests once per occurrence, for blobs known to be stored.
+        """
+        await self._adjust_references(Counter(digests))
+
+    async def release_references(self, digests: List[str]) -> None:
+        await self._adjust_references({digest: -count for digest, count in Counter(digests).items()})
+
+    async def _adjust_references(self, counts: Dict[str, int]) -> None:
+        if not counts:
+            return
+        blobs = Blob.__table__
+        query = (update(blobs)
+                 .where(blobs.c.digest == bindparam("blob_digest"))
+                 .values(refcount=blobs.c.refcount + bindparam("blob_count"), updated_at=func.now()))
+        # rows are updated in digest order, the order the locks are taken in
+        await self.session.execute(query, [{"blob_digest": digest, "blob_count": count}
+                                           for digest, count in sorted(counts.items())])
+
+    async def get_unreferenced(self, unreferenced_since: datetime.datetime) -> List[str]:
+        query = select(Blob.digest).where(Blob.refcount <= 0, Blob.updated_at < unreferenced_since)
+        result = await self.session.execute(query)
+        return list(result.scalars())
+
+    async def collect(self, digest: str, unreferenced_since: datetime.datetime) -> bool:
+        """
+        Delete the blob under its lock if nobody referenced it since unreferenced_since. The caller removes the
+        content before committing, so the lock covers both and no reference is taken in between.
+        """
+        await self.lock(digest)
+        query = (delete(Blob)
+                 .where(Blob.digest == digest, Blob.refcount <= 0, Blob.updated_at < unreferenced_since)
+                 .returning(Blob.digest))
+        result = await self.session.execute(query)
+        return result.scalar() is not None
@@ -0,0 +1,36 @@
+from typing import BinaryIO, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from app.database import async_session
+from app.storage.blobs import StoredBlob, blob_store
+from app.storage.service import BlobsService
+
+
+async def store_blob(source: BinaryIO) -> StoredBlob:
+    """
+    Store the content of source, a seekable file, as a blob. The blob is recorded before its content is written,
+    so content left behind by a request that fails before referencing it is still garbage collected.
+    """
+    blob = await run_in_threadpool(blob_store.hash, source)
+    async with async_session() as session:
+        await BlobsService(session).register(blob.digest, blob.size)
+        await session.commit()
+    return await run_in_threadpool(blob_store.put, source, blob)
+
+
+async def reference_blob(blobs_service: BlobsService, digest: str, size: int,
+                         source: Optional[BinaryIO] = None) -> None:
+    """
+    Reference the blob digest, making sure its content is stored: the garbage collection may have removed it
+    since it was found stored, and cannot any more once the reference is taken. Missing content is stored again
+    from source, the file it was written from; without one, raises FileNotFoundError.
+    """
+    if await blobs_service.add_reference(digest, size) > 1:
+        return
+    if await run_in_threadpool(blob_store.exists, digest):
+        return
+    if source is None:
+        await blobs_service.release(digest)
+        raise FileNotFoundError(digest)
+    await run_in_threadpool(blob_store.write, source)
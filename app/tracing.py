@@ -0,0 +1,160 @@
+import contextlib
+import json
+import logging
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.config import settings
+
+# OpenTelemetry is optional: install requirements-tracing.txt and set TRACING_ENABLED=True to record spans.
+# Without it every span() is a shared no-op context manager.
+try:
+    from opentelemetry import propagate, trace
+    from opentelemetry.trace import SpanKind, Status, StatusCode
+except ImportError:
+    propagate = trace = SpanKind = Status = StatusCode = None
+
+logger = logging.getLogger(__name__)
+
+_NOOP_SPAN = contextlib.nullcontext()
+
+tracer = None
+
+
+class FileSpanExporter:
+    """
+    Span exporter appending finished spans to a file, one JSON object per line, for local inspection.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def export(self, spans):
+        from opentelemetry.sdk.trace.export import SpanExportResult
+
+        with open(self.path, "a") as output:
+            for finished_span in spans:
+                output.write(json.dumps(json.loads(finished_span.to_json()), separators=(",", ":")) + "\n")
+        return SpanExportResult.SUCCESS
+
+    def shutdown(self):
+        pass
+
+    def force_flush(self, timeout_millis: int = 30000) -> bool:
+        return True
+
+
+def _create_exporter():
+    if settings.tracing_exporter == "otlp":
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        return OTLPSpanExporter(endpoint=settings.tracing_otlp_endpoint)
+    return FileSpanExporter(settings.tracing_file_path)
+
+
+def configure_tracing() -> bool:
+    """
+    Install a tracer provider exporting spans in batches from a background thread, so requests only pay for
+    recording them. Returns whether tracing is active.
+    """
+    global tracer
+
+    if not settings.tracing_enabled:
+        return False
+    if trace is None:
+        logger.warning("TRACING_ENABLED is set but OpenTelemetry is not installed; tracing stays off")
+        return False
+
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+
+    provider = TracerProvider(
+        resource=Resource.create({"service.name": settings.tracing_service_name}),
+        sampler=ParentBased(TraceIdRatioBased(settings.tracing_sample_ratio)),
+    )
+    provider.add_span_processor(BatchSpanProcessor(_create_exporter()))
+    trace.set_tracer_provider(provider)
+
+    tracer = trace.get_tracer("app")
+    return True
+
+
+def shutdown_tracing() -> None:
+    if tracer is not None:
+        # flushes the spans still waiting in the batch processor
+        trace.get_tracer_provider().shutdown()
+
+
+def span(name: str, attributes: Optional[dict] = None):
+    """
+    Context manager recording a span as a child of the current one; does nothing while tracing is off.
+    """
+    if tracer is None:
+        return _NOOP_SPAN
+    return tracer.start_as_current_span(name, attributes=attributes)
+
+
+def server_span(name: str, headers, attributes: Optional[dict] = None):
+    """
+    Span for an incoming request, continuing the trace of the caller when it sent a W3C traceparent header.
+    """
+    if tracer is None:
+        return _NOOP_SPAN
+    return tracer.start_as_current_span(name, context=propagate.extract(headers), kind=SpanKind.SERVER,
+                                        attributes=attributes)
+
+
+def inject_trace_headers(headers: dict) -> dict:
+    """
+    Add traceparent (and tracestate) for the current span to the headers of an outgoing request, such as a call
+    to an inference endpoint, so the downstream service joins the trace.
+    """
+    if tracer is not None:
+        propagate.inject(headers)
+    return headers
+
+
+def set_span_status(code: int) -> None:
+    if tracer is None:
+        return
+    current = trace.get_current_span()
+    current.set_attribute("http.status_code", code)
+    if code >= 500:
+        current.set_status(Status(StatusCode.ERROR))
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if tracer is None:
+        return
+    words = statement.lstrip().split(None, 1)
+    sql_span = tracer.start_span(f"postgres {words[0].upper() if words else 'QUERY'}", kind=SpanKind.CLIENT,
+                                 attributes={"db.system": "postgresql", "db.statement": statement})
+    conn.info.setdefault("trace_spans", []).append(sql_span)
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    spans = conn.info.get("trace_spans")
+    if spans:
+        spans.pop().end()
+
+
+def _handle_error(exception_context):
+    connection = exception_context.connection
+    spans = connection.info.get("trace_spans") if connection is not None else None
+    if spans:
+        sql_span = spans.pop()
+        sql_span.record_exception(exception_context.original_exception)
+        sql_span.set_status(Status(StatusCode.ERROR))
+        sql_span.end()
+
+
+def install_sql_tracing(engine: Engine) -> None:
+    """
+    Record a span for every statement run by engine.
+    """
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
@@ -1,4 +1,8 @@
+import base64
 import inspect
+import json
+import uuid
+from datetime import datetime
 from typing import Annotated
 from fastapi import Form
 
@@ -17,3 +21,45 @@ def as_form(cls):
     cls.__signature__ = cls.__signature__.replace(parameters=new_params)
 
     return cls
+
+
+def route_label(scope: dict) -> str:
+    """
+    Label requests by route template rather than by path, so /models/{username}/{model_name} is a single series.
+    Requests served by a mount (static files) are labelled with the mount path.
+    """
+    route = scope.get("route")
+    if route is not None:
+        return route.path_format
+    return scope.get("root_path") or "unmatched"
+
+
+def encode_cursor(*values) -> str:
+    """
+    Encode the sort key of the last item of a page into an opaque cursor.
+    """
+    data = json.dumps([value.isoformat() if isinstance(value, datetime) else str(value) for value in values])
+    return base64.urlsafe_b64encode(data.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> list:
+    """
+    Decode a cursor created by encode_cursor, raising ValueError when it is malformed.
+    """
+    try:
+        data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(data)
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+    if not isinstance(values, list):
+        raise ValueError("Invalid cursor")
+
+    return values
+
+
+def parse_uuid(value: str) -> uuid.UUID | None:
+    try:
+        return uuid.UUID(value)
+    except ValueError:
+        return None
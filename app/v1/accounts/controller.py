@@ -1,19 +1,35 @@
+import datetime
 import os
 import time
 import uuid
-from typing import List
+from typing import Optional
 
-import aiofiles as aiofiles
-from fastapi import APIRouter, Depends, status, Response, BackgroundTasks
+from fastapi import APIRouter, Depends, status, Response, Query, Request
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from starlette.concurrency import run_in_threadpool
 
+from app.conditional import make_etag, validator_headers, is_not_modified, not_modified_response
 from app.config import settings
-from app.dependencies import get_accounts_service, cache
-from app.v1.accounts.schedulers import scheduler
-from app.v1.accounts.schemas import UserRead, UserCreate, Token, RefreshTokenRequest, LogoutRequest
+from app.database import async_session
+from app.dependencies import get_accounts_service, cache, get_job_queue, get_blobs_service
+from app.exceptions import InvalidCursorException
+from app.jobs.queue import JobQueue
+from app.metrics import observe_upload, observe_blob_write
+from app.schemas import CursorPaginationMetadata
+from app.serializers import JSONBytesResponse, dump_json, project
+from app.storage.backends import storage
+from app.storage.blobs import blob_store
+from app.storage.layout import avatar_path
+from app.storage.service import BlobsService
+from app.storage.utils import reference_blob, store_blob
+from app.tracing import span
+from app.utils import encode_cursor, decode_cursor, parse_uuid
+from app.v1.accounts.schemas import UserRead, UserCreate, Token, RefreshTokenRequest, LogoutRequest, \
+    PaginatedUserResponse, UserBatchRequest, UserBatchResponse
 from app.v1.accounts.service import AccountsService
 from app.v1.accounts.utils import set_cookies, create_access_token, create_refresh_token, \
-    unset_cookies, generate_image_resolutions, encrypt_refresh_token, verify_refresh_token, verify_access_token
+    unset_cookies, encrypt_refresh_token, verify_refresh_token, verify_access_token
 from app.v1.accounts.exceptions import InvalidRefreshTokenException, InvalidGrantTypeException, \
     MissingUserFieldsException, IncorrectFieldsException, UserAlreadyExistsException, InvalidFileTypeException, \
     InvalidFileSizeException, InvalidCredentialsException, UserNotFoundException
@@ -23,12 +39,11 @@ router = APIRouter()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/v1/accounts/login")
 optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/v1/accounts/login", auto_error=False)
 
-scheduler.start()
-
 
 @router.post("/register", response_model=Token, status_code=status.HTTP_201_CREATED)
-async def register(response: Response, background_tasks: BackgroundTasks, user: UserCreate = Depends(),
-                   redis_client: cache = Depends(cache),
+async def register(response: Response, user: UserCreate = Depends(),
+                   redis_client: cache = Depends(cache), job_queue: JobQueue = Depends(get_job_queue),
+                   blobs_service: BlobsService = Depends(get_blobs_service(BlobsService)),
                    accounts_service: AccountsService = Depends(get_accounts_service(AccountsService))):
     existing_user = await accounts_service.get_user_by_username(user.username)
 
@@ -54,21 +69,24 @@ async def register(response: Response, background_tasks: BackgroundTasks, user:
 
         _, ext = os.path.splitext(file.filename)
 
-        media_img_dir = os.path.join(settings.media_dir, 'accounts/avatars')
-        static_img_dir = os.path.join(settings.static_dir, media_img_dir)
+        upload_start = time.perf_counter()
+        with span("blobs.write", {"kind": "avatar"}):
+            blob = await store_blob(file.file)
+        observe_upload("avatar", blob.size, upload_start)
+        observe_blob_write("avatar", blob.size, blob.created)
 
-        os.makedirs(static_img_dir, exist_ok=True)
+        # avatars are named by their content, so users with the same picture share the file and its renditions
+        file_name = f'{blob.digest}{ext.lower()}'
 
-        file_name = f'{uuid.uuid4().hex}-avatar{ext}'
+        media_img_url = avatar_path(file_name)
 
-        static_img_file = os.path.join(static_img_dir, file_name)
-        media_img_url = os.path.join(media_img_dir, file_name)
+        await reference_blob(blobs_service, blob.digest, blob.size, file.file)
 
-        async with aiofiles.open(static_img_file, mode='wb') as buffer:
-            while content := await file.read(4096):
-                await buffer.write(content)
+        if not await run_in_threadpool(storage.exists, media_img_url):
+            await run_in_threadpool(blob_store.place, blob.digest, media_img_url)
 
-        background_tasks.add_task(generate_image_resolutions, file_path=static_img_file, sizes=settings.avatar_sizes)
+        job_queue.enqueue("resize_avatar", {"key": media_img_url, "sizes": settings.avatar_sizes},
+                          idempotency_key=f"avatar:{file_name}")
 
     user = await accounts_service.create_user(user, media_img_url)
 
@@ -235,13 +253,70 @@ async def logout(response: Response, request: LogoutRequest, token: str = Depend
     return {'message': 'Logout successful'}
 
 
-@router.get("/", response_model=List[UserRead])
-async def read_users(accounts_service: AccountsService = Depends(get_accounts_service(AccountsService))):
-    return await accounts_service.get_all_users()
+@router.get("/", response_model=PaginatedUserResponse)
+async def read_users(
+        cursor: Optional[str] = Query(None, description="Cursor returned by the previous page"),
+        limit: int = Query(settings.accounts_page_size, description="Users per page", ge=1,
+                           le=settings.accounts_max_page_size),
+        accounts_service: AccountsService = Depends(get_accounts_service(AccountsService))):
+    after = None
+
+    if cursor is not None:
+        try:
+            created_at, user_id = decode_cursor(cursor)
+            after = (datetime.datetime.fromisoformat(created_at), uuid.UUID(user_id))
+        except (ValueError, TypeError):
+            raise InvalidCursorException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+    users = await accounts_service.get_user_rows_page(limit, after)
+
+    next_cursor = None
+    if len(users) > limit:
+        users = users[:limit]
+        next_cursor = encode_cursor(users[-1].created_at, users[-1].id)
+
+    return JSONBytesResponse(dump_json({
+        "users": [project(UserRead, user) for user in users],
+        "metadata": CursorPaginationMetadata(limit=limit, next_cursor=next_cursor),
+    }))
+
+
+@router.get("/export", response_class=StreamingResponse,
+            responses={status.HTTP_200_OK: {"content": {"application/x-ndjson": {}}}})
+async def export_users():
+    # the export outlives the request-scoped session, so it reads through a session of its own. It is
+    # transactional, since the server-side cursor needs a transaction, but can still be served by a replica.
+    async def generate_ndjson():
+        async with async_session(info={"read_only": True}) as session:
+            async for users in AccountsService(session).stream_user_rows(settings.accounts_export_batch_size):
+                yield b"".join(dump_json(project(UserRead, user)) + b"\n" for user in users)
+
+    return StreamingResponse(generate_ndjson(), media_type="application/x-ndjson")
+
+
+@router.post("/batch", response_model=UserBatchResponse, status_code=status.HTTP_200_OK)
+async def read_users_batch(
+        request: UserBatchRequest,
+        accounts_service: AccountsService = Depends(get_accounts_service(AccountsService))):
+    user_ids = {reference: user_id for reference in request.users if (user_id := parse_uuid(reference)) is not None}
+
+    # usernames may look like UUIDs too, so every reference is also looked up as a username; an id match wins
+    users = await accounts_service.get_user_rows_by_references(list(set(user_ids.values())), list(set(request.users)))
+
+    users_by_id = {user.id: user for user in users}
+    users_by_username = {user.username: user for user in users}
+
+    results = {}
+
+    for reference in request.users:
+        user = users_by_id.get(user_ids.get(reference)) or users_by_username.get(reference)
+        results[reference] = project(UserRead, user) if user is not None else None
+
+    return JSONBytesResponse(dump_json({"users": results}))
 
 
 @router.get('/me', response_model=UserRead)
-async def read_me(token: str = Depends(oauth2_scheme),
+async def read_me(request: Request, response: Response, token: str = Depends(oauth2_scheme),
                   redis_client: cache = Depends(cache),
                   accounts_service: AccountsService = Depends(get_accounts_service(AccountsService))):
 
@@ -264,15 +339,30 @@ async def read_me(token: str = Depends(oauth2_scheme),
         raise InvalidCredentialsException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token revoked",
                                           headers={"WWW-Authenticate": "Bearer"})
 
+    headers = validator_headers(make_etag(user.id, user.updated_at), user.updated_at)
+
+    if is_not_modified(request, headers["ETag"], headers.get("Last-Modified")):
+        return not_modified_response(headers)
+
+    response.headers.update(headers)
+
     return user
 
 
 @router.get("/{username}/", response_model=UserRead)
 async def read_user(
-        username: str, accounts_service: AccountsService = Depends(get_accounts_service(AccountsService))):
+        username: str, request: Request, response: Response,
+        accounts_service: AccountsService = Depends(get_accounts_service(AccountsService))):
     user = await accounts_service.get_user_by_username(username)
 
     if user is None:
         raise UserNotFoundException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
 
+    headers = validator_headers(make_etag(user.id, user.updated_at), user.updated_at)
+
+    if is_not_modified(request, headers["ETag"], headers.get("Last-Modified")):
+        return not_modified_response(headers)
+
+    response.headers.update(headers)
+
     return user
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, DateTime, func
+from sqlalchemy import Column, String, DateTime, func, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.dialects.postgresql import UUID
 from app.database import Base
@@ -17,9 +17,13 @@ class User(Base):
     github_username = Column(String)
     twitter_username = Column(String)
     homepage_url = Column(String)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
     models = relationship("Model", back_populates="owner", cascade="all, delete-orphan")
     repositories = relationship("Repository", back_populates="owner", cascade="all, delete-orphan")
 
+    # keyset pagination of the user listing walks (created_at, id), so created_at is never null
+    __table_args__ = (Index("ix_users_created_at_id", "created_at", "id"),)
+
     def __repr__(self):
         return f"id: {self.id}, username: {self.username}"
@@ -1,14 +1,70 @@
+import datetime
+import logging
 import time
+import uuid
+from typing import Optional
 from app.config import settings
-from app.dependencies import cache
+from app.dependencies import cache, get_job_queue
 from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.jobstores.memory import MemoryJobStore
 from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
 from apscheduler.executors.pool import ThreadPoolExecutor
 
-redis_client = cache()
+logger = logging.getLogger(__name__)
+
+# extends the lease only while it still holds this worker's token
+RENEW_LEASE_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("PEXPIRE", KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+class SchedulerLeadership:
+    """
+    Redis lease electing the one worker that runs the scheduled jobs; every worker runs a scheduler, but jobs
+    return early everywhere except on the leader. The leader renews the lease well before it expires, and
+    another worker takes over within one lease period when the leader dies.
+    """
+
+    def __init__(self, key: str = "scheduler:leader", lease: int = settings.scheduler_lease_seconds):
+        self.key = key
+        self.lease = lease
+        self.token = uuid.uuid4().hex
+        self.is_leader = False
+
+    def acquire_or_renew(self) -> bool:
+        redis_client = cache()
+        try:
+            lease_ms = self.lease * 1000
+            if self.is_leader and redis_client.eval(RENEW_LEASE_SCRIPT, 1, self.key, self.token, lease_ms):
+                return True
+            self.is_leader = bool(redis_client.set(self.key, self.token, nx=True, px=lease_ms))
+        except Exception as e:
+            logger.warning("Could not renew the scheduler lease: %s", e)
+            self.is_leader = False
+        return self.is_leader
+
+    def leader_present(self) -> bool:
+        return bool(cache().exists(self.key))
+
+    def release(self) -> None:
+        redis_client = cache()
+        if self.is_leader and redis_client.get(self.key) == self.token.encode("utf-8"):
+            redis_client.delete(self.key)
+        self.is_leader = False
+
+
+leadership = SchedulerLeadership()
 
 
 def clear_expired_refresh_tokens():
+    if not leadership.is_leader:
+        return
+
+    redis_client = cache()
+
     for key in redis_client.scan_iter("refresh_tokens:*"):
 
         current_timestamp = int(time.time())
@@ -20,6 +76,11 @@ def clear_expired_refresh_tokens():
 
 
 def clear_expired_blacklisted_access_tokens():
+    if not leadership.is_leader:
+        return
+
+    redis_client = cache()
+
     for key in redis_client.scan_iter("access_tokens:*"):
         current_timestamp = int(time.time())
 
@@ -29,26 +90,83 @@ def clear_expired_blacklisted_access_tokens():
             redis_client.delete(key)
 
 
-jobstores = {
-    'default': SQLAlchemyJobStore(url=settings.sync_database_url)
-}
+scheduler: Optional[BackgroundScheduler] = None
+
+
+def enqueue_blob_collection():
+    if not leadership.is_leader:
+        return
+
+    # a worker deletes the unreferenced blobs; the key keeps it to one run per hour across leader changes
+    get_job_queue().enqueue("collect_blobs", idempotency_key=f"collect_blobs:{int(time.time()) // 3600}")
+
+
+def create_scheduler() -> BackgroundScheduler:
+    jobstores = {
+        'default': SQLAlchemyJobStore(url=settings.sync_database_url),
+        'local': MemoryJobStore(),
+    }
+
+    executors = {
+        'default': ThreadPoolExecutor(10)
+    }
+
+    new_scheduler = BackgroundScheduler(jobstores=jobstores, executors=executors)
+
+    new_scheduler.add_job(
+        clear_expired_refresh_tokens,
+        trigger='cron',
+        day_of_week=0,
+        misfire_grace_time=3600
+    )
+
+    new_scheduler.add_job(
+        clear_expired_blacklisted_access_tokens,
+        trigger='cron',
+        day_of_week=0,
+        misfire_grace_time=3600
+    )
+
+    new_scheduler.add_job(
+        enqueue_blob_collection,
+        trigger='interval',
+        hours=1,
+        id='enqueue_blob_collection',
+        jobstore='local',
+    )
+
+    new_scheduler.add_job(
+        leadership.acquire_or_renew,
+        trigger='interval',
+        seconds=max(settings.scheduler_lease_seconds // 3, 1),
+        id='scheduler_leadership',
+        jobstore='local',
+        next_run_time=datetime.datetime.now(),
+    )
+
+    return new_scheduler
+
+
+def start_scheduler() -> None:
+    """
+    Create and start the scheduler; called from the application lifespan, as creating the job store connects
+    to the database.
+    """
+    global scheduler
 
-executors = {
-    'default': ThreadPoolExecutor(10)
-}
+    if scheduler is None:
+        scheduler = create_scheduler()
+        scheduler.start()
 
-scheduler = BackgroundScheduler(jobstores=jobstores, executors=executors)
 
-scheduler.add_job(
-    clear_expired_refresh_tokens,
-    trigger='cron',
-    day_of_week=0,
-    misfire_grace_time=3600
-)
+def shutdown_scheduler() -> None:
+    """
+    Stop the scheduler, waiting for running jobs, and hand the lease over to another worker.
+    """
+    global scheduler
 
-scheduler.add_job(
-    clear_expired_blacklisted_access_tokens,
-    trigger='cron',
-    day_of_week=0,
-    misfire_grace_time=3600
-)
+    if scheduler is not None:
+        if scheduler.running:
+            scheduler.shutdown(wait=True)
+        scheduler = None
+    leadership.release()
@@ -1,8 +1,10 @@
 import datetime
 import uuid
-from typing import Optional
+from typing import Optional, List, Dict
 from fastapi import UploadFile
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from app.config import settings
+from app.schemas import CursorPaginationMetadata
 from app.utils import as_form
 
 
@@ -53,6 +55,20 @@ class UserRead(BaseModel):
         from_attributes = True
 
 
+class PaginatedUserResponse(BaseModel):
+    users: List[UserRead]
+    metadata: CursorPaginationMetadata
+
+
+class UserBatchRequest(BaseModel):
+    # user ids or usernames
+    users: List[str] = Field(..., min_length=1, max_length=settings.max_batch_size)
+
+
+class UserBatchResponse(BaseModel):
+    users: Dict[str, Optional[UserRead]]
+
+
 class UserLogin(BaseModel):
     username: str
     password: str
@@ -1,13 +1,16 @@
+import datetime
 import uuid
-from typing import List, Union
+from typing import List, Union, AsyncIterator, Optional, Tuple
 
-from sqlalchemy import select
+from sqlalchemy import select, tuple_, or_, Row
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.v1.accounts.models import User
-from app.v1.accounts.schemas import UserCreate, TokenPayload
+from app.v1.accounts.schemas import UserCreate, TokenPayload, UserRead
 from app.v1.accounts.utils import get_hashed_password, decode_access_token, verify_password, decode_refresh_token
 
+USER_READ_COLUMNS = tuple(getattr(User, field) for field in UserRead.model_fields)
+
 
 class AccountsService:
     def __init__(self, session: AsyncSession):
@@ -18,6 +21,52 @@ class AccountsService:
         result = await self.session.execute(query)
         return result.scalars().all()
 
+    async def get_user_rows_page(
+            self,
+            limit: int,
+            after: Optional[Tuple[datetime.datetime, uuid.UUID]] = None) -> List[Row]:
+        """
+        Return up to limit + 1 users ordered by (created_at, id), starting after the given sort key. The extra row
+        only tells the caller whether another page exists.
+        """
+        query = select(*USER_READ_COLUMNS).order_by(User.created_at, User.id).limit(limit + 1)
+
+        if after is not None:
+            query = query.filter(tuple_(User.created_at, User.id) > tuple_(*after))
+
+        result = await self.session.execute(query)
+        return result.all()
+
+    async def stream_user_rows(self, batch_size: int) -> AsyncIterator[List[Row]]:
+        """
+        Yield every user in batches read from a server-side cursor, so memory use does not grow with the table.
+        """
+        query = (select(*USER_READ_COLUMNS)
+                 .order_by(User.created_at, User.id)
+                 .execution_options(yield_per=batch_size))
+        result = await self.session.stream(query)
+        async for partition in result.partitions(batch_size):
+            yield partition
+
+    async def get_user_rows_by_references(self, user_ids: List[uuid.UUID], usernames: List[str]) -> List[Row]:
+        """
+        Resolve users by id and by username in a single query.
+        """
+        Q = []
+
+        if user_ids:
+            Q.append(User.id.in_(user_ids))
+
+        if usernames:
+            Q.append(User.username.in_(usernames))
+
+        if len(Q) == 0:
+            return []
+
+        query = select(*USER_READ_COLUMNS).filter(or_(*Q))
+        result = await self.session.execute(query)
+        return result.all()
+
     async def get_user(self, user_id: uuid.UUID) -> User:
         query = select(User).filter(User.id == user_id)
         result = await self.session.execute(query)
@@ -50,7 +99,7 @@ class AccountsService:
         return user
 
     async def create_user(self, user: UserCreate, file_url: str = '') -> (User, str, str):
-        hashed_password = get_hashed_password(user.password)
+        hashed_password = await get_hashed_password(user.password)
         user.password = hashed_password
 
         user_obj = User(**user.model_dump(exclude={'avatar'}), avatar=file_url)
@@ -63,6 +112,6 @@ class AccountsService:
 
     async def authenticate_user(self, username_or_email: str, password: str) -> (User, str, str):
         user = await self.get_user_by_username(username_or_email) or await self.get_user_by_email(username_or_email)
-        if not user or not verify_password(password, user.password):
+        if not user or not await verify_password(password, user.password):
             return None
         return user
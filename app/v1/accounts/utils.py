@@ -2,28 +2,59 @@ import json
 import os
 import secrets
 import string
+import time
 import uuid
 from datetime import datetime, timedelta
+from functools import lru_cache
 from typing import Union, Any, List
-from cryptography.fernet import Fernet
 from fastapi import HTTPException, status
 from jose import jwt
-from passlib.context import CryptContext
 from pydantic import ValidationError
-from PIL import Image
+from starlette.concurrency import run_in_threadpool
 from app.config import settings
+from app.metrics import BCRYPT_QUEUE_DEPTH, BCRYPT_DURATION, IMAGE_RESIZE_DURATION
+from app.response_cache import ResponseCache
+from app.tracing import span
 from app.v1.accounts.exceptions import InvalidCredentialsException
 from app.v1.accounts.schemas import TokenPayload
 
-password_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# passlib, cryptography's Fernet and PIL are imported on first use rather than at worker startup
 
 
-def get_hashed_password(password: str) -> str:
-    return password_context.hash(password)
+@lru_cache(maxsize=None)
+def get_password_context():
+    from passlib.context import CryptContext
+    return CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 
-def verify_password(password: str, hashed_pass: str) -> bool:
-    return password_context.verify(password, hashed_pass)
+@lru_cache(maxsize=None)
+def get_refresh_token_cipher():
+    from cryptography.fernet import Fernet
+    return Fernet(settings.jwt_refresh_encryption_secret_key)
+
+
+def _hash_password(password: str) -> str:
+    with BCRYPT_DURATION.labels("hash").time():
+        return get_password_context().hash(password)
+
+
+def _verify_password(password: str, hashed_pass: str) -> bool:
+    with BCRYPT_DURATION.labels("verify").time():
+        return get_password_context().verify(password, hashed_pass)
+
+
+# bcrypt runs in the threadpool, off the event loop; the queue depth counts the calls from before they wait for
+# a thread, so it shows how many are queued behind the others
+
+
+async def get_hashed_password(password: str) -> str:
+    with BCRYPT_QUEUE_DEPTH.track_inprogress():
+        return await run_in_threadpool(_hash_password, password)
+
+
+async def verify_password(password: str, hashed_pass: str) -> bool:
+    with BCRYPT_QUEUE_DEPTH.track_inprogress():
+        return await run_in_threadpool(_verify_password, password, hashed_pass)
 
 
 def create_token(secret_key: str, algorithm: str, subject: Union[str, Any], identifier: Union[str, Any], expires_delta: int = None) -> str:
@@ -48,13 +79,13 @@ def create_refresh_token(subject: Union[str, Any], identifier: Union[str, Any],
 
 
 def encrypt_refresh_token(refresh_token):
-    cipher_suite = Fernet(settings.jwt_refresh_encryption_secret_key)
+    cipher_suite = get_refresh_token_cipher()
     encrypted_refresh_token = cipher_suite.encrypt(refresh_token.encode('utf-8'))
     return encrypted_refresh_token
 
 
 def decrypt_refresh_token(encrypted_refresh_token):
-    cipher_suite = Fernet(settings.jwt_refresh_encryption_secret_key)
+    cipher_suite = get_refresh_token_cipher()
     decrypted_refresh_token = cipher_suite.decrypt(encrypted_refresh_token).decode('utf-8')
     return decrypted_refresh_token
 
@@ -76,9 +107,10 @@ def verify_access_token(given_access_token, access_tokens):
 
 def decode_token(token: str, secret_key: str, algorithms: List[str]) -> TokenPayload:
     try:
-        payload = jwt.decode(
-            token, secret_key, algorithms=algorithms
-        )
+        with span("jwt.decode"):
+            payload = jwt.decode(
+                token, secret_key, algorithms=algorithms
+            )
         token_data = TokenPayload(**payload)
 
         if datetime.fromtimestamp(token_data.exp) < datetime.now():
@@ -119,6 +151,11 @@ def unset_cookies(response):
     response.set_cookie('logged_in', '', -1)
 
 
+def invalidate_user_cache(response_cache: ResponseCache, username: str) -> None:
+    # listings embed the owner, so they go stale together with the user's own entries
+    response_cache.invalidate("models", f"user:{username}")
+
+
 def generate_secret_key(mode='hex', n=32):
     if mode == 'hex':
         return secrets.token_hex(n)
@@ -133,13 +170,21 @@ def generate_secret_key(mode='hex', n=32):
     if mode == 'base16':
         return secrets.token_bytes(n).decode('base16')
     if mode == 'aes':
+        from cryptography.fernet import Fernet
         return Fernet.generate_key()
     raise ValueError('mode must be one of hex, urlsafe, ascii, base64, base32, base16')
 
 
-def generate_image_resolutions(file_path: str, sizes=None) -> None:
+def generate_image_resolutions(file_path: str, sizes=None) -> List[str]:
+    """
+    Write the renditions of the image at file_path next to it, as <name>-<width>x<height><ext>, and return their
+    paths.
+    """
+    renditions = []
     if sizes is None:
-        return
+        return renditions
+
+    from PIL import Image
 
     for size in sizes:
         if isinstance(size, tuple) and len(size) == 2:
@@ -149,12 +194,19 @@ def generate_image_resolutions(file_path: str, sizes=None) -> None:
         else:
             continue
 
+        start = time.perf_counter()
+
         image = Image.open(file_path, mode='r')
         image = image.resize((width, height), Image.LANCZOS)
 
         filename, ext = os.path.splitext(file_path)
 
         image.save(f'{filename}-{width}x{height}{ext}')
+        renditions.append(f'{filename}-{width}x{height}{ext}')
+
+        IMAGE_RESIZE_DURATION.labels(f'{width}x{height}').observe(time.perf_counter() - start)
+
+    return renditions
 
 
 if __name__ == '__main__':
@@ -1,20 +1,42 @@
+import io
 import os
 import time
 from typing import Optional
 
-import aiofiles
-from fastapi import APIRouter, status, Depends, Query
+from fastapi import APIRouter, status, Depends, Query, Request, Response
+from fastapi.responses import RedirectResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+
+from app.archives import Archive, ArchiveEntry
+from app.conditional import make_etag, validator_headers, is_not_modified, not_modified_response
 from app.config import settings
-from app.dependencies import get_accounts_service, cache, get_models_service
+from app.dependencies import get_accounts_service, cache, get_models_service, get_response_cache, \
+    get_blobs_service
+from app.files import content_disposition, requested_range
+from app.metrics import observe_upload, observe_blob_write
+from app.response_cache import ResponseCache, CachedResponse, CACHE_BYPASS, CACHE_STATUS_HEADER
 from app.schemas import PaginationMetadata
+from app.serializers import JSONBytesResponse, dump_json
+from app.storage.backends import storage
+from app.storage.blobs import blob_store
+from app.storage.layout import model_dir
+from app.storage.service import BlobsService
+from app.storage.utils import store_blob
+from app.tracing import span
+from app.utils import parse_uuid
 from app.v1.accounts.exceptions import InvalidCredentialsException
 from app.v1.accounts.service import AccountsService
 from app.v1.accounts.utils import verify_access_token
-from app.v1.models.exceptions import ModelNotFoundException, UnauthorizedModelAccessException
-from app.v1.models.schemas import ModelCreate, ModelRead, ModelReadWithUser, \
-    PaginatedModelResponse, UploadFilesResponse
+from app.v1.models.exceptions import ModelNotFoundException, UnauthorizedModelAccessException, \
+    InvalidFilePathException, ModelFileNotFoundException, RevisionNotFoundException
+from app.v1.models.schemas import ModelCreate, ModelRead, ModelReadWithRevision, \
+    PaginatedModelResponse, UploadFilesResponse, ModelBatchRequest, ModelBatchResponse, ModelFilesResponse, \
+    ModelFilesLinkRequest, ModelFilesLinkResponse, ModelRevisionsResponse
 from app.v1.accounts.controller import oauth2_scheme, optional_oauth2_scheme
 from app.v1.models.service import ModelsService
+from app.v1.models.utils import MODELS_CACHE_TAG, model_cache_tags, invalidate_model_cache, serialize_model, \
+    serialize_models_page, build_model_read, normalize_file_path, add_model_file, model_file_response, \
+    snapshot_model, immutable_cache_control, ensure_model_access
 
 router = APIRouter()
 
@@ -24,7 +46,9 @@ async def create_model(
         model: ModelCreate,
         redis_client: cache = Depends(cache),
         token: str = Depends(oauth2_scheme),
+        response_cache: ResponseCache = Depends(get_response_cache),
         models_service: ModelsService = Depends(get_models_service(ModelsService)),
+        blobs_service: BlobsService = Depends(get_blobs_service(BlobsService)),
         accounts_service: AccountsService = Depends(get_accounts_service(AccountsService))):
     user = await accounts_service.get_current_user(token)
 
@@ -45,22 +69,25 @@ async def create_model(
         raise InvalidCredentialsException(status_code=status.HTTP_403_FORBIDDEN, detail="Token revoked",
                                           headers={"WWW-Authenticate": "Bearer"})
 
-    model_model_dir = os.path.join(settings.models_dir, user.username, model.name)
-    static_model_model_dir = os.path.join(settings.static_dir, model_model_dir)
-
-    os.makedirs(static_model_model_dir, exist_ok=True)
+    # the directory is created in the storage with the first file linked into it
+    model_model_dir = model_dir(user.username, model.name)
 
     include_readme = model.readme
-
-    if include_readme:
-        readme_path = os.path.join(static_model_model_dir, "README.md")
-        async with aiofiles.open(readme_path, "w") as buffer:
-            await buffer.write("# " + model.name + "\n\n" + model.description)
+    readme = "# " + model.name + "\n\n" + (model.description or "")
 
     modifiable_model = ModelCreate(**model.model_dump(exclude={"readme"}))
 
     model = await models_service.create_model(modifiable_model, owner=user, path=model_model_dir)
 
+    if include_readme:
+        readme_file = io.BytesIO(readme.encode("utf-8"))
+        with span("blobs.write", {"path": "README.md"}):
+            blob = await store_blob(readme_file)
+        await add_model_file(models_service, blobs_service, model, "README.md", blob.digest, blob.size, readme_file)
+        await snapshot_model(models_service, blobs_service, model)
+
+    await run_in_threadpool(invalidate_model_cache, response_cache, user.username, model.name)
+
     return model
 
 
@@ -69,6 +96,7 @@ async def upload_file(
         response: UploadFilesResponse = Depends(),
         token: str = Depends(oauth2_scheme),
         models_service: ModelsService = Depends(get_models_service(ModelsService)),
+        blobs_service: BlobsService = Depends(get_blobs_service(BlobsService)),
         accounts_service: AccountsService = Depends(get_accounts_service(AccountsService))):
     user = await accounts_service.get_current_user(token)
 
@@ -82,89 +110,495 @@ async def upload_file(
     if not model:
         raise ModelNotFoundException(status_code=status.HTTP_404_NOT_FOUND, detail="Model not found")
 
-    if model.owner_id != user.id:
+    await ensure_model_access(model, token, accounts_service, owner_only=True, user=user)
+
+    paths = [normalize_file_path(file.filename) for file in response.files]
+
+    if None in paths:
+        raise InvalidFilePathException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid file path")
+
+    blobs = []
+
+    for path, file in zip(paths, response.files):
+        upload_start = time.perf_counter()
+        # content that is already stored is only hashed, and linked into the model without writing it again
+        with span("blobs.write", {"path": path}):
+            blob = await store_blob(file.file)
+        observe_upload("model", blob.size, upload_start)
+        observe_blob_write("model", blob.size, blob.created)
+        blobs.append(blob)
+
+    # every blob the batch may reference or release is locked up front, once the content is stored
+    await blobs_service.lock(*(blob.digest for blob in blobs), *await models_service.lock_manifest(model.id))
+
+    files = []
+
+    for path, file, blob in zip(paths, response.files, blobs):
+        await add_model_file(models_service, blobs_service, model, path, blob.digest, blob.size, file.file)
+        files.append({"path": path, "sha256": blob.digest, "size": blob.size})
+
+    # the whole batch makes one revision
+    revision = await snapshot_model(models_service, blobs_service, model)
+
+    return {"detail": "File uploaded successfully", "files": files, "revision": revision}
+
+
+@router.post("/files/link", response_model=ModelFilesLinkResponse, status_code=status.HTTP_200_OK)
+async def link_files(
+        request: ModelFilesLinkRequest,
+        token: str = Depends(oauth2_scheme),
+        models_service: ModelsService = Depends(get_models_service(ModelsService)),
+        blobs_service: BlobsService = Depends(get_blobs_service(BlobsService)),
+        accounts_service: AccountsService = Depends(get_accounts_service(AccountsService))):
+    """
+    Add files to a model by the SHA-256 of their content. Content that is already stored is linked without an
+    upload; the paths whose content is missing are returned, to be sent to /upload.
+    """
+    user = await accounts_service.get_current_user(token)
+
+    if user is None:
+        raise InvalidCredentialsException(status_code=status.HTTP_403_FORBIDDEN,
+                                          detail="Could not validate credentials",
+                                          headers={"WWW-Authenticate": "Bearer"})
+
+    model = await models_service.get_model(request.model_id)
+
+    if not model:
+        raise ModelNotFoundException(status_code=status.HTTP_404_NOT_FOUND, detail="Model not found")
+
+    await ensure_model_access(model, token, accounts_service, owner_only=True, user=user)
+
+    paths = [normalize_file_path(link.path) for link in request.files]
+
+    if None in paths:
+        raise InvalidFilePathException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid file path")
+
+    digests = list({link.sha256 for link in request.files})
+    await blobs_service.lock(*digests, *await models_service.lock_manifest(model.id))
+
+    blobs = await blobs_service.get_blobs(digests)
+
+    files, missing = [], []
+
+    for path, link in zip(paths, request.files):
+        blob = blobs.get(link.sha256)
+
+        if blob is None:
+            missing.append(path)
+            continue
+
+        try:
+            await add_model_file(models_service, blobs_service, model, path, blob.digest, blob.size)
+        except FileNotFoundError:
+            # collected after it was looked up
+            missing.append(path)
+            continue
+
+        observe_blob_write("model", blob.size, False)
+        files.append({"path": path, "sha256": blob.digest, "size": blob.size})
+
+    revision = await snapshot_model(models_service, blobs_service, model) if files else None
+
+    return {"files": files, "missing": missing, "revision": revision}
+
+
+@router.delete("/{username}/{model_name}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_user_model(
+        username: str,
+        model_name: str,
+        token: str = Depends(oauth2_scheme),
+        response_cache: ResponseCache = Depends(get_response_cache),
+        models_service: ModelsService = Depends(get_models_service(ModelsService)),
+        blobs_service: BlobsService = Depends(get_blobs_service(BlobsService)),
+        accounts_service: AccountsService = Depends(get_accounts_service(AccountsService))):
+    """
+    Delete the model with its files and revisions. The blobs they referenced are released in the same
+    transaction, and collected once nothing else references them.
+    """
+    user = await accounts_service.get_current_user(token)
+
+    if user is None:
+        raise InvalidCredentialsException(status_code=status.HTTP_403_FORBIDDEN,
+                                          detail="Could not validate credentials",
+                                          headers={"WWW-Authenticate": "Bearer"})
+
+    if user.username != username:
         raise UnauthorizedModelAccessException(status_code=status.HTTP_403_FORBIDDEN,
                                                detail="You do not have permission to access this model")
 
-    static_model_dir = os.path.join(settings.static_dir, model.path)
+    model = await models_service.get_model_by_name(user.id, model_name)
 
-    os.makedirs(static_model_dir, exist_ok=True)
+    if not model:
+        raise ModelNotFoundException(status_code=status.HTTP_404_NOT_FOUND, detail="Model not found")
+
+    model_files = await models_service.get_model_files(model.id)
+
+    digests = await models_service.delete_model(model.id)
+    await blobs_service.lock(*digests)
+    await blobs_service.release_references(digests)
+
+    if storage.local:
+        # the links in the model directory would keep the content of the blobs on disk
+        for model_file in model_files:
+            await run_in_threadpool(storage.delete, os.path.join(model.path, model_file.path))
+
+    await run_in_threadpool(invalidate_model_cache, response_cache, username, model_name)
 
-    for file in response.files:
-        file_path = os.path.join(static_model_dir, file.filename)
-        async with aiofiles.open(file_path, "wb") as buffer:
-            while content := await file.read(1024):
-                await buffer.write(content)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+@router.post("/batch", response_model=ModelBatchResponse, status_code=status.HTTP_200_OK)
+async def read_models_batch(
+        request: ModelBatchRequest,
+        token: str | None = Depends(optional_oauth2_scheme),
+        models_service: ModelsService = Depends(get_models_service(ModelsService)),
+        accounts_service: AccountsService = Depends(get_accounts_service(AccountsService))):
+    viewer_id = accounts_service.get_payload(token).sub if token is not None else None
 
-    return {"detail": "File uploaded successfully"}
+    model_ids, names = {}, {}
+
+    for reference in request.models:
+        if (model_id := parse_uuid(reference)) is not None:
+            model_ids[reference] = model_id
+        else:
+            username, _, model_name = reference.partition("/")
+            if username and model_name:
+                names[reference] = (username, model_name)
+
+    rows = await models_service.get_model_rows_by_references(
+        list(set(model_ids.values())), list(set(names.values())))
+
+    rows_by_id = {row.id: row for row in rows}
+    rows_by_name = {(row.owner__username, row.name): row for row in rows}
+
+    owners, results = {}, {}
+
+    for reference in request.models:
+        if reference in model_ids:
+            row = rows_by_id.get(model_ids[reference])
+        else:
+            row = rows_by_name.get(names.get(reference))
+
+        if row is not None and row.private and row.owner_id != viewer_id:
+            row = None
+
+        results[reference] = build_model_read(row, owners) if row is not None else None
+
+    return JSONBytesResponse(dump_json({"models": results}))
 
 
 @router.get("/",
             response_model=PaginatedModelResponse,
             status_code=status.HTTP_200_OK)
 async def read_models(
+        request: Request,
         token: str | None = Depends(optional_oauth2_scheme),
         include_count: bool = Query(False, description="Include total count of models"),
         page: Optional[int] = Query(None, description="Page number", ge=1),
         per_page: Optional[int] = Query(None, description="Items per page", le=100),
+        response_cache: ResponseCache = Depends(get_response_cache),
         models_service: ModelsService = Depends(get_models_service(ModelsService)),
         accounts_service: AccountsService = Depends(get_accounts_service(AccountsService))):
+    # page and per_page only paginate together, so a lone one of them is the same as neither
+    params = {"include_count": include_count}
+    if page is not None and per_page is not None:
+        params.update(page=page, per_page=per_page)
+
+    async def build_validators(owner_id=None) -> dict:
+        total, models_updated_at, owners_updated_at = await models_service.get_models_version(
+            only_public=True, owner_id=owner_id)
+
+        last_modified = max((stamp for stamp in (models_updated_at, owners_updated_at) if stamp), default=None)
+        etag = make_etag("models", ResponseCache.normalize_params(params), owner_id, total, last_modified)
+
+        return validator_headers(etag, last_modified)
+
+    async def build_body(owner_id=None) -> bytes:
+        models, total = await models_service.get_all_model_rows(
+            page, per_page, include_count, only_public=True, owner_id=owner_id)
+
+        pagination_metadata = (
+            PaginationMetadata(total=total, page=page, per_page=per_page, total_pages=total // per_page + 1)
+            if include_count and total and per_page
+            else PaginationMetadata(total=total) if include_count else None)
+
+        return serialize_models_page(models, pagination_metadata)
+
+    async def build_response() -> CachedResponse:
+        headers = await build_validators()
+        return CachedResponse(await build_body(), headers)
+
+    owner_id = None
     if token is not None and (user := await accounts_service.get_current_user(token)) is not None:
-        models, total = await models_service.get_all_models(
-            page, per_page, include_count, only_public=True, owner_id=user.id)
-    else:
-        models, total = await models_service.get_all_models(
-            page, per_page, include_count, only_public=True)
+        owner_id = user.id
 
-    pagination_metadata = (
-        PaginationMetadata(total=total, page=page, per_page=per_page, total_pages=total // per_page + 1)
-        if include_count and total
-        else PaginationMetadata(total=total) if include_count else None)
+    if owner_id is not None or not settings.response_cache_enabled:
+        headers = await build_validators(owner_id)
+        headers[CACHE_STATUS_HEADER] = CACHE_BYPASS
 
-    models = [ModelReadWithUser.model_validate(model) for model in models]
+        if is_not_modified(request, headers["ETag"], headers.get("Last-Modified")):
+            return not_modified_response(headers)
 
-    response_data = PaginatedModelResponse(models=models, metadata=pagination_metadata)
+        return JSONBytesResponse(await build_body(owner_id), headers=headers)
 
-    return response_data
+    cached, cache_status = await response_cache.get_or_set("models:list", params, [MODELS_CACHE_TAG], build_response)
+    headers = {**cached.headers, CACHE_STATUS_HEADER: cache_status}
+
+    if is_not_modified(request, headers["ETag"], headers.get("Last-Modified")):
+        return not_modified_response(headers)
+
+    return JSONBytesResponse(cached.body, headers=headers)
 
 
 @router.get("/{username}/{model_name}",
-            response_model=ModelReadWithUser,
+            response_model=ModelReadWithRevision,
             status_code=status.HTTP_200_OK)
 async def read_user_model(
         username: str,
         model_name: str,
+        request: Request,
+        revision: Optional[int] = Query(None, ge=1, description="Check that the model has this revision"),
         token: str | None = Depends(optional_oauth2_scheme),
+        response_cache: ResponseCache = Depends(get_response_cache),
         models_service: ModelsService = Depends(get_models_service(ModelsService)),
         accounts_service: AccountsService = Depends(get_accounts_service(AccountsService))):
-    user = await accounts_service.get_user_by_username(username)
+    async def load_model():
+        model = await models_service.get_model_row_by_name(username, model_name)
 
-    if user is None:
-        raise InvalidCredentialsException(status_code=status.HTTP_403_FORBIDDEN,
-                                          detail="Could not validate credentials",
-                                          headers={"WWW-Authenticate": "Bearer"})
+        if model is None:
+            raise ModelNotFoundException(status_code=status.HTTP_404_NOT_FOUND, detail="Model not found")
 
-    model = await models_service.get_model_by_name(user.id, model_name)
+        await ensure_model_access(model, token, accounts_service)
+
+        return model
+
+    def build_validators(model) -> dict:
+        last_modified = max(model.updated_at, model.owner__updated_at)
+        return validator_headers(make_etag(model.id, model.updated_at, model.owner__updated_at), last_modified)
+
+    async def build_response() -> CachedResponse:
+        model = await load_model()
+        return CachedResponse(serialize_model(model), build_validators(model))
+
+    if revision is not None:
+        model = await load_model()
+
+        if await models_service.get_revision(model.id, revision) is None:
+            raise RevisionNotFoundException(status_code=status.HTTP_404_NOT_FOUND, detail="Revision not found")
+
+        headers = build_validators(model)
+        headers[CACHE_STATUS_HEADER] = CACHE_BYPASS
+
+        if is_not_modified(request, headers["ETag"], headers.get("Last-Modified")):
+            return not_modified_response(headers)
+
+        return JSONBytesResponse(dump_json({**build_model_read(model), "revision": revision}), headers=headers)
+
+    if token is not None or not settings.response_cache_enabled:
+        model = await load_model()
+        headers = build_validators(model)
+        headers[CACHE_STATUS_HEADER] = CACHE_BYPASS
+
+        if is_not_modified(request, headers["ETag"], headers.get("Last-Modified")):
+            return not_modified_response(headers)
+
+        return JSONBytesResponse(serialize_model(model), headers=headers)
+
+    cached, cache_status = await response_cache.get_or_set(
+        "models:detail", {"username": username, "model_name": model_name},
+        model_cache_tags(username, model_name), build_response)
+    headers = {**cached.headers, CACHE_STATUS_HEADER: cache_status}
+
+    if is_not_modified(request, headers["ETag"], headers.get("Last-Modified")):
+        return not_modified_response(headers)
+
+    return JSONBytesResponse(cached.body, headers=headers)
+
+
+@router.get("/{username}/{model_name}/files",
+            response_model=ModelFilesResponse,
+            status_code=status.HTTP_200_OK)
+async def read_model_files(
+        username: str,
+        model_name: str,
+        response: Response,
+        revision: Optional[int] = Query(None, ge=1, description="List the files of this revision"),
+        token: str | None = Depends(optional_oauth2_scheme),
+        models_service: ModelsService = Depends(get_models_service(ModelsService)),
+        accounts_service: AccountsService = Depends(get_accounts_service(AccountsService))):
+    model = await models_service.get_model_row_by_name(username, model_name)
 
     if model is None:
         raise ModelNotFoundException(status_code=status.HTTP_404_NOT_FOUND, detail="Model not found")
 
-    if model.private:
-        if token is None:
-            raise InvalidCredentialsException(status_code=status.HTTP_403_FORBIDDEN,
-                                              detail="Could not validate credentials",
-                                              headers={"WWW-Authenticate": "Bearer"})
+    await ensure_model_access(model, token, accounts_service)
 
-        if not (user := await accounts_service.get_current_user(token)):
-            raise InvalidCredentialsException(status_code=status.HTTP_403_FORBIDDEN,
-                                              detail="Could not validate credentials",
-                                              headers={"WWW-Authenticate": "Bearer"})
+    if revision is not None:
+        model_revision = await models_service.get_revision(model.id, revision)
 
-        if model.owner_id != user.id:
-            raise UnauthorizedModelAccessException(status_code=status.HTTP_403_FORBIDDEN,
-                                                   detail="You do not have permission to access this model")
+        if model_revision is None:
+            raise RevisionNotFoundException(status_code=status.HTTP_404_NOT_FOUND, detail="Revision not found")
 
-    # for some reason, I can't call model.validate() in the return statement
-    model = ModelReadWithUser.model_validate(model)
+        model_files = await models_service.get_revision_files(model_revision.id)
+        response.headers["Cache-Control"] = immutable_cache_control(model)
+    else:
+        model_files = await models_service.get_model_files(model.id)
+        revision = await models_service.get_latest_revision_number(model.id)
 
-    return model
+    return {"files": [{"path": model_file.path, "sha256": model_file.digest, "size": model_file.size}
+                      for model_file in model_files],
+            "revision": revision}
+
+
+@router.get("/{username}/{model_name}/revisions",
+            response_model=ModelRevisionsResponse,
+            status_code=status.HTTP_200_OK)
+async def read_model_revisions(
+        username: str,
+        model_name: str,
+        token: str | None = Depends(optional_oauth2_scheme),
+        models_service: ModelsService = Depends(get_models_service(ModelsService)),
+        accounts_service: AccountsService = Depends(get_accounts_service(AccountsService))):
+    model = await models_service.get_model_row_by_name(username, model_name)
+
+    if model is None:
+        raise ModelNotFoundException(status_code=status.HTTP_404_NOT_FOUND, detail="Model not found")
+
+    await ensure_model_access(model, token, accounts_service)
+
+    revisions = await models_service.get_revisions(model.id)
+
+    return {"revisions": [{"number": model_revision.number, "created_at": model_revision.created_at}
+                          for model_revision in revisions]}
+
+
+@router.api_route("/{username}/{model_name}/archive",
+                  methods=["GET", "HEAD"],
+                  response_class=StreamingResponse,
+                  status_code=status.HTTP_200_OK)
+async def download_model_archive(
+        username: str,
+        model_name: str,
+        request: Request,
+        archive_format: str = Query("zip", alias="format", pattern="^(zip|tar)$",
+                                    description="zip, with uncompressed entries, or tar"),
+        revision: Optional[int] = Query(None, ge=1, description="Archive the files of this revision"),
+        token: str | None = Depends(optional_oauth2_scheme),
+        models_service: ModelsService = Depends(get_models_service(ModelsService)),
+        accounts_service: AccountsService = Depends(get_accounts_service(AccountsService))):
+    """
+    Download every file of the model in one archive, streamed from the storage as it is sent. The archive is
+    laid out from the manifest, so it has a Content-Length and interrupted downloads resume with Range.
+    """
+    model = await models_service.get_model_row_by_name(username, model_name)
+
+    if model is None:
+        raise ModelNotFoundException(status_code=status.HTTP_404_NOT_FOUND, detail="Model not found")
+
+    await ensure_model_access(model, token, accounts_service)
+
+    if revision is not None:
+        model_revision = await models_service.get_revision(model.id, revision)
+
+        if model_revision is None:
+            raise RevisionNotFoundException(status_code=status.HTTP_404_NOT_FOUND, detail="Revision not found")
+
+        model_files = await models_service.get_revision_files(model_revision.id)
+    else:
+        model_files = await models_service.get_model_files(model.id)
+
+    archive = Archive(model.name, [ArchiveEntry(model_file.path, model_file.digest, model_file.size,
+                                                model_file.updated_at) for model_file in model_files],
+                      archive_format, lambda entry, offset: blob_store.open(entry.digest, offset))
+
+    headers = validator_headers(archive.etag)
+    headers["Content-Disposition"] = content_disposition(f"{model.name}.{archive_format}")
+    headers["Accept-Ranges"] = "bytes"
+    if revision is not None:
+        headers["Cache-Control"] = immutable_cache_control(model)
+    elif model.private:
+        headers["Cache-Control"] = "private"
+
+    if is_not_modified(request, headers["ETag"]):
+        return not_modified_response(headers)
+
+    byte_range = requested_range(request, archive.size, headers["ETag"])
+    start, end = byte_range if byte_range is not None else (0, archive.size - 1)
+
+    headers["Content-Length"] = str(end - start + 1)
+    if byte_range is not None:
+        headers["Content-Range"] = f"bytes {start}-{end}/{archive.size}"
+
+    status_code = status.HTTP_206_PARTIAL_CONTENT if byte_range is not None else status.HTTP_200_OK
+    media_type = "application/zip" if archive_format == "zip" else "application/x-tar"
+
+    if request.method == "HEAD":
+        return Response(status_code=status_code, headers=headers, media_type=media_type)
+
+    return StreamingResponse(archive.iter_bytes(start, end), status_code=status_code, headers=headers,
+                             media_type=media_type)
+
+
+@router.api_route("/{username}/{model_name}/resolve/{file_path:path}",
+                  methods=["GET", "HEAD"],
+                  response_class=RedirectResponse,
+                  status_code=status.HTTP_302_FOUND)
+async def download_model_file(
+        username: str,
+        model_name: str,
+        file_path: str,
+        request: Request,
+        revision: Optional[int] = Query(None, ge=1, description="Download the file as of this revision"),
+        token: str | None = Depends(optional_oauth2_scheme),
+        models_service: ModelsService = Depends(get_models_service(ModelsService)),
+        accounts_service: AccountsService = Depends(get_accounts_service(AccountsService))):
+    """
+    Download a file of the model. Where the storage backend hands out download URLs, this redirects to one, so
+    the content never goes through the API; local files support Range requests for resumable and parallel
+    downloads.
+    """
+    model = await models_service.get_model_row_by_name(username, model_name)
+
+    if model is None:
+        raise ModelNotFoundException(status_code=status.HTTP_404_NOT_FOUND, detail="Model not found")
+
+    await ensure_model_access(model, token, accounts_service)
+
+    path = normalize_file_path(file_path)
+
+    if path is None:
+        raise InvalidFilePathException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid file path")
+
+    if revision is not None:
+        model_revision = await models_service.get_revision(model.id, revision)
+
+        if model_revision is None:
+            raise RevisionNotFoundException(status_code=status.HTTP_404_NOT_FOUND, detail="Revision not found")
+
+        model_file = await models_service.get_revision_file(model_revision.id, path)
+    else:
+        model_file = await models_service.get_model_file(model.id, path)
+
+    if model_file is None:
+        raise ModelFileNotFoundException(status_code=status.HTTP_404_NOT_FOUND, detail="File not found")
+
+    return await model_file_response(request, model, model_file, immutable=revision is not None)
+
+
+files_router = APIRouter()
+
+
+@files_router.api_route("/{username}/{model_name}/{file_path:path}", methods=["GET", "HEAD"],
+                        include_in_schema=False)
+async def serve_model_file(
+        username: str,
+        model_name: str,
+        file_path: str,
+        request: Request,
+        revision: Optional[int] = Query(None, ge=1, description="Download the file as of this revision"),
+        token: str | None = Depends(optional_oauth2_scheme),
+        models_service: ModelsService = Depends(get_models_service(ModelsService)),
+        accounts_service: AccountsService = Depends(get_accounts_service(AccountsService))):
+    # the files used to be served from the model directories; they are now read through the manifest
+    return await download_model_file(username, model_name, file_path, request, revision, token, models_service,
+                                     accounts_service)
@@ -7,3 +7,15 @@ class ModelNotFoundException(HTTPException):
 
 class UnauthorizedModelAccessException(HTTPException):
     pass
+
+
+class InvalidFilePathException(HTTPException):
+    pass
+
+
+class ModelFileNotFoundException(HTTPException):
+    pass
+
+
+class RevisionNotFoundException(HTTPException):
+    pass
@@ -1,7 +1,8 @@
-from sqlalchemy import Column, String, DateTime, func, ForeignKey, Boolean
+from sqlalchemy import Column, String, DateTime, func, ForeignKey, Boolean, BigInteger, UniqueConstraint, Integer
 from sqlalchemy.orm import relationship
 from sqlalchemy.dialects.postgresql import UUID
 from app.database import Base
+from app.storage.models import Blob
 import uuid
 
 
@@ -13,9 +14,64 @@ class Model(Base):
     description = Column(String, nullable=True)
     private = Column(Boolean, default=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
     path = Column(String, unique=True)
     endpoint = Column(String, nullable=True)
     type = Column(String, nullable=False)
     owner_id = Column(UUID(as_uuid=True), ForeignKey("users.id"))
     owner = relationship("User", back_populates="models")
+    files = relationship("ModelFile", back_populates="model", cascade="all, delete-orphan")
+    revisions = relationship("ModelRevision", back_populates="model", cascade="all, delete-orphan")
 
+
+class ModelFile(Base):
+    """
+    Manifest entry of a model: the file at path in the model directory has the content of the blob digest.
+    """
+    __tablename__ = "model_files"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    model_id = Column(UUID(as_uuid=True), ForeignKey("models.id", ondelete="CASCADE"), nullable=False)
+    path = Column(String, nullable=False)
+    digest = Column(String(64), ForeignKey(Blob.digest), nullable=False)
+    size = Column(BigInteger, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    model = relationship("Model", back_populates="files")
+
+    __table_args__ = (UniqueConstraint("model_id", "path", name="uq_model_files_model_id_path"),)
+
+
+class ModelRevision(Base):
+    """
+    Immutable snapshot of the manifest of a model, numbered from 1 in the order they were made. Every upload
+    batch makes one.
+    """
+    __tablename__ = "model_revisions"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    model_id = Column(UUID(as_uuid=True), ForeignKey("models.id", ondelete="CASCADE"), nullable=False)
+    number = Column(Integer, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    model = relationship("Model", back_populates="revisions")
+    files = relationship("ModelRevisionFile", cascade="all, delete-orphan")
+
+    __table_args__ = (UniqueConstraint("model_id", "number", name="uq_model_revisions_model_id_number"),)
+
+
+class ModelRevisionFile(Base):
+    """
+    Manifest entry of a revision. Rows are copied from model_files when the revision is made and never change;
+    unchanged files share their blob with the other revisions, each row holding a reference to it.
+    """
+    __tablename__ = "model_revision_files"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    revision_id = Column(UUID(as_uuid=True), ForeignKey("model_revisions.id", ondelete="CASCADE"), nullable=False)
+    path = Column(String, nullable=False)
+    digest = Column(String(64), ForeignKey(Blob.digest), nullable=False)
+    size = Column(BigInteger, nullable=False)
+    # when the content at path last changed, as of the revision
+    updated_at = Column(DateTime(timezone=True), nullable=False)
+
+    __table_args__ = (UniqueConstraint("revision_id", "path", name="uq_model_revision_files_revision_id_path"),)
@@ -1,10 +1,11 @@
 import datetime
 import uuid
-from typing import Optional, List
+from typing import Optional, List, Dict
 
 from fastapi import UploadFile, File
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
+from app.config import settings
 from app.schemas import PaginationMetadata
 from app.utils import as_form
 from app.v1.accounts.schemas import UserRead
@@ -47,12 +48,65 @@ class ModelReadWithUser(BaseModel):
         from_attributes = True
 
 
+class ModelReadWithRevision(ModelReadWithUser):
+    # the revision asked for; the model itself is not versioned, so it is the same as without one
+    revision: Optional[int] = None
+
+
 class PaginatedModelResponse(BaseModel):
     models: List[ModelReadWithUser]
     metadata: Optional[PaginationMetadata] = None
 
 
+class ModelBatchRequest(BaseModel):
+    # model ids or "username/model_name" references
+    models: List[str] = Field(..., min_length=1, max_length=settings.max_batch_size)
+
+
+class ModelBatchResponse(BaseModel):
+    models: Dict[str, Optional[ModelReadWithUser]]
+
+
 @as_form
 class UploadFilesResponse(BaseModel):
     files: List[UploadFile] = File(...)
     model_id: uuid.UUID
+
+
+class ModelFileRead(BaseModel):
+    path: str
+    sha256: str
+    size: int
+
+
+class ModelFilesResponse(BaseModel):
+    files: List[ModelFileRead]
+    # the revision listed, or the latest one for the current files; None before the first upload
+    revision: Optional[int] = None
+
+
+class ModelRevisionRead(BaseModel):
+    number: int
+    created_at: datetime.datetime
+
+
+class ModelRevisionsResponse(BaseModel):
+    revisions: List[ModelRevisionRead]
+
+
+class ModelFileLink(BaseModel):
+    path: str
+    sha256: str = Field(..., pattern="^[0-9a-f]{64}$")
+
+
+class ModelFilesLinkRequest(BaseModel):
+    model_id: uuid.UUID
+    files: List[ModelFileLink] = Field(..., min_length=1, max_length=settings.max_batch_size)
+
+
+class ModelFilesLinkResponse(BaseModel):
+    files: List[ModelFileRead]
+    # paths whose content is not stored yet and has to be uploaded
+    missing: List[str]
+    # the revision made with the linked files; None when nothing was linked
+    revision: Optional[int] = None
@@ -1,14 +1,25 @@
+import datetime
 import uuid
-from typing import List
+from typing import List, Tuple
 
-from sqlalchemy import func
+from sqlalchemy import func, Row, tuple_, insert
 from sqlalchemy.sql.expression import false, true, or_, desc, delete, select, and_
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import selectinload
 
 from app.v1.accounts.models import User
-from app.v1.models.models import Model
-from app.v1.models.schemas import ModelCreate
+from app.v1.models.models import Model, ModelFile, ModelRevision, ModelRevisionFile
+from app.v1.models.schemas import ModelCreate, ModelReadWithUser
+from app.v1.accounts.schemas import UserRead
+
+# Columns needed to render ModelReadWithUser. Owner columns are labeled owner__<field> so a row can be read
+# without hydrating ORM entities or a second query for the owner. The update stamps are only read for ETags.
+MODEL_READ_COLUMNS = tuple(
+    getattr(Model, field) for field in ModelReadWithUser.model_fields if field != "owner"
+) + (Model.owner_id, Model.updated_at)
+OWNER_READ_COLUMNS = tuple(
+    getattr(User, field).label(f"owner__{field}") for field in UserRead.model_fields
+) + (User.updated_at.label("owner__updated_at"),)
 
 
 class ModelsService:
@@ -50,6 +61,99 @@ class ModelsService:
 
         return result.scalars().all(), total_count
 
+    async def get_all_model_rows(
+            self,
+            page: int = None,
+            per_page: int = None,
+            include_count: bool = False,
+            only_public: bool = False,
+            owner_id: uuid.UUID = None) -> (List[Row], int):
+        Q = []
+
+        if only_public:
+            Q.append(Model.private == false())
+
+        if owner_id is not None:
+            Q.append(and_(Model.owner_id == owner_id, Model.private == true()))
+
+        total_count = None
+        if include_count:
+            count_query = select(func.count(Model.id))
+            if len(Q) > 0:
+                count_query = count_query.filter(or_(*Q))
+            count_result = await self.session.execute(count_query)
+            total_count = count_result.scalar()
+
+        query = select(*MODEL_READ_COLUMNS, *OWNER_READ_COLUMNS).join(User, Model.owner_id == User.id)
+
+        if len(Q) > 0:
+            query = query.filter(or_(*Q))
+
+        query = query.order_by(desc(Model.created_at), desc(Model.id))
+
+        if page is not None and per_page is not None:
+            query = query.limit(per_page).offset((page - 1) * per_page)
+
+        result = await self.session.execute(query)
+
+        return result.all(), total_count
+
+    async def get_models_version(
+            self,
+            only_public: bool = False,
+            owner_id: uuid.UUID = None) -> (int, datetime.datetime | None, datetime.datetime | None):
+        """
+        Return the number of listed models and the latest update stamps of those models and of their owners.
+        Together they change whenever the listing does, without reading the listing itself.
+        """
+        Q = []
+
+        if only_public:
+            Q.append(Model.private == false())
+
+        if owner_id is not None:
+            Q.append(and_(Model.owner_id == owner_id, Model.private == true()))
+
+        query = (select(func.count(Model.id), func.max(Model.updated_at), func.max(User.updated_at))
+                 .join(User, Model.owner_id == User.id))
+
+        if len(Q) > 0:
+            query = query.filter(or_(*Q))
+
+        result = await self.session.execute(query)
+        return tuple(result.one())
+
+    async def get_model_row_by_name(self, username: str, model_name: str) -> Row | None:
+        query = (select(*MODEL_READ_COLUMNS, *OWNER_READ_COLUMNS)
+                 .join(User, Model.owner_id == User.id)
+                 .filter(and_(User.username == username, Model.name == model_name)))
+        result = await self.session.execute(query)
+        return result.first()
+
+    async def get_model_rows_by_references(
+            self,
+            model_ids: List[uuid.UUID],
+            names: List[tuple]) -> List[Row]:
+        """
+        Resolve models by id and by (username, model_name) pairs in a single query.
+        """
+        Q = []
+
+        if model_ids:
+            Q.append(Model.id.in_(model_ids))
+
+        if names:
+            Q.append(tuple_(User.username, Model.name).in_(names))
+
+        if len(Q) == 0:
+            return []
+
+        query = (select(*MODEL_READ_COLUMNS, *OWNER_READ_COLUMNS)
+                 .join(User, Model.owner_id == User.id)
+                 .filter(or_(*Q)))
+        result = await self.session.execute(query)
+        return result.all()
+
     async def get_model(self, model_id: uuid.UUID) -> Model:
         query = select(Model).filter(Model.id == model_id)
         result = await self.session.execute(query)
@@ -70,12 +174,121 @@ class ModelsService:
         result = await self.session.execute(query)
         return result.scalar()
 
-    async def delete_model(self, model_id: uuid.UUID) -> None:
+    async def delete_model(self, model_id: uuid.UUID) -> List[str]:
+        """
+        Delete the model, its manifest and its revisions, and return the digests of their files, once per file,
+        for the caller to release.
+        """
+        result = await self.session.execute(delete(ModelFile).where(ModelFile.model_id == model_id)
+                                            .returning(ModelFile.digest))
+        digests = list(result.scalars())
+        revision_ids = select(ModelRevision.id).filter(ModelRevision.model_id == model_id)
+        result = await self.session.execute(delete(ModelRevisionFile)
+                                            .where(ModelRevisionFile.revision_id.in_(revision_ids))
+                                            .returning(ModelRevisionFile.digest))
+        digests += result.scalars()
+        await self.session.execute(delete(ModelRevision).where(ModelRevision.model_id == model_id))
         query = delete(Model).where(Model.id == model_id)
         await self.session.execute(query)
+        return digests
+
+    async def get_model_files(self, model_id: uuid.UUID) -> List[ModelFile]:
+        query = select(ModelFile).filter(ModelFile.model_id == model_id).order_by(ModelFile.path)
+        result = await self.session.execute(query)
+        return result.scalars().all()
+
+    async def lock_manifest(self, model_id: uuid.UUID) -> List[str]:
+        """
+        Lock the model until the transaction ends, so its manifest only changes through this transaction, and
+        return the digests of its files: the blobs a change of the manifest may release or snapshot.
+        """
+        await self.session.execute(select(Model.id).filter(Model.id == model_id).with_for_update())
+        result = await self.session.execute(select(ModelFile.digest).filter(ModelFile.model_id == model_id))
+        return list(result.scalars())
+
+    async def get_model_file(self, model_id: uuid.UUID, path: str) -> ModelFile | None:
+        query = select(ModelFile).filter(ModelFile.model_id == model_id, ModelFile.path == path)
+        result = await self.session.execute(query)
+        return result.scalar()
+
+    async def set_model_file(self, model_id: uuid.UUID, path: str, digest: str, size: int) -> str | None:
+        """
+        Point path in the manifest of the model at the blob digest. Returns the digest path pointed at before,
+        whose reference the caller releases.
+        """
+        query = (select(ModelFile)
+                 .filter(ModelFile.model_id == model_id, ModelFile.path == path)
+                 .with_for_update())
+        result = await self.session.execute(query)
+        model_file = result.scalar()
+
+        if model_file is None:
+            self.session.add(ModelFile(model_id=model_id, path=path, digest=digest, size=size))
+            await self.session.flush()
+            return None
+
+        replaced = model_file.digest
+        model_file.digest = digest
+        model_file.size = size
+        await self.session.flush()
+        return replaced
+
+    async def create_revision(self, model_id: uuid.UUID) -> Tuple[ModelRevision, List[str]]:
+        """
+        Snapshot the manifest of the model as its next revision. Returns the revision and the digests of its
+        files, once per file, each of which the caller references.
+        """
+        # the lock on the model numbers concurrent snapshots one after the other
+        await self.session.execute(select(Model.id).filter(Model.id == model_id).with_for_update())
+
+        query = select(func.max(ModelRevision.number)).filter(ModelRevision.model_id == model_id)
+        number = ((await self.session.execute(query)).scalar() or 0) + 1
+
+        revision = ModelRevision(model_id=model_id, number=number)
+        self.session.add(revision)
+        await self.session.flush()
+
+        model_files = await self.get_model_files(model_id)
+        if model_files:
+            await self.session.execute(insert(ModelRevisionFile), [
+                {"id": uuid.uuid4(), "revision_id": revision.id, "path": model_file.path,
+                 "digest": model_file.digest, "size": model_file.size, "updated_at": model_file.updated_at}
+                for model_file in model_files])
+
+        return revision, [model_file.digest for model_file in model_files]
+
+    async def get_revisions(self, model_id: uuid.UUID) -> List[ModelRevision]:
+        query = (select(ModelRevision)
+                 .filter(ModelRevision.model_id == model_id)
+                 .order_by(desc(ModelRevision.number)))
+        result = await self.session.execute(query)
+        return result.scalars().all()
+
+    async def get_revision(self, model_id: uuid.UUID, number: int) -> ModelRevision | None:
+        query = select(ModelRevision).filter(ModelRevision.model_id == model_id, ModelRevision.number == number)
+        result = await self.session.execute(query)
+        return result.scalar()
+
+    async def get_latest_revision_number(self, model_id: uuid.UUID) -> int | None:
+        query = select(func.max(ModelRevision.number)).filter(ModelRevision.model_id == model_id)
+        result = await self.session.execute(query)
+        return result.scalar()
+
+    async def get_revision_files(self, revision_id: uuid.UUID) -> List[ModelRevisionFile]:
+        query = (select(ModelRevisionFile)
+                 .filter(ModelRevisionFile.revision_id == revision_id)
+                 .order_by(ModelRevisionFile.path))
+        result = await self.session.execute(query)
+        return result.scalars().all()
+
+    async def get_revision_file(self, revision_id: uuid.UUID, path: str) -> ModelRevisionFile | None:
+        query = select(ModelRevisionFile).filter(ModelRevisionFile.revision_id == revision_id,
+                                                 ModelRevisionFile.path == path)
+        result = await self.session.execute(query)
+        return result.scalar()
 
     async def create_model(self, model: ModelCreate, path: str, owner: User) -> Model:
-        model_obj = Model(**model.model_dump(), path=path, owner=owner)
+        model_obj = Model(**model.model_dump(exclude={"readme"}), path=path, owner=owner)
 
         self.session.add(model_obj)
         await self.session.commit()
@@ -1 +1,164 @@
+import mimetypes
+import os
+import posixpath
+from typing import BinaryIO, Iterable, Optional
 
+from fastapi import Request, Response, status
+from fastapi.responses import RedirectResponse
+from sqlalchemy import Row
+from starlette.concurrency import run_in_threadpool
+
+from app.conditional import validator_headers, is_not_modified, not_modified_response
+from app.config import settings
+from app.files import RangeFileResponse, content_disposition, requested_range
+from app.response_cache import ResponseCache
+from app.schemas import PaginationMetadata
+from app.serializers import project, dump_json
+from app.storage.blobs import blob_store
+from app.storage.service import BlobsService
+from app.storage.utils import reference_blob
+from app.v1.accounts.exceptions import InvalidCredentialsException
+from app.v1.accounts.models import User
+from app.v1.accounts.schemas import UserRead
+from app.v1.accounts.service import AccountsService
+from app.v1.models.exceptions import UnauthorizedModelAccessException
+from app.v1.models.models import Model, ModelFile, ModelRevisionFile
+from app.v1.models.schemas import ModelReadWithUser
+from app.v1.models.service import ModelsService
+
+MODELS_CACHE_TAG = "models"
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def model_cache_tags(username: str, model_name: str) -> list:
+    return [f"model:{username}/{model_name}", f"user:{username}"]
+
+
+def invalidate_model_cache(response_cache: ResponseCache, username: str, model_name: str) -> None:
+    response_cache.invalidate(MODELS_CACHE_TAG, *model_cache_tags(username, model_name))
+
+
+async def ensure_model_access(model, token: Optional[str], accounts_service: AccountsService,
+                              owner_only: bool = False, user: Optional[User] = None) -> None:
+    """
+    Raise unless the user of token may access the model, a Model or a row with its owner_id: private models, and
+    every model with owner_only, are only for their owner. The user is loaded, so tokens of deleted users are
+    refused; routes that already loaded it pass it as user.
+    """
+    if not model.private and not owner_only:
+        return
+
+    if user is None and token is not None:
+        user = await accounts_service.get_current_user(token)
+
+    if user is None:
+        raise InvalidCredentialsException(status_code=status.HTTP_403_FORBIDDEN,
+                                          detail="Could not validate credentials",
+                                          headers={"WWW-Authenticate": "Bearer"})
+
+    if model.owner_id != user.id:
+        raise UnauthorizedModelAccessException(status_code=status.HTTP_403_FORBIDDEN,
+                                               detail="You do not have permission to access this model")
+
+
+def normalize_file_path(path: Optional[str]) -> Optional[str]:
+    """
+    Path of a file relative to its model directory, or None when path is empty or points outside of it.
+    """
+    if not path:
+        return None
+    normalized = posixpath.normpath(path.replace("\\", "/"))
+    if normalized.startswith("/") or normalized == "." or normalized == ".." or normalized.startswith("../"):
+        return None
+    return normalized
+
+
+async def add_model_file(models_service: ModelsService, blobs_service: BlobsService, model: Model, path: str,
+                         digest: str, size: int, source: Optional[BinaryIO] = None) -> None:
+    """
+    Put the stored blob digest at path in the model: reference it, link it into the model directory where the
+    storage backend has links, then record it in the manifest and release the blob the path held before.
+    Downloads go through the manifest, so backends without links need nothing more. Raises FileNotFoundError for
+    blobs not stored, unless source, the file the blob was written from, can store them again.
+    """
+    await reference_blob(blobs_service, digest, size, source)
+    await run_in_threadpool(blob_store.link, digest, os.path.join(model.path, path))
+
+    replaced = await models_service.set_model_file(model.id, path, digest, size)
+    if replaced is not None:
+        await blobs_service.release(replaced)
+
+
+async def snapshot_model(models_service: ModelsService, blobs_service: BlobsService, model: Model) -> int:
+    """
+    Record the current files of the model as a new immutable revision and return its number. The revision
+    references the blobs of the files, so later uploads and deletes never change what it serves.
+    """
+    revision, digests = await models_service.create_revision(model.id)
+    await blobs_service.add_references(digests)
+    return revision.number
+
+
+def immutable_cache_control(model) -> str:
+    # a revision never changes, so caches keep it for as long as they like
+    return f"{'private' if model.private else 'public'}, max-age={IMMUTABLE_MAX_AGE}, immutable"
+
+
+async def model_file_response(request: Request, model, model_file: ModelFile | ModelRevisionFile,
+                              immutable: bool = False) -> Response:
+    """
+    Serve a file of the model without the worker pushing its bytes where possible: a redirect to the storage
+    backend's URL, a handoff to the front proxy with X-Accel-Redirect, or else a sendfile-backed response.
+    Local files honour Range and If-Range, against a strong ETag made of the SHA-256 of the content. Files of
+    a revision are immutable.
+    """
+    filename = posixpath.basename(model_file.path)
+
+    # private files only get URLs that expire
+    url = await run_in_threadpool(blob_store.url, model_file.digest, filename, not model.private)
+
+    if url is not None:
+        return RedirectResponse(url, status_code=status.HTTP_302_FOUND)
+
+    etag = f'"{model_file.digest}"'
+    headers = validator_headers(etag, model_file.updated_at)
+    headers["Content-Disposition"] = content_disposition(filename)
+    if immutable:
+        headers["Cache-Control"] = immutable_cache_control(model)
+    elif model.private:
+        headers["Cache-Control"] = "private"
+
+    if is_not_modified(request, etag, headers.get("Last-Modified")):
+        return not_modified_response(headers)
+
+    media_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+
+    if settings.files_accel_redirect_prefix:
+        # the proxy answers Range requests itself
+        headers["X-Accel-Redirect"] = settings.files_accel_redirect_prefix + blob_store.key(model_file.digest)
+        return Response(headers=headers, media_type=media_type)
+
+    byte_range = requested_range(request, model_file.size, etag, headers.get("Last-Modified"))
+
+    return RangeFileResponse(blob_store.path(model_file.digest), model_file.size, byte_range, headers=headers,
+                             media_type=media_type, send_body=request.method != "HEAD")
+
+
+def build_model_read(row: Row, owners: Optional[dict] = None) -> dict:
+    # owners memoizes the nested owner so a user with many models on a page is projected only once
+    owners = {} if owners is None else owners
+
+    owner = owners.get(row.owner_id)
+    if owner is None:
+        owner = owners[row.owner_id] = project(UserRead, row, prefix="owner__")
+
+    return project(ModelReadWithUser, row, owner=owner)
+
+
+def serialize_model(row: Row) -> bytes:
+    return dump_json(build_model_read(row))
+
+
+def serialize_models_page(rows: Iterable[Row], metadata: Optional[PaginationMetadata]) -> bytes:
+    owners = {}
+    return dump_json({"models": [build_model_read(row, owners) for row in rows], "metadata": metadata})
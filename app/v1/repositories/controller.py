@@ -6,7 +6,9 @@ import aiofiles
 from fastapi import APIRouter, status, Depends, Query
 from app.config import settings
 from app.dependencies import get_accounts_service, cache, get_repositories_service
+from app.metrics import observe_upload
 from app.schemas import PaginationMetadata
+from app.storage.layout import model_dir
 from app.v1.accounts.exceptions import InvalidCredentialsException
 from app.v1.accounts.service import AccountsService
 from app.v1.accounts.utils import verify_access_token
@@ -45,7 +47,7 @@ async def create_repository(
     if not verify_access_token(token, access_tokens):
         raise InvalidCredentialsException(status_code=status.HTTP_403_FORBIDDEN, detail="Token revoked", headers={"WWW-Authenticate": "Bearer"})
 
-    model_repository_dir = os.path.join(settings.models_dir, user.username, model.name)
+    model_repository_dir = model_dir(user.username, model.name)
     static_model_repository_dir = os.path.join(settings.static_dir, model_repository_dir)
 
     os.makedirs(static_model_repository_dir, exist_ok=True)
@@ -83,9 +85,11 @@ async def upload_file(
 
     for file in response.files:
         file_path = os.path.join(static_repository_dir, file.filename)
+        upload_start = time.perf_counter()
         async with aiofiles.open(file_path, "wb") as buffer:
             while content := await file.read(1024):
                 await buffer.write(content)
+        observe_upload("repository", file.size, upload_start)
 
     return {"detail": "File uploaded successfully"}
 
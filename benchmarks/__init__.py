@@ -0,0 +1,12 @@
+import subprocess
+from typing import Optional
+
+
+def git_revision() -> Optional[str]:
+    """
+    Commit the benchmarks run against, recorded in reports so results can be compared across commits.
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
@@ -0,0 +1,267 @@
+"""
+Drive the API's hot paths at a fixed concurrency and report throughput and latency percentiles.
+
+Every worker owns one session (a seeded user logged in at setup, with a model to upload to) and runs scenarios
+picked at random according to --mix until --duration seconds pass or --requests requests are done:
+
+    register  POST /v1/accounts/register with a new user
+    login     POST /v1/accounts/login as a random seeded user
+    refresh   POST /v1/accounts/refresh with the session's refresh token
+    me        GET  /v1/accounts/me
+    models    GET  /v1/models/ at a random page
+    upload    POST /v1/models/upload of --upload-size bytes
+
+Against a running deployment, seeded with benchmarks.seed:
+
+    python -m benchmarks.load --base-url http://localhost:8000 --concurrency 32 --duration 60 --output load.json
+
+With --spawn the app is started with uvicorn (--workers processes) against the Postgres and Redis configured in
+the environment, seeded with the benchmarks.seed options, and stopped afterwards. Needs the packages from
+requirements-benchmarks.txt.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import httpx
+
+from benchmarks import git_revision, seed
+
+DEFAULT_MIX = "login=1,refresh=2,me=4,models=8,register=1,upload=1"
+
+
+class Session:
+    def __init__(self, username: str):
+        self.username = username
+        self.access_token: Optional[str] = None
+        self.refresh_token: Optional[str] = None
+        self.model_id: Optional[str] = None
+
+    @property
+    def headers(self) -> dict:
+        return {"Authorization": f"Bearer {self.access_token}"}
+
+    def update(self, response: httpx.Response) -> None:
+        self.access_token = response.json()["access_token"]
+        self.refresh_token = response.cookies.get("refresh_token", self.refresh_token)
+
+
+class LoadTest:
+    def __init__(self, client: httpx.AsyncClient, args: argparse.Namespace):
+        self.client = client
+        self.args = args
+        self.rng = random.Random(args.random_seed)
+        self.mix = parse_mix(args.mix)
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.run_id = uuid.uuid4().hex[:8]
+        self.counter = 0
+        self.upload_body = os.urandom(args.upload_size)
+
+    async def login(self, session: Session) -> httpx.Response:
+        return await self.client.post("/v1/accounts/login", data={
+            "username": session.username, "password": self.args.password, "grant_type": "password",
+        })
+
+    async def open_session(self, index: int) -> Session:
+        session = Session(seed.username(index))
+        response = await self.login(session)
+        response.raise_for_status()
+        session.update(response)
+
+        response = await self.client.post("/v1/models/create", headers=session.headers, json={
+            "name": f"load-{self.run_id}-{index}", "description": "load test upload target", "type": "benchmark",
+        })
+        response.raise_for_status()
+        session.model_id = response.json()["id"]
+        return session
+
+    async def register(self, session: Session) -> httpx.Response:
+        self.counter += 1
+        name = f"lt{self.run_id}{self.counter}"
+        return await self.client.post("/v1/accounts/register", data={
+            "username": name, "email": f"{name}@example.com", "password": self.args.password, "name": name,
+        })
+
+    async def login_random(self, session: Session) -> httpx.Response:
+        return await self.login(Session(seed.username(self.rng.randrange(self.args.users))))
+
+    async def refresh(self, session: Session) -> httpx.Response:
+        response = await self.client.post("/v1/accounts/refresh", json={"refresh_token": session.refresh_token})
+        if response.status_code == 200:
+            session.update(response)
+        return response
+
+    async def me(self, session: Session) -> httpx.Response:
+        return await self.client.get("/v1/accounts/me", headers=session.headers)
+
+    async def models(self, session: Session) -> httpx.Response:
+        pages = max(self.args.models // self.args.per_page, 1)
+        return await self.client.get("/v1/models/", params={
+            "page": self.rng.randint(1, min(pages, self.args.max_page)), "per_page": self.args.per_page,
+        })
+
+    async def upload(self, session: Session) -> httpx.Response:
+        files = {"files": (f"weights-{uuid.uuid4().hex}.bin", self.upload_body, "application/octet-stream")}
+        return await self.client.post("/v1/models/upload", headers=session.headers, files=files,
+                                      data={"model_id": session.model_id})
+
+    async def worker(self, session: Session, deadline: float, budget: List[int]) -> None:
+        scenarios = {
+            "register": self.register, "login": self.login_random, "refresh": self.refresh, "me": self.me,
+            "models": self.models, "upload": self.upload,
+        }
+        names, weights = zip(*self.mix.items())
+
+        while time.monotonic() < deadline and budget[0] > 0:
+            budget[0] -= 1
+            name = self.rng.choices(names, weights)[0]
+            start = time.perf_counter()
+            try:
+                response = await scenarios[name](session)
+                status = str(response.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            self.latencies[name].append(time.perf_counter() - start)
+            self.statuses[name][status] += 1
+
+    async def run(self) -> dict:
+        sessions = await asyncio.gather(*(self.open_session(index) for index in range(self.args.concurrency)))
+
+        budget = [self.args.requests or sys.maxsize]
+        started = time.monotonic()
+        await asyncio.gather(*(self.worker(session, started + self.args.duration, budget) for session in sessions))
+        elapsed = time.monotonic() - started
+
+        scenarios = {name: summarize(latencies, self.statuses[name], elapsed)
+                     for name, latencies in sorted(self.latencies.items())}
+        everything = [latency for latencies in self.latencies.values() for latency in latencies]
+        statuses = defaultdict(int)
+        for counts in self.statuses.values():
+            for status, count in counts.items():
+                statuses[status] += count
+
+        return {"elapsed_seconds": elapsed, "total": summarize(everything, statuses, elapsed), "scenarios": scenarios}
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        weights[name.strip()] = float(weight or 1)
+    return {name: weight for name, weight in weights.items() if weight > 0}
+
+
+def percentile(ordered: List[float], fraction: float) -> float:
+    if not ordered:
+        return 0.0
+    index = min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def summarize(latencies: List[float], statuses: Dict[str, int], elapsed: float) -> dict:
+    ordered = sorted(latencies)
+    return {
+        "requests": len(ordered),
+        "throughput_rps": len(ordered) / elapsed if elapsed else 0.0,
+        "mean_ms": statistics.mean(ordered) * 1000 if ordered else 0.0,
+        "p50_ms": percentile(ordered, 0.50) * 1000,
+        "p95_ms": percentile(ordered, 0.95) * 1000,
+        "p99_ms": percentile(ordered, 0.99) * 1000,
+        "max_ms": ordered[-1] * 1000 if ordered else 0.0,
+        "statuses": dict(statuses),
+    }
+
+
+def spawn_server(args: argparse.Namespace) -> subprocess.Popen:
+    server = subprocess.Popen([
+        sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(args.port),
+        "--workers", str(args.workers), "--log-level", "warning",
+    ])
+
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{args.port}/health").status_code == 200:
+                return server
+        except httpx.HTTPError:
+            pass
+        if server.poll() is not None:
+            raise RuntimeError("the API server exited during startup")
+        time.sleep(0.5)
+
+    server.terminate()
+    raise RuntimeError("the API server did not become healthy within 60 seconds")
+
+
+async def run(args: argparse.Namespace) -> dict:
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=args.timeout) as client:
+        return await LoadTest(client, args).run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8000", help="API to test")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent workers, one session each")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to run")
+    parser.add_argument("--requests", type=int, default=0, help="stop after this many requests (0: no limit)")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="scenario weights, name=weight,...")
+    parser.add_argument("--per-page", type=int, default=20, help="page size of the model listing")
+    parser.add_argument("--max-page", type=int, default=500, help="deepest listing page requested")
+    parser.add_argument("--upload-size", type=int, default=1024 * 1024, help="bytes per uploaded file")
+    parser.add_argument("--timeout", type=float, default=30, help="request timeout in seconds")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    parser.add_argument("--spawn", action="store_true", help="start, seed and stop the API server")
+    parser.add_argument("--port", type=int, default=8765, help="port of the spawned server")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers of the spawned server")
+    seed.add_arguments(parser)
+    args = parser.parse_args()
+
+    server = None
+    seeded = None
+    if args.spawn:
+        server = spawn_server(args)
+        args.base_url = f"http://127.0.0.1:{args.port}"
+        seeded = asyncio.run(seed.seed(args.users, args.models, args.heavy_users, args.tokens_per_user,
+                                       args.password, args.random_seed))
+
+    try:
+        results = asyncio.run(run(args))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    report = {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "params": {key: value for key, value in vars(args).items() if key != "password"},
+        "seed": seeded,
+        **results,
+    }
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+
+    print(f"{'scenario':<10} {'requests':>9} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, result in [*report["scenarios"].items(), ("total", report["total"])]:
+        print(f"{name:<10} {result['requests']:>9} {result['throughput_rps']:>9.1f} {result['p50_ms']:>9.2f} "
+              f"{result['p95_ms']:>9.2f} {result['p99_ms']:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
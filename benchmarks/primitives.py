@@ -0,0 +1,188 @@
+"""
+Micro-benchmarks of the CPU-heavy primitives behind authentication and avatar uploads.
+
+    token.create                    create_access_token
+    token.decode                    decode_access_token
+    refresh.encrypt / .decrypt      encrypt_refresh_token / decrypt_refresh_token
+    refresh.verify[tokens=N]        verify_refresh_token against N stored tokens, matching the last one
+    bcrypt.hash / .verify[rounds=R] the bcrypt CryptContext of get_hashed_password / verify_password, R rounds
+    image.resize[format, size]      generate_image_resolutions for the configured avatar sizes
+
+Each case is warmed up, then timed in --repeat samples of enough calls to last about --min-time seconds. The
+report gives the median, mean, stdev and a 95% confidence interval of the mean per call. With --compare, cases
+whose median got slower than --threshold relative to a previous report are flagged, and the exit status is 1.
+
+    python -m benchmarks.primitives --output before.json
+    python -m benchmarks.primitives --compare before.json
+"""
+import argparse
+import io
+import json
+import math
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import timeit
+import uuid
+from typing import Callable, Dict, List
+
+from passlib.context import CryptContext
+from PIL import Image
+
+from app.config import settings
+from app.v1.accounts import utils
+from benchmarks import git_revision
+
+
+def measure(function: Callable[[], object], repeat: int, min_time: float) -> dict:
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    # autorange aims at 0.2 s per sample; scale to the requested sample length
+    number = max(int(number * min_time / 0.2), 1)
+    timer.timeit(number=max(number // 10, 1))
+
+    samples = [total / number for total in timer.repeat(repeat=repeat, number=number)]
+    mean = statistics.mean(samples)
+    stdev = statistics.stdev(samples) if len(samples) > 1 else 0.0
+    margin = 1.96 * stdev / math.sqrt(len(samples))
+
+    return {
+        "calls_per_sample": number,
+        "samples": len(samples),
+        "min_us": min(samples) * 1e6,
+        "median_us": statistics.median(samples) * 1e6,
+        "mean_us": mean * 1e6,
+        "stdev_us": stdev * 1e6,
+        "ci95_us": [(mean - margin) * 1e6, (mean + margin) * 1e6],
+    }
+
+
+def token_cases() -> Dict[str, Callable[[], object]]:
+    user_id = uuid.uuid4()
+    access_token = utils.create_access_token(user_id, identifier=uuid.uuid4().hex)
+    refresh_token = utils.create_refresh_token(user_id, identifier=uuid.uuid4().hex)
+    encrypted = utils.encrypt_refresh_token(refresh_token)
+
+    return {
+        "token.create": lambda: utils.create_access_token(user_id, identifier="0" * 32),
+        "token.decode": lambda: utils.decode_access_token(access_token),
+        "refresh.encrypt": lambda: utils.encrypt_refresh_token(refresh_token),
+        "refresh.decrypt": lambda: utils.decrypt_refresh_token(encrypted),
+    }
+
+
+def refresh_verify_cases(token_counts: List[int]) -> Dict[str, Callable[[], object]]:
+    cases = {}
+    user_id = uuid.uuid4()
+    for count in token_counts:
+        tokens = [utils.create_refresh_token(user_id, identifier=uuid.uuid4().hex) for _ in range(count)]
+        encrypted = [utils.encrypt_refresh_token(token) for token in tokens]
+        # the worst case, and the common one for a user with many sessions: the match is the last token checked
+        cases[f"refresh.verify[tokens={count}]"] = \
+            lambda given=tokens[-1], stored=encrypted: utils.verify_refresh_token(given, stored)
+    return cases
+
+
+def bcrypt_cases(rounds_list: List[int]) -> Dict[str, Callable[[], object]]:
+    cases = {}
+    for rounds in rounds_list:
+        context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=rounds)
+        hashed = context.hash("correct horse battery staple")
+        cases[f"bcrypt.hash[rounds={rounds}]"] = lambda context=context: context.hash("correct horse battery staple")
+        cases[f"bcrypt.verify[rounds={rounds}]"] = \
+            lambda context=context, hashed=hashed: context.verify("correct horse battery staple", hashed)
+    return cases
+
+
+def image_cases(directory: str, sizes: List[int], formats: List[str]) -> Dict[str, Callable[[], object]]:
+    cases = {}
+    for image_format in formats:
+        extension = {"JPEG": ".jpg", "PNG": ".png", "GIF": ".gif"}[image_format]
+        for size in sizes:
+            path = os.path.join(directory, f"avatar-{size}{extension}")
+            image = Image.effect_noise((size, size), 64).convert("L" if image_format == "GIF" else "RGB")
+            buffer = io.BytesIO()
+            image.save(buffer, image_format)
+            with open(path, "wb") as image_file:
+                image_file.write(buffer.getvalue())
+
+            cases[f"image.resize[{image_format.lower()},{size}x{size}]"] = \
+                lambda path=path: utils.generate_image_resolutions(path, sizes=settings.avatar_sizes)
+    return cases
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> List[str]:
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            print(f"{name:<40} new")
+            continue
+        ratio = result["median_us"] / previous["median_us"]
+        # only a regression when the confidence intervals do not overlap as well
+        flagged = ratio > 1 + threshold and result["ci95_us"][0] > previous["ci95_us"][1]
+        print(f"{name:<40} {previous['median_us']:>12.1f} -> {result['median_us']:>12.1f} us  {ratio:>6.2f}x"
+              f"{'  REGRESSION' if flagged else ''}")
+        if flagged:
+            regressions.append(name)
+    return regressions
+
+
+def int_list(value: str) -> List[int]:
+    return [int(item) for item in value.split(",") if item]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=15, help="timing samples per case")
+    parser.add_argument("--min-time", type=float, default=0.2, help="approximate seconds per sample")
+    parser.add_argument("--tokens", type=int_list, default=[1, 10, 100, 500], help="stored refresh token counts")
+    parser.add_argument("--rounds", type=int_list, default=[10, 12], help="bcrypt rounds")
+    parser.add_argument("--image-sizes", type=int_list, default=[256, 1024, 2048], help="source image sizes")
+    parser.add_argument("--image-formats", default="JPEG,PNG", help="source image formats")
+    parser.add_argument("--only", help="run only cases whose name starts with this prefix")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    parser.add_argument("--compare", help="previous JSON report to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="slowdown flagged as a regression")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="benchmark-images-")
+    try:
+        cases = {
+            **token_cases(),
+            **refresh_verify_cases(args.tokens),
+            **bcrypt_cases(args.rounds),
+            **image_cases(directory, args.image_sizes, args.image_formats.upper().split(",")),
+        }
+
+        results = {}
+        for name, function in cases.items():
+            if args.only and not name.startswith(args.only):
+                continue
+            results[name] = measure(function, args.repeat, args.min_time)
+            if not args.compare:
+                result = results[name]
+                print(f"{name:<40} {result['median_us']:>12.1f} us median  (stdev {result['stdev_us']:.1f}, "
+                      f"{result['samples']} x {result['calls_per_sample']} calls)")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    report = {"revision": git_revision(), "python": platform.python_version(), "params": vars(args),
+              "results": results}
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)["results"]
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
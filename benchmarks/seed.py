@@ -0,0 +1,149 @@
+"""
+Seed Postgres and Redis with a realistic data volume for load tests.
+
+Users are named loaduser<N> (loaduser<N>@example.com) and all share the password given with --password, hashed
+once. Models get random owners, 10% of them private. The first --heavy-users users also get --tokens-per-user
+live access and refresh tokens each, so token verification runs against long lists the way it does for users
+logged in on many devices.
+
+The API drops and recreates its tables on startup, so seed after the server is up:
+
+    python -m benchmarks.seed --users 100000 --models 1000000 --heavy-users 100 --tokens-per-user 300
+"""
+import argparse
+import asyncio
+import datetime
+import random
+import time
+import uuid
+
+import asyncpg
+
+from app.config import settings
+from app.dependencies import cache
+from app.storage.layout import model_dir
+from app.v1.accounts.utils import get_hashed_password, create_access_token, create_refresh_token, \
+    encrypt_refresh_token
+
+BATCH_SIZE = 50_000
+
+MODEL_TYPES = ("text-classification", "token-classification", "text-generation", "image-classification",
+               "object-detection", "summarization")
+
+
+def username(index: int) -> str:
+    return f"loaduser{index}"
+
+
+def user_records(user_ids: list, password_hash: str, start: datetime.datetime):
+    for index, user_id in enumerate(user_ids):
+        created_at = start + datetime.timedelta(seconds=index)
+        yield (user_id, username(index), f"{username(index)}@example.com", password_hash, f"Load User {index}", "",
+               created_at, created_at)
+
+
+def model_records(n_models: int, user_ids: list, rng: random.Random, start: datetime.datetime):
+    for index in range(n_models):
+        owner = rng.randrange(len(user_ids))
+        created_at = start + datetime.timedelta(seconds=index)
+        path = model_dir(username(owner), f"model-{index}")
+        yield (uuid.UUID(int=rng.getrandbits(128), version=4), f"model-{index}", f"Load test model {index}",
+               rng.random() < 0.1, created_at, created_at, path, rng.choice(MODEL_TYPES), user_ids[owner])
+
+
+async def copy_in_batches(connection, table: str, columns: list, records) -> int:
+    total = 0
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == BATCH_SIZE:
+            await connection.copy_records_to_table(table, records=batch, columns=columns)
+            total += len(batch)
+            batch = []
+    if batch:
+        await connection.copy_records_to_table(table, records=batch, columns=columns)
+        total += len(batch)
+    return total
+
+
+def seed_tokens(user_ids: list, tokens_per_user: int) -> int:
+    redis_client = cache()
+    now = int(time.time())
+    access_expire = now + settings.access_token_expire_minutes * 60
+    refresh_expire = now + settings.refresh_token_expire_minutes * 60
+
+    for user_id in user_ids:
+        access_tokens = {}
+        refresh_tokens = {}
+        for _ in range(tokens_per_user):
+            token_id = uuid.uuid4().hex
+            access_tokens[create_access_token(user_id, identifier=token_id)] = access_expire
+            refresh_tokens[encrypt_refresh_token(create_refresh_token(user_id, identifier=token_id))] = refresh_expire
+
+        pipeline = redis_client.pipeline(transaction=False)
+        pipeline.zadd(f"access_tokens:{user_id}", access_tokens)
+        pipeline.zadd(f"refresh_tokens:{user_id}", refresh_tokens)
+        pipeline.execute()
+
+    return len(user_ids) * tokens_per_user
+
+
+async def seed(n_users: int, n_models: int, heavy_users: int, tokens_per_user: int, password: str,
+               random_seed: int = 0) -> dict:
+    rng = random.Random(random_seed)
+    user_ids = [uuid.UUID(int=rng.getrandbits(128), version=4) for _ in range(n_users)]
+    start = datetime.datetime(2023, 1, 1, tzinfo=datetime.timezone.utc)
+    timings = {}
+
+    connection = await asyncpg.connect(settings.sync_database_url)
+    try:
+        began = time.perf_counter()
+        await copy_in_batches(
+            connection, "users",
+            ["id", "username", "email", "password", "name", "avatar", "created_at", "updated_at"],
+            user_records(user_ids, await get_hashed_password(password), start),
+        )
+        timings["users_seconds"] = time.perf_counter() - began
+
+        began = time.perf_counter()
+        await copy_in_batches(
+            connection, "models",
+            ["id", "name", "description", "private", "created_at", "updated_at", "path", "type", "owner_id"],
+            model_records(n_models, user_ids, rng, start),
+        )
+        timings["models_seconds"] = time.perf_counter() - began
+
+        await connection.execute("ANALYZE users")
+        await connection.execute("ANALYZE models")
+    finally:
+        await connection.close()
+
+    began = time.perf_counter()
+    tokens = seed_tokens(user_ids[:heavy_users], tokens_per_user) if tokens_per_user else 0
+    timings["tokens_seconds"] = time.perf_counter() - began
+
+    return {"users": n_users, "models": n_models, "heavy_users": min(heavy_users, n_users),
+            "tokens": tokens, **timings}
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--users", type=int, default=100_000, help="users to create")
+    parser.add_argument("--models", type=int, default=1_000_000, help="models to create")
+    parser.add_argument("--heavy-users", type=int, default=100, help="users given many live tokens")
+    parser.add_argument("--tokens-per-user", type=int, default=300, help="live tokens per heavy user")
+    parser.add_argument("--password", default="password", help="password of every seeded user")
+    parser.add_argument("--random-seed", type=int, default=0, help="seed for ids, owners and flags")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    result = asyncio.run(seed(args.users, args.models, args.heavy_users, args.tokens_per_user, args.password,
+                              args.random_seed))
+    print(result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Compare the old and the new serialization paths of the model listing endpoint.
+
+The old path validates every ORM row into ModelReadWithUser, wraps the page in PaginatedModelResponse and lets
+FastAPI validate and serialize it again through response_model. The new path reads the flat rows returned by
+the column-projected listing query, projects the schema fields without validation and serializes them straight
+to JSON bytes.
+
+    python -m benchmarks.serialization --models 100 --owners 10
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import statistics
+import timeit
+import tracemalloc
+import uuid
+from types import SimpleNamespace
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from app.schemas import PaginationMetadata
+from app.v1.models.schemas import ModelReadWithUser, PaginatedModelResponse
+from app.v1.models.utils import serialize_models_page
+
+
+def make_entities(n_models: int, n_owners: int) -> list:
+    now = datetime.datetime.now(datetime.timezone.utc)
+    owners = [
+        SimpleNamespace(id=uuid.uuid4(), username=f"user{i}", email=f"user{i}@example.com", name=f"User {i}",
+                        avatar=f"media/accounts/avatars/{uuid.uuid4().hex}-avatar.png", github_username=None,
+                        twitter_username=f"user{i}", homepage_url=None, created_at=now)
+        for i in range(n_owners)
+    ]
+    rows = []
+    for i in range(n_models):
+        owner = owners[i % n_owners]
+        rows.append(SimpleNamespace(id=uuid.uuid4(), name=f"model-{i}", description="A model " * 10, private=False,
+                                    created_at=now, path=f"models/{owner.username}/model-{i}", endpoint=None,
+                                    type="text-classification", owner_id=owner.id, owner=owner))
+    return rows
+
+
+def flatten(entities: list) -> list:
+    # the shape of ModelsService.get_all_model_rows results: model columns plus owner__<field> columns
+    rows = []
+    for entity in entities:
+        values = {key: value for key, value in vars(entity).items() if key != "owner"}
+        values.update({f"owner__{key}": value for key, value in vars(entity.owner).items()})
+        rows.append(SimpleNamespace(**values))
+    return rows
+
+
+response_field = create_response_field(name="Response_read_models", type_=PaginatedModelResponse)
+
+
+async def old_path(entities, metadata) -> bytes:
+    models = [ModelReadWithUser.model_validate(entity) for entity in entities]
+    content = PaginatedModelResponse(models=models, metadata=metadata)
+    content = await serialize_response(field=response_field, response_content=content, is_coroutine=True)
+    return JSONResponse(content).body
+
+
+async def new_path(rows, metadata) -> bytes:
+    return serialize_models_page(rows, metadata)
+
+
+def measure(path, rows, metadata, repeat: int, number: int) -> dict:
+    loop = asyncio.new_event_loop()
+    try:
+        timer = timeit.Timer(lambda: loop.run_until_complete(path(rows, metadata)))
+        timings = [total / number for total in timer.repeat(repeat=repeat, number=number)]
+
+        tracemalloc.start()
+        loop.run_until_complete(path(rows, metadata))
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        loop.close()
+
+    return {
+        "min_ms": min(timings) * 1000,
+        "mean_ms": statistics.mean(timings) * 1000,
+        "median_ms": statistics.median(timings) * 1000,
+        "stdev_ms": statistics.stdev(timings) * 1000 if len(timings) > 1 else 0.0,
+        "peak_bytes": peak,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--models", type=int, default=100, help="models per page")
+    parser.add_argument("--owners", type=int, default=10, help="distinct owners on the page")
+    parser.add_argument("--repeat", type=int, default=20, help="timing samples")
+    parser.add_argument("--number", type=int, default=50, help="serializations per timing sample")
+    parser.add_argument("--json", action="store_true", help="print machine-readable output")
+    args = parser.parse_args()
+
+    entities = make_entities(args.models, args.owners)
+    rows = flatten(entities)
+    metadata = PaginationMetadata(total=args.models, page=1, per_page=args.models, total_pages=1)
+
+    old_body = asyncio.run(old_path(entities, metadata))
+    new_body = asyncio.run(new_path(rows, metadata))
+    assert json.loads(old_body) == json.loads(new_body), "serialization paths disagree"
+
+    results = {
+        "params": vars(args),
+        "old": measure(old_path, entities, metadata, args.repeat, args.number),
+        "new": measure(new_path, rows, metadata, args.repeat, args.number),
+    }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    for name in ("old", "new"):
+        result = results[name]
+        print(f"{name}: {result['min_ms']:.3f} ms min, {result['median_ms']:.3f} ms median "
+              f"(stdev {result['stdev_ms']:.3f}), peak {result['peak_bytes']} bytes allocated")
+    print(f"speedup: {results['old']['median_ms'] / results['new']['median_ms']:.1f}x (median)")
+
+
+if __name__ == "__main__":
+    main()
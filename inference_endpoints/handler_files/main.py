@@ -2,7 +2,20 @@ from flask import Flask, request, jsonify
 from handler import EndpointHandler
 from healthcheck import HealthCheck
 # from waitress import serve
+import contextlib
 import logging
+import os
+
+# Tracing is optional: with OpenTelemetry installed and OTEL_EXPORTER_OTLP_ENDPOINT set, each request becomes a
+# span continuing the API's trace from the W3C traceparent header.
+try:
+    from opentelemetry import propagate, trace
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+except ImportError:
+    trace = None
 
 app = Flask(__name__)
 
@@ -16,6 +29,29 @@ logging.basicConfig(level=logging.DEBUG,
 
 logging.info("Starting the application")
 
+tracer = None
+
+if trace is not None and os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT"):
+    provider = TracerProvider(resource=Resource.create({"service.name": os.environ.get("OTEL_SERVICE_NAME",
+                                                                                       "inference_endpoint")}))
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    trace.set_tracer_provider(provider)
+    tracer = trace.get_tracer("inference_endpoint")
+
+
+def traced(name):
+    """
+    Span continuing the trace of the incoming request; when tracing is off, the caller's trace id is still
+    logged so the request can be matched with the API's trace.
+    """
+    if tracer is None:
+        traceparent = request.headers.get("traceparent")
+        if traceparent:
+            app.logger.info(f"traceparent: {traceparent}")
+        return contextlib.nullcontext()
+    return tracer.start_as_current_span(name, context=propagate.extract(request.headers),
+                                        kind=trace.SpanKind.SERVER)
+
 
 def health_check():
     return True, "Hello, World!"
@@ -28,7 +64,8 @@ def root():
     if request.method == "POST":
         if request.is_json:
             input_data = request.get_json()
-            result = handler(input_data)
+            with traced("inference"):
+                result = handler(input_data)
             app.logger.info(f"Received POST request with JSON data: {input_data}")
             return jsonify(result), 200
 
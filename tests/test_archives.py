@@ -0,0 +1,92 @@
+import datetime
+import io
+import tarfile
+import zipfile
+
+import pytest
+
+from app.archives import Archive, ArchiveEntry
+
+MODIFIED = datetime.datetime(2026, 10, 19, 10, 0, 0, tzinfo=datetime.timezone.utc)
+
+CONTENTS = {
+    "a" * 64: b"weights " * 1000,
+    "b" * 64: b"{}",
+    "c" * 64: b"",
+    "d" * 64: bytes(range(256)) * 3,
+}
+
+
+def make_archive(archive_format: str) -> Archive:
+    entries = [
+        ArchiveEntry("model.bin", "a" * 64, len(CONTENTS["a" * 64]), MODIFIED),
+        ArchiveEntry("config.json", "b" * 64, len(CONTENTS["b" * 64]), MODIFIED),
+        ArchiveEntry("empty.txt", "c" * 64, 0, MODIFIED),
+        ArchiveEntry("nested/tokenizer.bin", "d" * 64, len(CONTENTS["d" * 64]), MODIFIED),
+    ]
+
+    def open_entry(entry: ArchiveEntry, offset: int):
+        source = io.BytesIO(CONTENTS[entry.digest])
+        source.seek(offset)
+        return source
+
+    return Archive("m", entries, archive_format, open_entry)
+
+
+def read(archive: Archive, start: int = 0, end=None) -> bytes:
+    return b"".join(archive.iter_bytes(start, end))
+
+
+def test_zip_layout():
+    archive = make_archive("zip")
+    data = read(archive)
+    assert len(data) == archive.size
+
+    with zipfile.ZipFile(io.BytesIO(data)) as zip_file:
+        assert zip_file.testzip() is None
+        infos = zip_file.infolist()
+        assert [info.filename for info in infos] == ["m/model.bin", "m/config.json", "m/empty.txt",
+                                                     "m/nested/tokenizer.bin"]
+        assert all(info.compress_type == zipfile.ZIP_STORED for info in infos)
+        for info, content in zip(infos, CONTENTS.values()):
+            assert zip_file.read(info) == content
+            assert info.date_time == (2026, 10, 19, 10, 0, 0)
+
+
+def test_tar_layout():
+    archive = make_archive("tar")
+    data = read(archive)
+    assert len(data) == archive.size
+    assert archive.size % tarfile.BLOCKSIZE == 0
+
+    with tarfile.open(fileobj=io.BytesIO(data)) as tar_file:
+        members = tar_file.getmembers()
+        assert [member.name for member in members] == ["m/model.bin", "m/config.json", "m/empty.txt",
+                                                       "m/nested/tokenizer.bin"]
+        for member, content in zip(members, CONTENTS.values()):
+            assert tar_file.extractfile(member).read() == content
+            assert member.mtime == int(MODIFIED.timestamp())
+
+
+@pytest.mark.parametrize("archive_format", ["zip", "tar"])
+def test_resume(archive_format):
+    archive = make_archive(archive_format)
+    data = read(archive)
+
+    # every offset a download may stop at: inside headers, file content, descriptors and the central directory
+    for start in range(0, archive.size, 97):
+        assert read(archive, start) == data[start:]
+
+
+@pytest.mark.parametrize("archive_format", ["zip", "tar"])
+def test_ranges(archive_format):
+    archive = make_archive(archive_format)
+    data = read(archive)
+
+    for start, end in [(0, 0), (0, 29), (100, 8100), (archive.size - 30, archive.size - 1), (5, archive.size - 1)]:
+        assert read(archive, start, end) == data[start:end + 1]
+
+
+def test_etag():
+    assert make_archive("zip").etag == make_archive("zip").etag
+    assert make_archive("zip").etag != make_archive("tar").etag
@@ -0,0 +1,67 @@
+import pytest
+from starlette.requests import Request
+
+from app.exceptions import RangeNotSatisfiableException
+from app.files import parse_range, requested_range
+
+ETAG = '"3bfc2695"'
+LAST_MODIFIED = "Mon, 19 Oct 2026 10:00:00 GMT"
+
+
+def make_request(**headers) -> Request:
+    raw_headers = [(name.replace("_", "-").encode("latin-1"), value.encode("latin-1"))
+                   for name, value in headers.items()]
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": raw_headers})
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("bytes=0-99", (0, 99)),
+    ("bytes=10-", (10, 999)),
+    ("bytes=990-2000", (990, 999)),
+    ("bytes=-100", (900, 999)),
+    ("bytes=-5000", (0, 999)),
+    ("bytes=999-999", (999, 999)),
+    ("BYTES = 5-6", (5, 6)),
+])
+def test_parse_range(value, expected):
+    assert parse_range(value, 1000) == expected
+
+
+@pytest.mark.parametrize("value", [
+    "items=0-99",
+    "bytes=0-9,20-29",
+    "bytes=abc",
+    "bytes=a-b",
+    "bytes=50-10",
+])
+def test_parse_range_ignores(value):
+    assert parse_range(value, 1000) is None
+
+
+@pytest.mark.parametrize("value", ["bytes=1000-", "bytes=1000-1200", "bytes=-0"])
+def test_parse_range_unsatisfiable(value):
+    with pytest.raises(RangeNotSatisfiableException) as exc_info:
+        parse_range(value, 1000)
+    assert exc_info.value.status_code == 416
+    assert exc_info.value.headers["Content-Range"] == "bytes */1000"
+
+
+def test_requested_range():
+    assert requested_range(make_request(range="bytes=0-9"), 1000, ETAG) == (0, 9)
+    assert requested_range(make_request(), 1000, ETAG) is None
+    assert requested_range(make_request(range="bytes=0-9"), 0, ETAG) is None
+
+
+def test_requested_range_if_range_etag():
+    assert requested_range(make_request(range="bytes=0-9", if_range=ETAG), 1000, ETAG) == (0, 9)
+    assert requested_range(make_request(range="bytes=0-9", if_range='"other"'), 1000, ETAG) is None
+    # weak validators never match If-Range
+    assert requested_range(make_request(range="bytes=0-9", if_range=f"W/{ETAG}"), 1000, ETAG) is None
+    assert requested_range(make_request(range="bytes=0-9", if_range=f"W/{ETAG}"), 1000, f"W/{ETAG}") is None
+
+
+def test_requested_range_if_range_date():
+    request = make_request(range="bytes=0-9", if_range=LAST_MODIFIED)
+    assert requested_range(request, 1000, ETAG, LAST_MODIFIED) == (0, 9)
+    assert requested_range(request, 1000, ETAG, "Tue, 20 Oct 2026 10:00:00 GMT") is None
+    assert requested_range(request, 1000, ETAG) is None
@@ -0,0 +1,84 @@
+import fakeredis
+import pytest
+
+from app.jobs.queue import JOBS, JobDefinition, JobQueue
+
+QUEUE = "tests"
+
+
+@pytest.fixture
+def queue(monkeypatch):
+    monkeypatch.setitem(JOBS, "noop", JobDefinition("noop", lambda: None, QUEUE, 3))
+
+    job_queue = JobQueue(fakeredis.FakeRedis(), prefix="jobs")
+    job_queue.ensure_group(QUEUE)
+    # retries are due at once
+    monkeypatch.setattr(job_queue, "backoff", lambda attempts: 0)
+    return job_queue
+
+
+def test_enqueue_and_read(queue):
+    job_id = queue.enqueue("noop", {"key": "a"})
+
+    read = queue.read(QUEUE, "worker", block=0.01)
+    assert read.id == job_id
+    assert read.name == "noop"
+    assert read.kwargs == {"key": "a"}
+    assert read.attempts == 0
+    assert read.max_attempts == 3
+
+    queue.ack(QUEUE, read)
+    assert queue.redis_client.xlen(queue.stream_key(QUEUE)) == 0
+
+
+def test_enqueue_idempotent(queue):
+    first = queue.enqueue("noop", {"key": "a"}, idempotency_key="a")
+    second = queue.enqueue("noop", {"key": "a"}, idempotency_key="a")
+    other = queue.enqueue("noop", {"key": "b"}, idempotency_key="b")
+
+    assert first == second
+    assert other != first
+    assert queue.redis_client.xlen(queue.stream_key(QUEUE)) == 2
+    assert queue.read(QUEUE, "worker", block=0.01).id == first
+
+
+def test_enqueue_idempotent_delayed(queue):
+    first = queue.enqueue("noop", idempotency_key="a", delay=60)
+    assert queue.enqueue("noop", idempotency_key="a", delay=60) == first
+    assert queue.redis_client.zcard(queue.delayed_key(QUEUE)) == 1
+    assert queue.redis_client.xlen(queue.stream_key(QUEUE)) == 0
+
+
+def test_retry(queue):
+    job_id = queue.enqueue("noop")
+    read = queue.read(QUEUE, "worker", block=0.01)
+
+    assert queue.retry(QUEUE, read, "boom") == 0
+    assert queue.redis_client.xlen(queue.stream_key(QUEUE)) == 0
+    assert queue.promote_due(QUEUE) == 1
+
+    retried = queue.read(QUEUE, "worker", block=0.01)
+    assert retried.id == job_id
+    assert retried.attempts == 1
+    assert retried.fields["last_error"] == "boom"
+
+
+def test_retry_dead_letters_after_max_attempts(queue):
+    queue.enqueue("noop", idempotency_key="a")
+
+    for _ in range(2):
+        read = queue.read(QUEUE, "worker", block=0.01)
+        assert queue.retry(QUEUE, read, "boom") is not None
+        queue.promote_due(QUEUE)
+
+    read = queue.read(QUEUE, "worker", block=0.01)
+    assert read.attempts == 2
+    assert queue.retry(QUEUE, read, "boom") is None
+
+    dead = queue.redis_client.xrange(queue.dead_key(QUEUE))
+    assert len(dead) == 1
+    assert dead[0][1][b"last_error"] == b"boom"
+    assert queue.redis_client.xlen(queue.stream_key(QUEUE)) == 0
+    # the same work can be enqueued again
+    assert not queue.redis_client.exists(queue.idempotency_key("a"))
+    assert queue.enqueue("noop", idempotency_key="a") != read.id
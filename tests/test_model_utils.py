@@ -0,0 +1,30 @@
+import pytest
+
+from app.v1.models.utils import normalize_file_path
+
+
+@pytest.mark.parametrize("path, expected", [
+    ("model.bin", "model.bin"),
+    ("weights/model.bin", "weights/model.bin"),
+    ("weights//model.bin", "weights/model.bin"),
+    ("./weights/./model.bin", "weights/model.bin"),
+    ("weights/../model.bin", "model.bin"),
+    ("weights\\model.bin", "weights/model.bin"),
+])
+def test_normalize_file_path(path, expected):
+    assert normalize_file_path(path) == expected
+
+
+@pytest.mark.parametrize("path", [
+    None,
+    "",
+    ".",
+    "..",
+    "../model.bin",
+    "weights/../../model.bin",
+    "/etc/passwd",
+    "..\\..\\model.bin",
+    "\\model.bin",
+])
+def test_normalize_file_path_rejects(path):
+    assert normalize_file_path(path) is None
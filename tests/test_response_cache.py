@@ -0,0 +1,67 @@
+import asyncio
+
+import fakeredis
+import pytest
+
+from app.response_cache import CACHE_HIT, CACHE_MISS, CachedResponse, ResponseCache
+
+
+@pytest.fixture
+def cache() -> ResponseCache:
+    return ResponseCache(fakeredis.FakeRedis(), namespace="test", ttl=60, lock_timeout=5)
+
+
+def test_normalize_params():
+    assert ResponseCache.normalize_params({"b": 2, "a": "x", "c": None, "d": True}) == "a=x&b=2&d=1"
+
+
+def test_invalidate_changes_keys(cache):
+    key = cache.build_key("models:detail", {"model_name": "m"}, ["model:alice/m", "models"])
+    assert cache.build_key("models:detail", {"model_name": "m"}, ["models", "model:alice/m"]) == key
+
+    cache.set(key, CachedResponse(b"{}", {"ETag": '"1"'}))
+    assert cache.get(key) == CachedResponse(b"{}", {"ETag": '"1"'})
+
+    cache.invalidate("model:alice/m")
+    new_key = cache.build_key("models:detail", {"model_name": "m"}, ["model:alice/m", "models"])
+    assert new_key != key
+    assert cache.get(new_key) is None
+
+
+def test_invalidate_only_affects_its_tags(cache):
+    key = cache.build_key("users:detail", {"username": "bob"}, ["user:bob"])
+    cache.invalidate("user:alice")
+    assert cache.build_key("users:detail", {"username": "bob"}, ["user:bob"]) == key
+
+
+def test_get_or_set(cache):
+    calls = []
+
+    async def producer():
+        calls.append(1)
+        return CachedResponse(b"body", {"ETag": '"1"'})
+
+    async def run():
+        first = await cache.get_or_set("models:list", {"page": 1}, ["models"], producer)
+        second = await cache.get_or_set("models:list", {"page": 1}, ["models"], producer)
+        cache.invalidate("models")
+        third = await cache.get_or_set("models:list", {"page": 1}, ["models"], producer)
+        return first, second, third
+
+    first, second, third = asyncio.run(run())
+    assert first == (CachedResponse(b"body", {"ETag": '"1"'}), CACHE_MISS)
+    assert second == (CachedResponse(b"body", {"ETag": '"1"'}), CACHE_HIT)
+    assert third[1] == CACHE_MISS
+    assert len(calls) == 2
+
+
+def test_get_or_set_not_cached(cache):
+    async def producer():
+        return None
+
+    async def run():
+        return [await cache.get_or_set("models:list", {}, ["models"], producer) for _ in range(2)]
+
+    assert asyncio.run(run()) == [(None, CACHE_MISS), (None, CACHE_MISS)]
+    # the fill lock is released
+    assert not cache.redis_client.keys("test:models:list:*:lock")
@@ -0,0 +1,41 @@
+import base64
+import datetime
+import uuid
+
+import pytest
+
+from app.utils import decode_cursor, encode_cursor, parse_uuid
+
+
+def test_cursor_round_trip():
+    created_at = datetime.datetime(2026, 10, 19, 10, 0, 0, 123456, tzinfo=datetime.timezone.utc)
+    user_id = uuid.uuid4()
+
+    cursor = encode_cursor(created_at, user_id)
+
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == [created_at.isoformat(), str(user_id)]
+    assert datetime.datetime.fromisoformat(decode_cursor(cursor)[0]) == created_at
+
+
+def test_cursor_is_url_safe():
+    cursor = encode_cursor("?>?>?>")
+    assert "+" not in cursor and "/" not in cursor
+    assert decode_cursor(cursor) == ["?>?>?>"]
+
+
+@pytest.mark.parametrize("cursor", [
+    "not a cursor",
+    "!!!",
+    base64.urlsafe_b64encode(b"{broken").decode("ascii"),
+    base64.urlsafe_b64encode(b'{"created_at": 1}').decode("ascii"),
+])
+def test_decode_invalid_cursor(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+def test_parse_uuid():
+    user_id = uuid.uuid4()
+    assert parse_uuid(str(user_id)) == user_id
+    assert parse_uuid("alice") is None